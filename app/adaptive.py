@@ -0,0 +1,94 @@
+# adaptive.py
+"""Adaptive check intervals: quick retries on failure, slower checks when stable.
+
+With ``MONITOR_ADAPTIVE`` on, a failed check is retried after
+``RETRY_INTERVAL`` instead of a full interval, until enough consecutive
+failures have been seen to alert. Services that have been up for
+``STABLE_AFTER`` checks in a row have their interval doubled, and doubled
+again after as many more, up to ``MAX_STRETCH`` times. Retries are extra
+probes, so they only run while the ``PROBE_BUDGET`` has room once every
+scheduled check has taken its share.
+"""
+import os
+import time
+
+from .metrics import Counter
+
+ADAPTIVE_INTERVALS = os.environ.get('MONITOR_ADAPTIVE', '').lower() in ('1', 'true', 'yes')
+RETRY_INTERVAL = float(os.environ.get('MONITOR_RETRY_INTERVAL', '10'))
+# Consecutive up checks before an interval is stretched; 0 never stretches
+STABLE_AFTER = int(os.environ.get('MONITOR_STABLE_AFTER', '0'))
+MAX_STRETCH = float(os.environ.get('MONITOR_MAX_STRETCH', '4'))
+# Probes per second for each worker; 0 leaves retries unlimited
+PROBE_BUDGET = float(os.environ.get('MONITOR_PROBE_BUDGET', '0'))
+# Seconds of budget that may be saved up for a burst of retries
+PROBE_BUDGET_BURST = 10.0
+
+_retries = Counter(
+    'monitor_adaptive_retries',
+    'Confirmation retries after a failed check, by whether the probe budget allowed them.',
+    ('outcome',),
+)
+RETRIES_SCHEDULED = _retries.labels('scheduled')
+RETRIES_OVER_BUDGET = _retries.labels('over_budget')
+
+
+class ProbeBudget:
+    """A token bucket that every probe draws from.
+
+    Scheduled checks always run and simply use up tokens; a retry is only
+    scheduled while one is left, so retries fill the capacity the regular
+    schedule leaves idle.
+    """
+
+    def __init__(self, rate: float = PROBE_BUDGET, burst: float = PROBE_BUDGET_BURST):
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def spend(self):
+        if self.rate:
+            self._refill()
+            self.tokens = max(0.0, self.tokens - 1)
+
+    def has_room(self) -> bool:
+        if not self.rate:
+            return True
+        self._refill()
+        return self.tokens >= 1
+
+
+probe_budget = ProbeBudget()
+
+
+def stretched_interval(interval: float, up_streak: int) -> float:
+    """``interval`` lengthened for a service up for ``up_streak`` checks in a row."""
+    if not ADAPTIVE_INTERVALS or not STABLE_AFTER or up_streak < STABLE_AFTER:
+        return interval
+    return interval * min(MAX_STRETCH, 2 ** (up_streak // STABLE_AFTER))
+
+
+def retry_delay(interval: float, min_interval: float) -> float:
+    """Seconds until a retry, never below ``min_interval`` nor above ``interval``."""
+    return min(interval, max(RETRY_INTERVAL, min_interval))
+
+
+def should_retry(failures: int, threshold: int) -> bool:
+    """Whether to retry after ``failures`` consecutive failed checks.
+
+    Retries stop once the threshold is reached and the alert has been
+    decided, or when the budget has no room for another probe.
+    """
+    if not ADAPTIVE_INTERVALS or failures >= max(threshold or 1, 1):
+        return False
+    if not probe_budget.has_room():
+        RETRIES_OVER_BUDGET.inc()
+        return False
+    RETRIES_SCHEDULED.inc()
+    return True
@@ -0,0 +1,161 @@
+# agent.py
+"""Standalone probe agent.
+
+    python -m app.agent --server http://monitor:3009
+
+Leases due services from the server, checks them with the same code the
+server uses, and uploads results in gzip-compressed batches. Run the
+server with MONITOR_REMOTE_PROBES=1 so it leaves checks to agents; any
+number of agents, on one host or many, share the work.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import socket
+import time
+from typing import List, Optional
+
+import aiohttp
+
+from .database import now_ms
+from .monitor import MIN_CHECK_INTERVAL, PROBE_REUSE_WINDOW, shared_check, close_http_session, close_pinger
+
+AGENT_SERVER = os.environ.get('MONITOR_AGENT_SERVER', 'http://127.0.0.1:3009')
+AGENT_TOKEN = os.environ.get('MONITOR_AGENT_TOKEN', '')
+AGENT_CONCURRENCY = int(os.environ.get('MONITOR_AGENT_CONCURRENCY', '200'))
+AGENT_BATCH_SIZE = int(os.environ.get('MONITOR_AGENT_BATCH_SIZE', '500'))
+AGENT_FLUSH_INTERVAL = float(os.environ.get('MONITOR_AGENT_FLUSH_INTERVAL', '1'))
+AGENT_POLL_INTERVAL = 0.5
+# Results kept while the server is unreachable; the oldest are dropped first.
+AGENT_MAX_PENDING = 50_000
+
+
+class ProbeAgent:
+    """Pulls due services, checks them concurrently and pushes results back."""
+
+    def __init__(self, server: str, agent_id: str, concurrency: int = AGENT_CONCURRENCY,
+                 batch_size: int = AGENT_BATCH_SIZE, flush_interval: float = AGENT_FLUSH_INTERVAL,
+                 token: str = AGENT_TOKEN):
+        self._server = server.rstrip('/')
+        self.agent_id = agent_id
+        self._concurrency = concurrency
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._headers = {'X-Agent-Token': token} if token else {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._in_flight: set = set()
+        self._results: List[list] = []
+        self._flushed_at = time.monotonic()
+
+        self.checks = 0
+        self.uploaded = 0
+        self.dropped = 0
+        self.errors = 0
+
+    async def run(self):
+        self._session = aiohttp.ClientSession(
+            headers=self._headers, timeout=aiohttp.ClientTimeout(total=30)
+        )
+        try:
+            while True:
+                leased = []
+                capacity = self._concurrency - len(self._in_flight)
+                if capacity > 0:
+                    leased = await self._lease(capacity)
+                for service in leased:
+                    task = asyncio.create_task(self._probe(service))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+
+                if self._results and (len(self._results) >= self._batch_size or
+                                      time.monotonic() - self._flushed_at >= self._flush_interval):
+                    await self._upload()
+                if len(self._in_flight) >= self._concurrency:
+                    # Full: lease again as soon as a check finishes
+                    await asyncio.wait(self._in_flight, timeout=AGENT_POLL_INTERVAL,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                elif not leased:
+                    await asyncio.sleep(AGENT_POLL_INTERVAL)
+        finally:
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+            if self._results:
+                await self._upload()
+            await self._session.close()
+
+    async def _lease(self, capacity: int) -> List[dict]:
+        try:
+            async with self._session.post(
+                f'{self._server}/api/agents/lease',
+                json={'agent_id': self.agent_id, 'max_services': capacity},
+            ) as response:
+                response.raise_for_status()
+                return (await response.json())['services']
+        except Exception as e:
+            self.errors += 1
+            print(f"Lease failed: {str(e)}")
+            return []
+
+    async def _probe(self, service: dict):
+        try:
+            # Services sharing a target are often leased together; probe it once
+            status, response_time, details = await shared_check(
+                service['type'], service['target'], min(PROBE_REUSE_WINDOW, MIN_CHECK_INTERVAL / 2)
+            )
+        except Exception as e:
+            status, response_time, details = False, None, {'error': str(e)}
+        self.checks += 1
+        self._results.append([service['id'], now_ms(), bool(status), response_time, details])
+
+    async def _upload(self):
+        batch = self._results[:self._batch_size]
+        body = gzip.compress(json.dumps({'results': batch}).encode())
+        self._flushed_at = time.monotonic()
+        try:
+            async with self._session.post(
+                f'{self._server}/api/agents/{self.agent_id}/results',
+                data=body,
+                headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+            ) as response:
+                response.raise_for_status()
+        except Exception as e:
+            self.errors += 1
+            print(f"Upload of {len(batch)} results failed: {str(e)}")
+            overflow = len(self._results) - AGENT_MAX_PENDING
+            if overflow > 0:
+                del self._results[:overflow]
+                self.dropped += overflow
+            return
+        del self._results[:len(batch)]
+        self.uploaded += len(batch)
+
+
+async def run_agent(agent: ProbeAgent):
+    try:
+        await agent.run()
+    finally:
+        await close_http_session()
+        close_pinger()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run checks for a monitor server.')
+    parser.add_argument('--server', default=AGENT_SERVER)
+    parser.add_argument('--id', default=f'{socket.gethostname()}:{os.getpid()}')
+    parser.add_argument('--concurrency', type=int, default=AGENT_CONCURRENCY)
+    parser.add_argument('--batch-size', type=int, default=AGENT_BATCH_SIZE)
+    parser.add_argument('--flush-interval', type=float, default=AGENT_FLUSH_INTERVAL)
+    args = parser.parse_args()
+
+    agent = ProbeAgent(args.server, args.id, args.concurrency, args.batch_size, args.flush_interval)
+    print(f"Probe agent {agent.agent_id} polling {args.server}")
+    try:
+        asyncio.run(run_agent(agent))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
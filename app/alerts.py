@@ -0,0 +1,321 @@
+# alerts.py
+import asyncio
+import os
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.utils import formatdate
+from typing import Any, Dict, List, Optional, Tuple
+
+from .database import db_session
+from .metrics import Counter, Histogram
+from .writer import write, INSERT_ERROR_SQL
+
+# Seconds to collect alerts before mailing each recipient one digest;
+# 0 sends every alert on its own as soon as possible.
+ALERT_DIGEST_WINDOW = float(os.environ.get('MONITOR_ALERT_DIGEST_WINDOW', '0'))
+ALERT_MAX_ATTEMPTS = int(os.environ.get('MONITOR_ALERT_MAX_ATTEMPTS', '5'))
+ALERT_RETRY_BASE = float(os.environ.get('MONITOR_ALERT_RETRY_BASE', '2'))
+ALERT_QUEUE_SIZE = 10000
+SMTP_IDLE_TIMEOUT = 60.0
+SMTP_TIMEOUT = 10
+SMTP_CONFIG_TTL = 60.0
+
+SEND_SECONDS = Histogram(
+    'monitor_alert_send_seconds',
+    'Time to hand one alert email to the SMTP server.',
+).labels()
+_deliveries = Counter(
+    'monitor_alert_deliveries',
+    'Alert emails by outcome; failed means every retry was used up.',
+    ('result',),
+)
+ALERTS_SENT = _deliveries.labels('sent')
+ALERTS_RETRIED = _deliveries.labels('retried')
+ALERTS_FAILED = _deliveries.labels('failed')
+ALERTS_DROPPED = _deliveries.labels('dropped')
+
+_smtp_config: Optional[Dict[str, Any]] = None
+_smtp_config_loaded_at = 0.0
+
+
+def _clean(value: str) -> str:
+    return value.strip().encode('ascii', 'ignore').decode()
+
+
+def _read_smtp_config(conn):
+    return conn.execute(
+        "SELECT host, port, username, password, from_email, use_tls FROM smtp_config"
+    ).fetchone()
+
+
+def load_smtp_config(conn=None) -> Optional[Dict[str, Any]]:
+    """Return the SMTP settings, re-reading the database at most once a minute.
+
+    ``POST /smtp`` calls ``invalidate_smtp_config()`` so changes made through
+    this process apply immediately; the TTL covers other workers. Reads use
+    ``conn`` when given, so this can run through ``run_db``.
+    """
+    global _smtp_config, _smtp_config_loaded_at
+    if _smtp_config_loaded_at and time.monotonic() - _smtp_config_loaded_at < SMTP_CONFIG_TTL:
+        return _smtp_config
+
+    if conn is None:
+        with db_session() as conn:
+            config = _read_smtp_config(conn)
+    else:
+        config = _read_smtp_config(conn)
+
+    _smtp_config = None
+    if config:
+        _smtp_config = {
+            'host': _clean(config[0]),
+            'port': config[1],
+            'username': _clean(config[2]),
+            'password': _clean(config[3]),
+            'from_email': _clean(config[4]),
+            'use_tls': bool(config[5]),
+        }
+    _smtp_config_loaded_at = time.monotonic()
+    return _smtp_config
+
+
+def invalidate_smtp_config():
+    global _smtp_config_loaded_at
+    _smtp_config_loaded_at = 0.0
+
+
+def open_smtp(config: Dict[str, Any]) -> smtplib.SMTP:
+    server = smtplib.SMTP(config['host'], config['port'], timeout=SMTP_TIMEOUT)
+    try:
+        if config['use_tls']:
+            server.starttls()
+        if config['username'] and config['password']:
+            server.login(config['username'], config['password'])
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def build_message(config: Dict[str, Any], email: str, alerts: List[Tuple[str, str, datetime]]) -> MIMEText:
+    """One email for ``email`` covering every ``(service_name, status, time)`` alert."""
+    if len(alerts) == 1:
+        service_name, status, when = alerts[0]
+        subject = f"Service Alert: {service_name} is {status.upper()}"
+        body = f"""
+Service: {service_name}
+Status: {status.upper()}
+Time: {when.strftime('%Y-%m-%d %H:%M:%S')}
+"""
+    else:
+        down = sum(1 for _, status, _ in alerts if status == 'down')
+        subject = f"Service Alert: {len(alerts)} status changes ({down} down)"
+        lines = [
+            f"{when.strftime('%Y-%m-%d %H:%M:%S')}  {status.upper():<5} {service_name}"
+            for service_name, status, when in alerts
+        ]
+        body = "\n" + "\n".join(lines) + "\n"
+
+    msg = MIMEText(body, 'plain', 'utf-8')
+    msg['Subject'] = subject
+    msg['From'] = config['from_email']
+    msg['To'] = email
+    msg['Date'] = formatdate(localtime=True)
+    return msg
+
+
+class AlertDispatcher:
+    """Sends alert emails from a queue so the monitor never waits on SMTP.
+
+    Messages go out over one authenticated SMTP session that is reused
+    until it idles out, fails or the configuration changes; all SMTP I/O
+    runs on a single dedicated thread. Failed sends are re-queued with
+    exponential backoff. With a digest window, alerts are grouped per
+    recipient and each recipient gets one email per window.
+    """
+
+    def __init__(self, digest_window: float = ALERT_DIGEST_WINDOW):
+        self._digest_window = digest_window
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=ALERT_QUEUE_SIZE)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smtp')
+        self._task: Optional[asyncio.Task] = None
+        self._retries: set = set()
+        self._server: Optional[smtplib.SMTP] = None
+        self._server_key: Optional[Tuple] = None
+        self._server_used_at = 0.0
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.last_send_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close_server)
+        self._executor.shutdown(wait=True)
+
+    def enqueue(self, email: str, service_name: str, status: str):
+        try:
+            self._queue.put_nowait((email, [(service_name, status, datetime.now())], 1))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            ALERTS_DROPPED.inc()
+            print(f"Alert dropped, queue full: {service_name} is {status}")
+
+    async def _run(self):
+        while True:
+            items = [await self._queue.get()]
+            if self._digest_window:
+                await asyncio.sleep(self._digest_window)
+            while not self._queue.empty():
+                items.append(self._queue.get_nowait())
+
+            for email, alerts, attempt in self._group(items):
+                await self._deliver(email, alerts, attempt)
+
+    def _group(self, items):
+        if not self._digest_window:
+            return items
+        # Retries keep their own attempt count; fresh alerts merge per recipient.
+        grouped: Dict[str, List] = {}
+        retries = []
+        for email, alerts, attempt in items:
+            if attempt > 1:
+                retries.append((email, alerts, attempt))
+            else:
+                grouped.setdefault(email, []).extend(alerts)
+        return retries + [(email, alerts, 1) for email, alerts in grouped.items()]
+
+    async def _deliver(self, email: str, alerts: List, attempt: int):
+        loop = asyncio.get_running_loop()
+        try:
+            config = await loop.run_in_executor(self._executor, load_smtp_config)
+            if not config:
+                print("Alert not sent: SMTP not configured")
+                return
+            msg = build_message(config, email, alerts)
+            started = time.perf_counter()
+            await loop.run_in_executor(self._executor, self._send, config, msg)
+            self.last_send_seconds = time.perf_counter() - started
+            self.sent += 1
+            SEND_SECONDS.observe(self.last_send_seconds)
+            ALERTS_SENT.inc()
+            for service_name, status, _ in alerts:
+                print(f"Alert sent to {email}: {service_name} is {status}")
+        except Exception as e:
+            if attempt < ALERT_MAX_ATTEMPTS:
+                self.retried += 1
+                ALERTS_RETRIED.inc()
+                delay = ALERT_RETRY_BASE ** attempt
+                handle = loop.call_later(delay, self._requeue, (email, alerts, attempt + 1))
+                self._retries.add(handle)
+                return
+            self.failed += 1
+            ALERTS_FAILED.inc()
+            print(f"Failed to send alert: {str(e)}")
+            await write(INSERT_ERROR_SQL, (datetime.now().isoformat(), f"SMTP Error: {str(e)}"))
+
+    def _requeue(self, item):
+        now = asyncio.get_running_loop().time()
+        self._retries = {handle for handle in self._retries if handle.when() > now}
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            ALERTS_DROPPED.inc()
+
+    def _send(self, config: Dict[str, Any], msg: MIMEText):
+        key = tuple(sorted(config.items()))
+        if (self._server is not None and
+                (key != self._server_key or time.monotonic() - self._server_used_at > SMTP_IDLE_TIMEOUT)):
+            self._close_server()
+        if self._server is None:
+            self._server = open_smtp(config)
+            self._server_key = key
+        try:
+            self._server.send_message(msg)
+        except Exception:
+            # The session may be dead; the retry starts from a new one.
+            self._close_server()
+            raise
+        self._server_used_at = time.monotonic()
+
+    def _close_server(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+            self._server_key = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_size': self._queue.qsize(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'dropped': self.dropped,
+            'last_send_seconds': self.last_send_seconds,
+        }
+
+
+dispatcher: Optional[AlertDispatcher] = None
+
+
+async def start_alerts():
+    global dispatcher
+    if dispatcher is None or not dispatcher.running:
+        dispatcher = AlertDispatcher()
+        dispatcher.start()
+
+
+async def stop_alerts():
+    global dispatcher
+    if dispatcher is not None:
+        await dispatcher.stop()
+        dispatcher = None
+
+
+async def send_alert(email: str, service_name: str, status: str):
+    """Queue an alert email; delivery happens in the background."""
+    if dispatcher is None or not dispatcher.running:
+        await start_alerts()
+    dispatcher.enqueue(email, service_name, status)
+
+
+def get_alert_stats() -> Dict[str, Any]:
+    return dispatcher.stats() if dispatcher else {}
+
+
+def send_test_email(config: Dict[str, Any]):
+    """Blocking: send a test message over a fresh session so config errors surface."""
+    server = open_smtp(config)
+    try:
+        msg = MIMEText("Test email", 'plain', 'utf-8')
+        msg['Subject'] = 'Test Alert'
+        msg['From'] = config['from_email']
+        msg['To'] = config['from_email']
+        server.send_message(msg)
+    finally:
+        try:
+            server.quit()
+        except Exception:
+            server.close()
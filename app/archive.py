@@ -0,0 +1,289 @@
+# archive.py
+"""Cold storage for raw checks in compressed, append-only segment files.
+
+Under ``ARCHIVE_DIR`` each UTC day gets a directory holding one segment and
+one index per shard (``service_id % ARCHIVE_SHARDS``)::
+
+    2026-01-31/checks-03.seg
+    2026-01-31/checks-03.idx
+
+A segment is a run of zlib-compressed blocks, each holding one service's
+checks for that day; the index has one fixed-size ``INDEX_ENTRY`` per
+block. Blocks are synced before their index entries, and rows leave SQLite
+only after both, so a crash leaves at worst an unreferenced block or rows
+present in both places, which readers drop by check id.
+"""
+import asyncio
+import math
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from .database import get_db
+from .series import pack_array, unpack_array
+
+DAY_MS = 86_400_000
+
+# Empty disables archiving: retention deletes old raw checks instead.
+ARCHIVE_DIR = os.environ.get('MONITOR_ARCHIVE_DIR', '')
+ARCHIVE_SHARDS = int(os.environ.get('MONITOR_ARCHIVE_SHARDS', '16'))
+# Rows moved per executor call; the loop yields between calls.
+ARCHIVE_BATCH_ROWS = 20_000
+ARCHIVE_PAUSE = 0.05
+ARCHIVE_COMPRESSION = 6
+
+# service_id, first timestamp, last timestamp, offset, length, row count
+INDEX_ENTRY = struct.Struct('<qqqQII')
+BLOCK_HEADER = struct.Struct('<I')
+INDEX_CACHE_ENTRIES = 256
+
+_index_cache: 'OrderedDict[str, Tuple[int, List[tuple]]]' = OrderedDict()
+
+archive_stats = {'rows_archived': 0, 'blocks_written': 0, 'blocks_read': 0}
+
+
+def archive_enabled() -> bool:
+    return bool(ARCHIVE_DIR)
+
+
+def _segment_paths(day_start: int, shard: int) -> Tuple[str, str]:
+    day = datetime.fromtimestamp(day_start / 1000, timezone.utc).strftime('%Y-%m-%d')
+    base = os.path.join(ARCHIVE_DIR, day, f'checks-{shard:02d}')
+    return base + '.seg', base + '.idx'
+
+
+def encode_block(rows: List[tuple]) -> bytes:
+    """Compress ``(id, timestamp, status, response_time, details)`` rows column by column."""
+    ids, timestamps, statuses, response_times, details = zip(*rows)
+    encoded_details = [(value or '').encode() for value in details]
+    return zlib.compress(b''.join([
+        BLOCK_HEADER.pack(len(rows)),
+        pack_array('q', ids),
+        pack_array('q', timestamps),
+        bytes(status == 'up' for status in statuses),
+        pack_array('d', (math.nan if value is None else value for value in response_times)),
+        pack_array('I', map(len, encoded_details)),
+        *encoded_details,
+    ]), ARCHIVE_COMPRESSION)
+
+
+def decode_block(data) -> List[tuple]:
+    payload = zlib.decompress(data)
+    (count,) = BLOCK_HEADER.unpack_from(payload)
+    offset = BLOCK_HEADER.size
+    ids = unpack_array('q', payload, offset, count)
+    offset += 8 * count
+    timestamps = unpack_array('q', payload, offset, count)
+    offset += 8 * count
+    statuses = payload[offset:offset + count]
+    offset += count
+    response_times = unpack_array('d', payload, offset, count)
+    offset += 8 * count
+    lengths = unpack_array('I', payload, offset, count)
+    offset += 4 * count
+
+    rows = []
+    for i in range(count):
+        details = payload[offset:offset + lengths[i]].decode() or None
+        offset += lengths[i]
+        response_time = response_times[i]
+        rows.append((ids[i], timestamps[i], 'up' if statuses[i] else 'down',
+                     None if math.isnan(response_time) else response_time, details))
+    return rows
+
+
+def _append_blocks(day_start: int, shard: int, blocks: List[Tuple[int, List[tuple]]]):
+    segment_path, index_path = _segment_paths(day_start, shard)
+    os.makedirs(os.path.dirname(segment_path), exist_ok=True)
+    entries = []
+    with open(segment_path, 'ab') as segment:
+        for service_id, rows in blocks:
+            offset = segment.tell()
+            data = encode_block(rows)
+            segment.write(data)
+            entries.append(INDEX_ENTRY.pack(
+                service_id, rows[0][1], rows[-1][1], offset, len(data), len(rows)
+            ))
+        segment.flush()
+        os.fsync(segment.fileno())
+    with open(index_path, 'ab') as index:
+        index.write(b''.join(entries))
+        index.flush()
+        os.fsync(index.fileno())
+    archive_stats['blocks_written'] += len(entries)
+
+
+def archive_batch(cutoff: int, after_service: int) -> Tuple[Optional[int], int]:
+    """Move up to ``ARCHIVE_BATCH_ROWS`` checks older than ``cutoff`` into segments.
+
+    Services are visited in id order from ``after_service``, each with one
+    index seek. Returns the id to resume after (None once every service is
+    done) and the number of rows moved.
+    """
+    conn = get_db()
+    try:
+        moved = 0
+        groups: Dict[Tuple[int, int], List[Tuple[int, List[tuple]]]] = {}
+        ids = []
+        while moved < ARCHIVE_BATCH_ROWS:
+            row = conn.execute(
+                'SELECT service_id FROM checks WHERE service_id > ? ORDER BY service_id LIMIT 1',
+                (after_service,)
+            ).fetchone()
+            if row is None:
+                after_service = None
+                break
+            service_id = row[0]
+            limit = ARCHIVE_BATCH_ROWS - moved
+            rows = [tuple(row) for row in conn.execute('''
+                SELECT id, timestamp, status, response_time, details FROM checks
+                WHERE service_id = ? AND timestamp < ?
+                ORDER BY timestamp
+                LIMIT ?
+            ''', (service_id, cutoff, limit))]
+            # Resume on this service next time if it had more than fit
+            after_service = service_id - 1 if len(rows) == limit else service_id
+
+            day_rows: Dict[int, List[tuple]] = {}
+            for check in rows:
+                day_rows.setdefault(check[1] - check[1] % DAY_MS, []).append(check)
+            for day_start, checks in day_rows.items():
+                groups.setdefault((day_start, service_id % ARCHIVE_SHARDS), []).append((service_id, checks))
+            ids.extend(check[0] for check in rows)
+            moved += len(rows)
+
+        for (day_start, shard), blocks in groups.items():
+            _append_blocks(day_start, shard, blocks)
+        if ids:
+            with conn:
+                conn.executemany('DELETE FROM checks WHERE id = ?', ((check_id,) for check_id in ids))
+        archive_stats['rows_archived'] += len(ids)
+        return after_service, moved
+    finally:
+        conn.close()
+
+
+async def archive_checks(cutoff: int) -> int:
+    """Archive every raw check from UTC days that ended before ``cutoff``.
+
+    Only whole days are moved, so each service gets one block per day.
+    """
+    cutoff -= cutoff % DAY_MS
+    loop = asyncio.get_running_loop()
+    after_service = -1
+    total = 0
+    while after_service is not None:
+        after_service, moved = await loop.run_in_executor(None, archive_batch, cutoff, after_service)
+        total += moved
+        await asyncio.sleep(ARCHIVE_PAUSE)
+    return total
+
+
+def _index_entries(path: str) -> List[tuple]:
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return []
+    cached = _index_cache.get(path)
+    if cached is not None and cached[0] == size:
+        _index_cache.move_to_end(path)
+        return cached[1]
+    with open(path, 'rb') as index:
+        # A torn final entry from an interrupted append is ignored
+        data = index.read(size - size % INDEX_ENTRY.size)
+    entries = list(INDEX_ENTRY.iter_unpack(data))
+    _index_cache[path] = (size, entries)
+    while len(_index_cache) > INDEX_CACHE_ENTRIES:
+        _index_cache.popitem(last=False)
+    return entries
+
+
+def _read_day(day_start: int, shard: int, service_id: Optional[int], start: int, end: int):
+    """``(service_id, check)`` pairs from one segment in ``[start, end)``, for one service or all."""
+    segment_path, index_path = _segment_paths(day_start, shard)
+    entries = [
+        entry for entry in _index_entries(index_path)
+        if (service_id is None or entry[0] == service_id) and entry[2] >= start and entry[1] < end
+    ]
+    if not entries:
+        return []
+    found = []
+    with open(segment_path, 'rb') as segment, \
+            mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            memoryview(mapped) as view:
+        for entry_service, _, _, offset, length, _ in entries:
+            for check in decode_block(view[offset:offset + length]):
+                if start <= check[1] < end:
+                    found.append((entry_service, check))
+            archive_stats['blocks_read'] += 1
+    return found
+
+
+def read_archived_checks(service_id: int, start: int, end: int) -> List[tuple]:
+    """Archived ``(id, timestamp, status, response_time, details)`` rows in ``[start, end)``.
+
+    Segments are memory-mapped, so only the blocks the index points at are
+    paged in and decompressed.
+    """
+    if not ARCHIVE_DIR:
+        return []
+    shard = service_id % ARCHIVE_SHARDS
+    rows = {}
+    day_start = start - start % DAY_MS
+    while day_start < end:
+        for _, check in _read_day(day_start, shard, service_id, start, end):
+            rows[check[0]] = check
+        day_start += DAY_MS
+    return sorted(rows.values(), key=lambda check: check[1])
+
+
+def archived_days(start: int, end: int) -> List[int]:
+    """Start of each UTC day overlapping ``[start, end)`` that has segments, in order."""
+    if not ARCHIVE_DIR:
+        return []
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except OSError:
+        return []
+    days = []
+    for name in names:
+        try:
+            day_start = int(datetime.strptime(name, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+        except ValueError:
+            continue
+        if day_start < end and day_start + DAY_MS > start:
+            days.append(day_start)
+    return sorted(days)
+
+
+def read_archived_day(conn, day_start: int, service_id: Optional[int], start: int, end: int) -> List[tuple]:
+    """One day's archived ``(id, service_id, timestamp, status, response_time, details)`` rows.
+
+    Covers ``[start, end)`` for one service, or every service when
+    ``service_id`` is None, in ``(timestamp, id)`` order. Rows still in
+    ``checks`` after an interrupted archive run are left out, since the
+    live table is exported too.
+    """
+    start, end = max(start, day_start), min(end, day_start + DAY_MS)
+    shards = range(ARCHIVE_SHARDS) if service_id is None else (service_id % ARCHIVE_SHARDS,)
+    rows = {}
+    for shard in shards:
+        for entry_service, (check_id, timestamp, status, response_time, details) in _read_day(
+            day_start, shard, service_id, start, end
+        ):
+            rows[check_id] = (check_id, entry_service, timestamp, status, response_time, details)
+    if rows:
+        where, params = ('', ()) if service_id is None else ('AND service_id = ?', (service_id,))
+        for (check_id,) in conn.execute(
+            f'SELECT id FROM checks WHERE timestamp >= ? AND timestamp < ? {where}', (start, end) + params
+        ):
+            rows.pop(check_id, None)
+    return sorted(rows.values(), key=lambda row: (row[2], row[0]))
+
+
+def get_archive_stats():
+    return dict(archive_stats, enabled=archive_enabled())
@@ -5,7 +5,7 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 import sqlite3
-from .database import get_db, set_database_path
+from .database import get_db, db_session, set_database_path
 
 
 SECRET_KEY = "your-secret-key-here"
@@ -61,7 +61,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 
 
 async def create_default_admin():
-    with get_db() as conn:
+    with db_session() as conn:
         # Check if admin exists
         admin = conn.execute(
             "SELECT * FROM users WHERE username = ?", 
@@ -0,0 +1,370 @@
+# bulk.py
+"""Bulk service import and streamed exports.
+
+Imports read the request body as it arrives and upsert it in chunks, one
+transaction per chunk; exports page through tables along an index so
+neither side ever holds a whole table in memory.
+"""
+import asyncio
+import codecs
+import csv
+import io
+import json
+import os
+import zlib
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+from pydantic import ValidationError
+
+from .archive import archived_days, read_archived_day
+from .dal import run_cpu, run_db
+from .models import Service
+
+IMPORT_CHUNK_SIZE = int(os.environ.get('MONITOR_IMPORT_CHUNK_SIZE', '500'))
+EXPORT_PAGE_SIZE = 1000
+# Errors reported back per import; the count still covers every rejected row.
+MAX_REPORTED_ERRORS = 1000
+# Ids must fit SQLite's signed 64-bit INTEGER PRIMARY KEY
+MAX_SERVICE_ID = 2 ** 63 - 1
+
+SERVICE_FIELDS = tuple(Service.model_fields)
+SERVICE_COLUMNS = ('id',) + SERVICE_FIELDS
+LAYOUTS = ('ndjson', 'csv')
+MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+UPSERT_SERVICE_SQL = f'''
+    INSERT INTO services ({', '.join(SERVICE_COLUMNS)})
+    VALUES ({', '.join('?' * len(SERVICE_COLUMNS))})
+    ON CONFLICT (id) DO UPDATE SET
+        {', '.join(f'{field} = excluded.{field}' for field in SERVICE_FIELDS)}
+'''
+INSERT_SERVICE_SQL = f'''
+    INSERT INTO services ({', '.join(SERVICE_FIELDS)})
+    VALUES ({', '.join('?' * len(SERVICE_FIELDS))})
+'''
+
+
+def request_layout(request: Request, layout: Optional[str]) -> str:
+    """``layout`` if given, else guessed from the Content-Type; NDJSON by default."""
+    if layout:
+        return layout
+    return 'csv' if 'csv' in request.headers.get('content-type', '') else 'ndjson'
+
+
+async def _body_lines(request: Request) -> AsyncIterator[str]:
+    compressed = request.headers.get('content-encoding') == 'gzip'
+    inflater = zlib.decompressobj(wbits=31) if compressed else None
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    async for chunk in request.stream():
+        if inflater is not None:
+            chunk = inflater.decompress(chunk)
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line
+    if inflater is not None:
+        pending += decoder.decode(inflater.flush())
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def _service_id(value: Any, layout: str) -> Optional[int]:
+    """The row's ``id``: an integer (decimal text in CSV) in 1..MAX_SERVICE_ID, or None."""
+    if value is None or value == '':
+        return None
+    if layout == 'csv' and isinstance(value, str) and value.strip().isascii() and value.strip().isdigit():
+        service_id = int(value)
+    elif isinstance(value, int) and not isinstance(value, bool):
+        service_id = value
+    else:
+        raise ValueError(f"id must be an integer, got {value!r}")
+    if not 1 <= service_id <= MAX_SERVICE_ID:
+        raise ValueError(f"id must be between 1 and {MAX_SERVICE_ID}")
+    return service_id
+
+
+def _parse_lines(lines: List[Tuple[int, str]], layout: str, header: Optional[Sequence[str]]):
+    """Validate raw lines into ``(line, id or None, Service)`` rows and ``(line, error)`` pairs."""
+    rows = []
+    errors = []
+    for number, line in lines:
+        try:
+            if layout == 'csv':
+                values = next(csv.reader([line]))
+                if len(values) != len(header):
+                    raise ValueError(f"expected {len(header)} fields, got {len(values)}")
+                record = dict(zip(header, values))
+            else:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+            service_id = _service_id(record.pop('id', None), layout)
+            rows.append((number, service_id, Service.model_validate(record)))
+        except ValidationError as e:
+            errors.append((number, '; '.join(
+                f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}"
+                for error in e.errors()
+            )))
+        except (ValueError, csv.Error) as e:
+            errors.append((number, str(e)))
+    return rows, errors
+
+
+def _values(service: Service) -> tuple:
+    return tuple(getattr(service, field) for field in SERVICE_FIELDS)
+
+
+def _upsert_chunk(conn, rows: List[Tuple[int, Optional[int], Service]]):
+    """Upsert validated rows in the caller's transaction.
+
+    Rows with an ``id`` update that service, or create it under that id.
+    Rows without one update the service with the same name, or create a new
+    one; a name shared by several services is rejected as ambiguous. When
+    rows in the chunk resolve to the same service, the last one wins.
+    """
+    errors = []
+    names = list({service.name for _, service_id, service in rows if service_id is None})
+    ids_by_name: Dict[str, List[int]] = {}
+    if names:
+        placeholders = ','.join('?' * len(names))
+        for service_id, name in conn.execute(
+            f'SELECT id, name FROM services WHERE name IN ({placeholders})', names
+        ):
+            ids_by_name.setdefault(name, []).append(service_id)
+
+    resolved: Dict[Any, Tuple[int, Optional[int], Service]] = {}
+    for number, service_id, service in rows:
+        if service_id is None:
+            matches = ids_by_name.get(service.name, [])
+            if len(matches) > 1:
+                errors.append((number, f"{len(matches)} services are named {service.name!r}; give an id"))
+                continue
+            if matches:
+                service_id = matches[0]
+        key = service_id if service_id is not None else service.name
+        if key in resolved:
+            errors.append((resolved[key][0], f"superseded by line {number}"))
+        resolved[key] = (number, service_id, service)
+
+    keyed = [(service_id,) + _values(service) for _, service_id, service in resolved.values()
+             if service_id is not None]
+    new = [_values(service) for _, service_id, service in resolved.values() if service_id is None]
+
+    existing = 0
+    if keyed:
+        ids = [row[0] for row in keyed]
+        placeholders = ','.join('?' * len(ids))
+        existing = conn.execute(
+            f'SELECT COUNT(*) FROM services WHERE id IN ({placeholders})', ids
+        ).fetchone()[0]
+        conn.executemany(UPSERT_SERVICE_SQL, keyed)
+    if new:
+        conn.executemany(INSERT_SERVICE_SQL, new)
+    return len(keyed) - existing + len(new), existing, errors
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def add_errors(self, errors: List[Tuple[int, str]]):
+        self.error_count += len(errors)
+        room = MAX_REPORTED_ERRORS - len(self.errors)
+        self.errors.extend({'line': number, 'error': error} for number, error in errors[:room])
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+        }
+
+
+async def import_services(request: Request, layout: str,
+                          chunk_size: int = IMPORT_CHUNK_SIZE) -> ImportReport:
+    """Upsert services from an NDJSON or CSV body (optionally gzip-compressed).
+
+    CSV needs a header row naming the ``Service`` fields, plus ``id`` if
+    wanted; fields cannot contain line breaks. Each chunk of ``chunk_size``
+    rows is validated off the event loop and written in one transaction, so
+    a bad row only costs its own line in the report. A header that is not
+    valid CSV raises ``csv.Error`` before anything is written.
+    """
+    report = ImportReport()
+    header = None
+    pending: List[Tuple[int, str]] = []
+
+    async def flush():
+        rows, errors = await run_cpu(_parse_lines, pending, layout, header)
+        if rows:
+            inserted, updated, upsert_errors = await run_db(_upsert_chunk, rows)
+            report.inserted += inserted
+            report.updated += updated
+            errors = errors + upsert_errors
+        report.add_errors(errors)
+        pending.clear()
+
+    number = 0
+    async for line in _body_lines(request):
+        number += 1
+        if not line.strip():
+            continue
+        if layout == 'csv' and header is None:
+            header = [name.strip() for name in next(csv.reader([line.lstrip('\ufeff')]))]
+            unknown = set(header) - set(SERVICE_COLUMNS)
+            if unknown:
+                report.add_errors([(number, f"unknown columns: {', '.join(sorted(unknown))}")])
+                return report
+            continue
+        pending.append((number, line))
+        if len(pending) >= chunk_size:
+            await flush()
+    if pending:
+        await flush()
+    return report
+
+
+def _payload_sql(columns: Sequence[str], layout: str, json_columns: Sequence[str]) -> str:
+    if layout != 'ndjson':
+        return ', '.join(columns)
+    # SQLite builds each NDJSON line itself; JSON text columns are embedded
+    # as values rather than as escaped strings.
+    return 'json_object(' + ', '.join(
+        f"'{column}', " + (
+            f'CASE WHEN json_valid({column}) THEN json({column}) ELSE {column} END'
+            if column in json_columns else column
+        )
+        for column in columns
+    ) + ')'
+
+
+def _compress(text: str, compressor) -> bytes:
+    data = text.encode()
+    if compressor is not None:
+        data = compressor.compress(data)
+    return data
+
+
+def _csv_text(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue()
+
+
+def _encode_page(conn, sql: str, params: tuple, layout: str, key_size: int, compressor):
+    rows = conn.execute(sql, params).fetchall()
+    if layout == 'csv':
+        text = _csv_text(row[key_size:] for row in rows)
+    else:
+        text = ''.join(row[key_size] + '\n' for row in rows)
+    return (rows[-1][:key_size] if rows else None), len(rows), _compress(text, compressor)
+
+
+def _encode_read(conn, read: Callable, args: tuple, columns: Sequence[str], layout: str,
+                 json_columns: Sequence[str], compressor) -> bytes:
+    """Encode rows from ``read(conn, *args)`` exactly as a page of the table would be."""
+    rows = read(conn, *args)
+    if layout == 'csv':
+        return _compress(_csv_text(rows), compressor)
+    # SQLite renders the lines too, so numbers and embedded JSON come out
+    # formatted the same as rows exported from the table itself.
+    extracted = ', '.join(f"json_extract(value, '$[{i}]') AS {column}" for i, column in enumerate(columns))
+    lines = conn.execute(f'''
+        SELECT {_payload_sql(columns, layout, json_columns)}
+        FROM (SELECT {extracted} FROM json_each(?) ORDER BY key)
+    ''', (json.dumps(rows),))
+    return _compress(''.join(line[0] + '\n' for line in lines), compressor)
+
+
+async def stream_rows(table: str, columns: Sequence[str], layout: str, *,
+                      segments: Sequence[tuple] = (('', ()),),
+                      keys: Sequence[str] = ('id',), start: tuple = (0,),
+                      json_columns: Sequence[str] = (), page_size: int = EXPORT_PAGE_SIZE,
+                      compress: bool = False) -> AsyncIterator[bytes]:
+    """Stream ``columns`` of ``table`` as NDJSON or CSV, optionally gzip-compressed.
+
+    Each ``(where, params)`` segment is exported in turn, in ``keys`` order,
+    with keyset pagination after ``start``. Every page is one short indexed
+    query on the database pool, which also encodes and compresses it, so an
+    export holds no read transaction open and no more than one page in
+    memory however long the client takes to drain it.
+
+    A segment may carry a third element, ``(read, args)`` pairs whose
+    ``read(conn, *args)`` rows (in ``columns`` order) are streamed before
+    the segment's own rows, one read at a time.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    key_list = ', '.join(keys)
+    header = (','.join(columns) + '\n').encode() if layout == 'csv' else b''
+    if compressor is not None:
+        header = compressor.compress(header)
+    if header:
+        yield header
+
+    for where, params, *reads in segments:
+        for read, args in (reads[0] if reads else ()):
+            data = await run_db(_encode_read, read, args, columns, layout, json_columns, compressor)
+            if data:
+                yield data
+        sql = f'''
+            SELECT {key_list}, {_payload_sql(columns, layout, json_columns)}
+            FROM {table}
+            WHERE ({key_list}) > ({', '.join('?' * len(keys))}) {f'AND {where}' if where else ''}
+            ORDER BY {key_list}
+            LIMIT ?
+        '''
+        after = start
+        while True:
+            last, count, data = await run_db(
+                _encode_page, sql, tuple(after) + params + (page_size,), layout, len(keys), compressor
+            )
+            if data:
+                yield data
+            if count < page_size:
+                break
+            after = last
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def stream_services(layout: str) -> AsyncIterator[bytes]:
+    return stream_rows('services', SERVICE_COLUMNS, layout)
+
+
+CHECK_COLUMNS = ('id', 'service_id', 'timestamp', 'status', 'response_time', 'details')
+ALERT_COLUMNS = ('id', 'service_id', 'timestamp', 'type', 'details')
+HISTORY_COLUMNS = {'checks': CHECK_COLUMNS, 'alerts': ALERT_COLUMNS}
+
+
+async def stream_history(table: str, layout: str, service_ids: Optional[Sequence[int]],
+                         start: int, end: int, compress: bool = False) -> AsyncIterator[bytes]:
+    """Stream ``checks`` or ``alerts`` rows with ``start <= timestamp < end``.
+
+    Without a service filter rows come in timestamp order. With one, each
+    service is exported in turn in timestamp order, so every page is a range
+    scan of the (service_id, timestamp) index. Checks moved to the archive
+    are read back for the days they cover, a day at a time, ahead of the
+    live rows.
+    """
+    days = []
+    if table == 'checks':
+        days = await asyncio.get_running_loop().run_in_executor(None, archived_days, start, end)
+    if service_ids is None:
+        reads = [(read_archived_day, (day_start, None, start, end)) for day_start in days]
+        segments = [('timestamp < ?', (end,), reads)]
+    else:
+        segments = [('service_id = ? AND timestamp < ?', (service_id, end),
+                     [(read_archived_day, (day_start, service_id, start, end)) for day_start in days])
+                    for service_id in dict.fromkeys(service_ids)]
+    async for data in stream_rows(
+        table, HISTORY_COLUMNS[table], layout, segments=segments,
+        keys=('timestamp', 'id'), start=(start, -1), json_columns=('details',), compress=compress
+    ):
+        yield data
@@ -0,0 +1,142 @@
+# cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from .database import get_db
+from .dal import run_db
+
+CACHE_MAX_ENTRIES = int(os.environ.get('MONITOR_CACHE_ENTRIES', '1024'))
+# Browsers revalidate every time by default (cheap with ETags); raise this
+# to let clients and proxies reuse responses during traffic spikes.
+CACHE_MAX_AGE = int(os.environ.get('MONITOR_CACHE_MAX_AGE', '0'))
+
+
+class ResponseCache:
+    """Encoded API responses keyed by endpoint and parameters.
+
+    Entries are stamped with the database's ``PRAGMA data_version`` as seen
+    from one long-lived connection. SQLite bumps that value whenever any
+    other connection commits, so the writer's batches, service CRUD and
+    commits made by other worker processes all invalidate the cache without
+    any explicit bookkeeping. Reading it can wait on the database, so
+    ``generation`` is called from the database pool, never the event loop.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple, Tuple[int, bytes, str]]' = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def generation(self) -> int:
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = get_db(check_same_thread=False)
+                return self._conn.execute('PRAGMA data_version').fetchone()[0]
+            except sqlite3.Error:
+                self._close_connection()
+                return -1
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def close(self):
+        with self._lock:
+            self._close_connection()
+        self._entries.clear()
+
+    def get(self, key: Tuple, generation: int) -> Optional[Tuple[bytes, str]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != generation or generation < 0:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1], entry[2]
+
+    def put(self, key: Tuple, generation: int, body: bytes) -> str:
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self._entries[key] = (generation, body, etag)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return etag
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def _generation(conn) -> int:
+    return response_cache.generation()
+
+
+def _encode(conn, compute: Callable, args: tuple) -> bytes:
+    return json.dumps(compute(conn, *args)).encode()
+
+
+def _render(conn, render: Callable, args: tuple) -> bytes:
+    return render(conn, *args)
+
+
+async def cached_json(request: Request, key: Tuple, compute: Callable, *args) -> Response:
+    """Serve ``compute(conn, *args)`` as JSON, reusing the encoded body until the data changes.
+
+    Queries, encoding and the data version check run on the database pool,
+    off the event loop. Answers ``If-None-Match`` with 304 when the client
+    already holds the current representation.
+    """
+    return await _cached(request, key, 'application/json', _encode, compute, args)
+
+
+async def cached_body(request: Request, key: Tuple, media_type: str, render: Callable, *args) -> Response:
+    """Like ``cached_json`` for a ``render(conn, *args)`` that returns the encoded body itself."""
+    return await _cached(request, key, media_type, _render, render, args)
+
+
+async def _cached(request: Request, key: Tuple, media_type: str, encode: Callable,
+                  compute: Callable, args: tuple) -> Response:
+    generation = await run_db(_generation)
+    cached = response_cache.get(key, generation)
+    if cached is None:
+        response_cache.misses += 1
+        body = await run_db(encode, compute, args)
+        etag = response_cache.put(key, generation, body)
+    else:
+        response_cache.hits += 1
+        body, etag = cached
+
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={CACHE_MAX_AGE}' if CACHE_MAX_AGE else 'no-cache',
+    }
+    if _etag_matches(request, etag):
+        response_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
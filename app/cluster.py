@@ -0,0 +1,192 @@
+# cluster.py
+import asyncio
+import hashlib
+import os
+import secrets
+import socket
+from typing import Any, Dict, Iterable, List, Optional
+
+from .database import now_ms, iso_from_ms
+from .dal import run_db
+from .events import broadcaster
+
+# A worker that has not renewed its membership within the TTL is considered
+# dead and its services are redistributed among the remaining workers.
+LEASE_TTL = float(os.environ.get('MONITOR_LEASE_TTL', '15'))
+HEARTBEAT_INTERVAL = float(os.environ.get('MONITOR_HEARTBEAT_INTERVAL', '5'))
+RELAY_INTERVAL = 1.0
+# How often a joining worker looks for its peers to have seen it
+SETTLE_POLL_INTERVAL = 0.5
+# Checks reach service_status through the batch writer, so look back a
+# little further than the relay interval to catch late batches.
+RELAY_LOOKBACK_MS = 10_000
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+RENEW_LEASE_SQL = '''
+    INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires
+    WHERE leases.owner = excluded.owner OR leases.expires < ?
+'''
+
+
+def _weight(worker_id: str, service_id: int) -> bytes:
+    return hashlib.blake2b(f'{worker_id}/{service_id}'.encode(), digest_size=8).digest()
+
+
+def shard_owner(service_id: int, workers: Iterable[str]) -> Optional[str]:
+    """The worker responsible for ``service_id`` (rendezvous hashing).
+
+    Every worker computes the same answer from the same member list, and
+    when a member joins or leaves only the services it gains or loses move.
+    """
+    return max(workers, key=lambda worker_id: _weight(worker_id, service_id), default=None)
+
+
+def _heartbeat(conn, worker_id: str, ttl_ms: int):
+    now = now_ms()
+    conn.execute('''
+        INSERT INTO monitor_workers (worker_id, started, heartbeat) VALUES (?, ?, ?)
+        ON CONFLICT (worker_id) DO UPDATE SET heartbeat = excluded.heartbeat
+    ''', (worker_id, now, now))
+    conn.execute('DELETE FROM monitor_workers WHERE heartbeat < ?', (now - ttl_ms,))
+    workers = [row[0] for row in conn.execute(
+        'SELECT worker_id FROM monitor_workers ORDER BY worker_id'
+    )]
+    conn.execute(RENEW_LEASE_SQL, ('leader', worker_id, now + ttl_ms, now))
+    leader = conn.execute("SELECT owner FROM leases WHERE name = 'leader'").fetchone()[0]
+    version = conn.execute(
+        "SELECT value FROM monitor_meta WHERE key = 'services_version'"
+    ).fetchone()
+    return workers, leader, version[0] if version else 0
+
+
+def _peers_behind(conn, worker_id: str) -> int:
+    """Members whose last heartbeat predates ``worker_id`` joining, so have not seen it yet."""
+    return conn.execute('''
+        SELECT COUNT(*) FROM monitor_workers
+        WHERE worker_id != ? AND heartbeat <= (
+            SELECT started FROM monitor_workers WHERE worker_id = ?
+        )
+    ''', (worker_id, worker_id)).fetchone()[0]
+
+
+def _leave(conn, worker_id: str):
+    conn.execute('DELETE FROM monitor_workers WHERE worker_id = ?', (worker_id,))
+    conn.execute("DELETE FROM leases WHERE owner = ?", (worker_id,))
+
+
+def _recent_status(conn, since: int):
+    return conn.execute('''
+        SELECT service_id, status, timestamp, response_time
+        FROM service_status WHERE timestamp > ?
+    ''', (since,)).fetchall()
+
+
+class Cluster:
+    """Membership of the uvicorn workers sharing one database.
+
+    Each worker renews a row in ``monitor_workers`` every heartbeat; rows
+    older than the TTL belong to dead workers and are removed by whoever
+    notices first. Services are split across the live members by
+    ``shard_owner``, and one member holds the ``leader`` lease for
+    database-wide housekeeping such as retention.
+
+    Members see changes at their next heartbeat. A joining worker waits
+    until every peer has heartbeated since it joined (see ``settle``), so
+    the peers have already handed over its shard and no service is checked
+    twice; instead the moved services may be skipped for up to
+    ``SETTLE_POLL_INTERVAL``. After a worker leaves, its services may be
+    skipped for up to one heartbeat interval, or the TTL if it crashed.
+    """
+
+    def __init__(self, worker_id: str = WORKER_ID, ttl: float = LEASE_TTL,
+                 interval: float = HEARTBEAT_INTERVAL):
+        self.worker_id = worker_id
+        self._ttl_ms = int(ttl * 1000)
+        self._interval = interval
+        self.workers: List[str] = [worker_id]
+        self.leader: Optional[str] = None
+        self.services_version: Optional[int] = None
+        self.rebalances = 0
+        self._published: Dict[int, int] = {}
+
+    @property
+    def is_leader(self) -> bool:
+        return self.leader == self.worker_id
+
+    def owns(self, service_id: int) -> bool:
+        return shard_owner(service_id, self.workers) == self.worker_id
+
+    async def heartbeat(self) -> bool:
+        """Renew membership; True when the shard assignment or service list changed."""
+        workers, leader, version = await run_db(_heartbeat, self.worker_id, self._ttl_ms)
+        changed = workers != self.workers or version != self.services_version
+        if workers != self.workers:
+            self.rebalances += 1
+            print(f"Cluster members changed: {len(workers)} worker(s), leader {leader}")
+        if self.services_version is not None and version != self.services_version:
+            # Service edits made through another worker
+            broadcaster.publish('services', {'changed': 'remote'})
+        self.workers, self.leader, self.services_version = workers, leader, version
+        return changed
+
+    async def settle(self):
+        """Join, then wait until every peer has heartbeated since.
+
+        By then each peer has dropped the services this worker takes over,
+        so its first shard assignment does not overlap theirs. A peer that
+        never heartbeats again drops out after the TTL, which bounds the wait.
+        """
+        await self.heartbeat()
+        while await run_db(_peers_behind, self.worker_id):
+            await asyncio.sleep(SETTLE_POLL_INTERVAL)
+            await self.heartbeat()
+
+    async def run(self, on_change):
+        while True:
+            try:
+                if await self.heartbeat():
+                    on_change()
+            except Exception as e:
+                print(f"Cluster heartbeat failed: {str(e)}")
+            await asyncio.sleep(self._interval)
+
+    async def relay(self):
+        """Forward other workers' check results to this worker's live clients."""
+        since = now_ms()
+        while True:
+            await asyncio.sleep(RELAY_INTERVAL)
+            if len(self.workers) < 2 or not broadcaster.client_count:
+                since = now_ms()
+                continue
+            try:
+                polled_at = now_ms()
+                rows = await run_db(_recent_status, since - RELAY_LOOKBACK_MS)
+                since = polled_at
+                for service_id, status, timestamp, response_time in rows:
+                    if self.owns(service_id) or self._published.get(service_id, 0) >= timestamp:
+                        continue
+                    self._published[service_id] = timestamp
+                    broadcaster.publish('check', {
+                        'id': service_id,
+                        'status': status,
+                        'response_time': response_time,
+                        'last_check': iso_from_ms(timestamp)
+                    })
+            except Exception as e:
+                print(f"Check relay failed: {str(e)}")
+
+    async def leave(self):
+        await run_db(_leave, self.worker_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'worker_id': self.worker_id,
+            'workers': len(self.workers),
+            'leader': self.is_leader,
+            'rebalances': self.rebalances,
+        }
+
+
+cluster = Cluster()
@@ -0,0 +1,65 @@
+# dal.py
+import asyncio
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+from .database import get_db
+
+DB_THREADS = int(os.environ.get('MONITOR_DB_THREADS', '4'))
+CPU_THREADS = int(os.environ.get('MONITOR_CPU_THREADS', '2'))
+
+# SQLite reads and password hashing get separate pools so a burst of
+# logins cannot starve queries, and neither ever runs on the event loop.
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+_cpu_executor = ThreadPoolExecutor(max_workers=CPU_THREADS, thread_name_prefix='cpu')
+
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_generation = 0
+
+
+def _thread_connection() -> sqlite3.Connection:
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'generation', None) != _generation:
+        conn = get_db(check_same_thread=False)
+        _local.conn = conn
+        _local.generation = _generation
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def _call_with_connection(fn: Callable, args: tuple) -> Any:
+    conn = _thread_connection()
+    with conn:
+        return fn(conn, *args)
+
+
+async def run_db(fn: Callable, *args) -> Any:
+    """Run ``fn(conn, *args)`` on the database pool in one transaction.
+
+    Each pool thread keeps its own connection for its lifetime, so handlers
+    pay neither connect cost nor leak connections.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, _call_with_connection, fn, args)
+
+
+async def run_cpu(fn: Callable, *args) -> Any:
+    """Run CPU-bound work such as bcrypt off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_cpu_executor, fn, *args)
+
+
+def close_connections():
+    """Close every pooled connection; threads reconnect lazily if reused."""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
@@ -1,26 +1,128 @@
 import sqlite3
 import os
+import json
+import asyncio
+import time
+from contextlib import contextmanager
+from datetime import datetime
 
 DB_PATH = '/app/data/monitor.db'
 
+# Version 2: checks/alerts store epoch-millisecond INTEGER timestamps and
+# carry (service_id, timestamp) indexes.
+# Version 3: check_rollups holds per-bucket aggregates of checks.
+# Version 4: service_status holds each service's latest check and history.
+# Version 5: monitor_workers, leases and monitor_meta coordinate workers.
+# Version 6: probe_schedule hands due checks to probe agents.
+# Version 7: check_rollups carries per-phase HTTP timing sums.
+# Version 8: check_rollups carries a response-time sketch for percentiles.
+# Version 9: status_transitions records each service's up/down changes.
+SCHEMA_VERSION = 9
+
+# HTTP timing phases, in the order checks store them (see monitor.check_http).
+CHECK_PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')
+
+ROLLUP_RESOLUTIONS = {
+    '1m': 60_000,
+    '1h': 3_600_000,
+    '1d': 86_400_000,
+}
+
+MIGRATION_CHUNK_SIZE = 5000
+MIGRATION_PAUSE = 0.05
+
 def set_database_path(path):
-    global DB_PATH 
+    global DB_PATH
     DB_PATH = path
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+def get_db(check_same_thread=True):
+    conn = sqlite3.connect(DB_PATH, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    # WAL (set once in init_db) lets readers run alongside the single writer;
+    # NORMAL sync is durable across application crashes in WAL mode.
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.execute('PRAGMA synchronous = NORMAL')
     return conn
 
+@contextmanager
+def db_session():
+    """A connection that commits (or rolls back) and is closed on exit."""
+    conn = get_db()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def check_phases(details):
+    """The phase timings in a check's details JSON, or None if it has none."""
+    if not details or '"phases"' not in details:
+        return None
+    try:
+        phases = json.loads(details).get('phases')
+    except (ValueError, AttributeError):
+        return None
+    if isinstance(phases, list) and len(phases) == len(CHECK_PHASES):
+        return phases
+    return None
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+def to_ms(value: datetime) -> int:
+    return int(value.timestamp() * 1000)
+
+def from_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000)
+
+def iso_from_ms(value):
+    return from_ms(value).isoformat() if value is not None else None
+
+_check_hooks = []
+
+def register_check_hook(hook, backfill=True):
+    """Run ``hook(conn, rows)`` inside every transaction that inserts checks.
+
+    ``rows`` are ``(service_id, timestamp, status, response_time, details)``
+    tuples; hooks use it to keep derived tables in step with ``checks``.
+    Hooks registered with ``backfill=False`` only see live checks, not
+    historical rows copied in by a migration.
+    """
+    if all(registered != hook for registered, _ in _check_hooks):
+        _check_hooks.append((hook, backfill))
+
+def run_check_hooks(conn, rows, backfill=False):
+    for hook, runs_on_backfill in _check_hooks:
+        if runs_on_backfill or not backfill:
+            hook(conn, rows)
+
+def _table_exists(c, name):
+    return c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
 def init_db(db_path=None):
     if db_path:
         set_database_path(db_path)
-    
+
     conn = get_db()
+    conn.isolation_level = None
     c = conn.cursor()
-    
+
     try:
+        c.execute('PRAGMA journal_mode = WAL')
+        # Serialise schema changes between workers starting at the same time.
+        c.execute('BEGIN IMMEDIATE')
+
+        version = c.execute('PRAGMA user_version').fetchone()[0]
+        if version < 2:
+            # Move text-timestamp tables aside; migrate_legacy_tables() copies
+            # them into the new layout in the background.
+            for table in ('checks', 'alerts'):
+                if _table_exists(c, table) and not _table_exists(c, f'{table}_legacy'):
+                    c.execute(f'ALTER TABLE {table} RENAME TO {table}_legacy')
+
         c.execute('''CREATE TABLE IF NOT EXISTS services
             (id INTEGER PRIMARY KEY,
              name TEXT,
@@ -30,24 +132,93 @@ def init_db(db_path=None):
              retry_threshold INTEGER,
              grace_period INTEGER,
              alert_email TEXT)''')
-        
+
         c.execute('''CREATE TABLE IF NOT EXISTS checks
             (id INTEGER PRIMARY KEY,
              service_id INTEGER,
-             timestamp TEXT,
+             timestamp INTEGER,
              status TEXT,
              response_time REAL,
              details TEXT,
              FOREIGN KEY(service_id) REFERENCES services(id))''')
-        
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_checks_service_timestamp
+            ON checks (service_id, timestamp)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_checks_timestamp
+            ON checks (timestamp)''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS check_rollups
+            (service_id INTEGER,
+             resolution INTEGER,
+             bucket INTEGER,
+             count INTEGER,
+             up_count INTEGER,
+             response_time_sum REAL,
+             response_time_min REAL,
+             response_time_max REAL,
+             phase_count INTEGER NOT NULL DEFAULT 0,
+             dns_sum REAL NOT NULL DEFAULT 0,
+             connect_sum REAL NOT NULL DEFAULT 0,
+             tls_sum REAL NOT NULL DEFAULT 0,
+             ttfb_sum REAL NOT NULL DEFAULT 0,
+             transfer_sum REAL NOT NULL DEFAULT 0,
+             response_time_sketch BLOB,
+             PRIMARY KEY (service_id, resolution, bucket)) WITHOUT ROWID''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_check_rollups_bucket
+            ON check_rollups (resolution, bucket)''')
+        if 3 <= version < 7:
+            # Older checks carry no phase timings, so existing buckets start at zero.
+            columns = {row[1] for row in c.execute('PRAGMA table_info(check_rollups)')}
+            for column in ('phase_count INTEGER', *(f'{phase}_sum REAL' for phase in CHECK_PHASES)):
+                if column.split()[0] not in columns:
+                    c.execute(f'ALTER TABLE check_rollups ADD COLUMN {column} NOT NULL DEFAULT 0')
+        if 3 <= version < 8:
+            # Buckets written before sketches existed contribute no percentiles.
+            c.execute('ALTER TABLE check_rollups ADD COLUMN response_time_sketch BLOB')
+        if version == 2:
+            # History written under version 2 predates rollups.
+            for resolution in ROLLUP_RESOLUTIONS.values():
+                c.execute('''
+                    INSERT OR IGNORE INTO check_rollups
+                    (service_id, resolution, bucket, count, up_count,
+                     response_time_sum, response_time_min, response_time_max)
+                    SELECT service_id, ?, timestamp - timestamp % ?, COUNT(*),
+                           SUM(status = 'up'), TOTAL(response_time),
+                           MIN(response_time), MAX(response_time)
+                    FROM checks
+                    GROUP BY service_id, timestamp - timestamp % ?
+                ''', (resolution, resolution, resolution))
+
+        c.execute('''CREATE TABLE IF NOT EXISTS service_status
+            (service_id INTEGER PRIMARY KEY,
+             status TEXT,
+             timestamp INTEGER,
+             response_time REAL,
+             history TEXT)''')
+        if version in (2, 3):
+            from .service_status import rebuild_service_status
+            rebuild_service_status(c)
+
+        c.execute('''CREATE TABLE IF NOT EXISTS status_transitions
+            (service_id INTEGER,
+             timestamp INTEGER,
+             up INTEGER,
+             PRIMARY KEY (service_id, timestamp)) WITHOUT ROWID''')
+        if 2 <= version < 9:
+            from .transitions import rebuild_status_transitions
+            rebuild_status_transitions(c)
+
         c.execute('''CREATE TABLE IF NOT EXISTS alerts
             (id INTEGER PRIMARY KEY,
              service_id INTEGER,
-             timestamp TEXT,
+             timestamp INTEGER,
              type TEXT,
              details TEXT,
              FOREIGN KEY(service_id) REFERENCES services(id))''')
-        
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_alerts_service_timestamp
+            ON alerts (service_id, timestamp)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_alerts_timestamp
+            ON alerts (timestamp)''')
+
         c.execute('''CREATE TABLE IF NOT EXISTS errors
             (id INTEGER PRIMARY KEY,
              timestamp TEXT,
@@ -61,10 +232,140 @@ def init_db(db_path=None):
              password TEXT,
              from_email TEXT,
              use_tls BOOLEAN)''')
-        
-        conn.commit()
+
+        # Coordination between uvicorn workers (see cluster.py).
+        c.execute('''CREATE TABLE IF NOT EXISTS monitor_workers
+            (worker_id TEXT PRIMARY KEY,
+             started INTEGER,
+             heartbeat INTEGER)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS leases
+            (name TEXT PRIMARY KEY,
+             owner TEXT,
+             expires INTEGER)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS monitor_meta
+            (key TEXT PRIMARY KEY,
+             value INTEGER)''')
+        c.execute("INSERT OR IGNORE INTO monitor_meta (key, value) VALUES ('services_version', 0)")
+        # Any change to the service list, from any worker, bumps the version
+        # so every worker reloads its shard.
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS services_version_{event.lower()}
+                AFTER {event} ON services
+                BEGIN
+                    UPDATE monitor_meta SET value = value + 1 WHERE key = 'services_version';
+                END''')
+
+        # When checks run on probe agents, due times live here (see probes.py).
+        c.execute('''CREATE TABLE IF NOT EXISTS probe_schedule
+            (service_id INTEGER PRIMARY KEY,
+             next_due INTEGER,
+             agent_id TEXT,
+             leased_at INTEGER)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_probe_schedule_next_due
+            ON probe_schedule (next_due)''')
+        c.execute('''INSERT OR IGNORE INTO probe_schedule (service_id, next_due)
+            SELECT id, 0 FROM services''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS probe_schedule_insert
+            AFTER INSERT ON services
+            BEGIN
+                INSERT OR IGNORE INTO probe_schedule (service_id, next_due) VALUES (new.id, 0);
+            END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS probe_schedule_delete
+            AFTER DELETE ON services
+            BEGIN
+                DELETE FROM probe_schedule WHERE service_id = old.id;
+            END''')
+
+        c.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        c.execute('COMMIT')
     except Exception as e:
-        conn.rollback()
+        if conn.in_transaction:
+            c.execute('ROLLBACK')
         raise e
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def _legacy_ms(value):
+    if value is None:
+        return None
+    try:
+        return to_ms(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        return None
+
+def migrate_legacy_chunk(table, chunk_size=MIGRATION_CHUNK_SIZE):
+    """Move one chunk of ``<table>_legacy`` rows into ``table``, newest first.
+
+    Every worker runs the migration, so each chunk is read and moved under
+    a write lock taken up front; a second worker waits and then sees only
+    rows that are still left. Migrated rows get new ids, since live checks
+    may already have taken the legacy ones.
+
+    Returns the number of rows moved; 0 means the legacy table is gone.
+    """
+    legacy = f'{table}_legacy'
+    conn = get_db()
+    try:
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if not _table_exists(conn, legacy):
+                return 0
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info({legacy})')]
+            rows = conn.execute(f'''
+                SELECT {', '.join(columns)} FROM {legacy}
+                ORDER BY id DESC LIMIT ?
+            ''', (chunk_size,)).fetchall()
+            if not rows:
+                conn.execute(f'DROP TABLE {legacy}')
+                return 0
+
+            timestamp_index = columns.index('timestamp')
+            copy_columns = [column for column in columns if column != 'id']
+            converted = []
+            for row in rows:
+                values = dict(zip(columns, row))
+                values['timestamp'] = _legacy_ms(row[timestamp_index])
+                converted.append([values[column] for column in copy_columns])
+
+            conn.executemany(f'''
+                INSERT INTO {table} ({', '.join(copy_columns)})
+                VALUES ({', '.join('?' for _ in copy_columns)})
+            ''', converted)
+            if table == 'checks':
+                run_check_hooks(conn, converted, backfill=True)
+            conn.execute(f'DELETE FROM {legacy} WHERE id >= ?', (rows[-1]['id'],))
+            return len(rows)
+    finally:
+        conn.close()
+
+async def migrate_legacy_tables():
+    """Convert pre-version-2 history in small transactions while the app runs."""
+    loop = asyncio.get_running_loop()
+    for table in ('checks', 'alerts'):
+        moved_total = 0
+        while True:
+            try:
+                moved = await loop.run_in_executor(None, migrate_legacy_chunk, table)
+            except sqlite3.OperationalError as e:
+                print(f"Migration of {table} paused: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            if not moved:
+                break
+            moved_total += moved
+            await asyncio.sleep(MIGRATION_PAUSE)
+        if moved_total:
+            print(f"Migrated {moved_total} legacy rows into {table}")
+            if table == 'checks':
+                await loop.run_in_executor(None, _rebuild_service_status)
+
+def _rebuild_service_status():
+    from .service_status import rebuild_service_status
+    from .transitions import rebuild_status_transitions
+    conn = get_db()
+    try:
+        with conn:
+            rebuild_service_status(conn)
+            rebuild_status_transitions(conn)
+    finally:
+        conn.close()
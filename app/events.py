@@ -0,0 +1,83 @@
+# events.py
+import asyncio
+import json
+import os
+from typing import Any, Dict, Set
+
+CLIENT_BUFFER_SIZE = int(os.environ.get('MONITOR_EVENT_BUFFER', '256'))
+HEARTBEAT_INTERVAL = 15.0
+
+
+class Subscriber:
+    """One connected client: a bounded buffer of already-encoded events."""
+
+    def __init__(self, buffer_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.evicted = False
+
+
+class Broadcaster:
+    """Fans monitor events out to every live-status client.
+
+    Each event is encoded once and handed to every subscriber without
+    awaiting. A client whose buffer is full is evicted instead of slowing
+    the monitor down; its stream ends and the browser reconnects with a
+    fresh snapshot.
+    """
+
+    def __init__(self, buffer_size: int = CLIENT_BUFFER_SIZE):
+        self._buffer_size = buffer_size
+        self._subscribers: Set[Subscriber] = set()
+        self.events_published = 0
+        self.clients_evicted = 0
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self._buffer_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    @property
+    def client_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: str, data: Dict[str, Any]):
+        if not self._subscribers:
+            return
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        self.events_published += 1
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                subscriber.evicted = True
+                self.clients_evicted += 1
+                self._subscribers.discard(subscriber)
+
+    async def stream(self, subscriber: Subscriber, is_disconnected):
+        """Yield SSE frames for ``subscriber`` until it disconnects or is evicted."""
+        try:
+            yield "retry: 3000\n\n"
+            while not subscriber.evicted:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'clients': len(self._subscribers),
+            'events_published': self.events_published,
+            'clients_evicted': self.clients_evicted,
+        }
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,181 @@
+# metrics.py
+import asyncio
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+LOOP_LAG_INTERVAL = 0.5
+
+_registry: List['_Family'] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramChild:
+    """Fixed buckets; an observation is one bisect and two additions."""
+
+    __slots__ = ('_bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # The last slot is the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self._bounds, value)] += 1
+        self.sum += value
+
+
+class _Family:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def labels(self, *values: str):
+        """The child for ``values``; created once, so hot paths should keep a reference."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_text(self, values: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f'# TYPE {self.name} {self.type_name}', f'# HELP {self.name} {_escape(self.documentation)}']
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Family):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+    def samples(self):
+        return [
+            f'{self.name}_total{self._label_text(values)} {_format(child.value)}'
+            for values, child in self._children.items()
+        ]
+
+
+class Gauge(_Family):
+    """A gauge set by the code, or read from ``fn`` at scrape time."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._fn = fn
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def samples(self):
+        if self._fn is not None:
+            return [f'{self.name} {_format(self._fn())}']
+        return [
+            f'{self.name}{self._label_text(values)} {_format(child.value)}'
+            for values, child in self._children.items()
+        ]
+
+
+class Histogram(_Family):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self._bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramChild(self._bounds)
+
+    def samples(self):
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self._bounds + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format(float(bound))}"'
+                lines.append(f'{self.name}_bucket{self._label_text(values, le)} {cumulative}')
+            lines.append(f'{self.name}_count{self._label_text(values)} {cumulative}')
+            lines.append(f'{self.name}_sum{self._label_text(values)} {_format(child.sum)}')
+        return lines
+
+
+def render_metrics() -> str:
+    """Every registered metric in the OpenMetrics text format."""
+    lines = []
+    for family in _registry:
+        lines.extend(family.render())
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+LOOP_LAG = Histogram(
+    'monitor_event_loop_lag_seconds',
+    'How late a periodic event loop timer fired.',
+    buckets=LAG_BUCKETS,
+).labels()
+
+
+async def run_loop_lag_probe(interval: float = LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
@@ -30,3 +30,7 @@ class SMTPConfig(BaseModel):
     password: str
     from_email: str  # Changed from EmailStr to str
     use_tls: bool = True
+
+class AgentLease(BaseModel):
+    agent_id: str
+    max_services: int = 100
@@ -1,225 +1,664 @@
 from datetime import datetime
 import asyncio
+import contextvars
 import aiohttp
 import ping3
 import json
-from .database import get_db
-from typing import Tuple, Dict, Union, Optional
-from email.utils import formatdate
-from email.mime.text import MIMEText
-import smtplib
-import ssl
+import os
+import time
+from urllib.parse import urlsplit, urlunsplit
+from .database import now_ms, iso_from_ms
+from .events import broadcaster
+from .metrics import Counter, Gauge, Histogram, run_loop_lag_probe
+from .alerts import send_alert, start_alerts, stop_alerts
+from .cluster import cluster
+from .scheduler import CheckScheduler
+from .adaptive import ADAPTIVE_INTERVALS, probe_budget, retry_delay, should_retry, stretched_interval
+from .ping import AsyncPinger
+from .rollups import run_retention
+from .state import get_service_state, load_service_state, load_service_states, prune_service_states
+from .dal import run_db
+from .writer import write, start_writer, stop_writer, INSERT_CHECK_SQL, INSERT_ALERT_SQL, INSERT_ERROR_SQL
+from typing import Tuple, Dict, List, NamedTuple, Union, Optional
 
 
+# check_frequency is stored in minutes; the unit is configurable so short
+# intervals can be used in development and benchmarks.
+FREQUENCY_UNIT_SECONDS = float(os.environ.get('MONITOR_FREQUENCY_UNIT', '60'))
+MIN_CHECK_INTERVAL = float(os.environ.get('MONITOR_MIN_INTERVAL', '5'))
+CHECK_DEADLINE = float(os.environ.get('MONITOR_CHECK_DEADLINE', '30'))
+# A probe gives up this much sooner, leaving time to record its timeout for
+# every service sharing it before the scheduler abandons the check.
+PROBE_DEADLINE = CHECK_DEADLINE - min(5.0, CHECK_DEADLINE / 4)
+MAX_CONCURRENT_CHECKS = int(os.environ.get('MONITOR_MAX_CONCURRENCY', '200'))
+SCHEDULE_JITTER = float(os.environ.get('MONITOR_JITTER', '0.1'))
+SERVICE_REFRESH_INTERVAL = 30
+# Leave checks to probe agents (agent.py) instead of running them here.
+REMOTE_PROBES = os.environ.get('MONITOR_REMOTE_PROBES', '').lower() in ('1', 'true', 'yes')
+# Seconds a probe result is reused by other services checking the same
+# target; 0 still shares probes that are in flight at the same time.
+PROBE_REUSE_WINDOW = float(os.environ.get('MONITOR_PROBE_REUSE_WINDOW', '5'))
+
+scheduler: Optional[CheckScheduler] = None
+_lag_probe_task: Optional[asyncio.Task] = None
+_refresh_event: Optional[asyncio.Event] = None
+_monitor_task: Optional[asyncio.Task] = None
+_retention_task: Optional[asyncio.Task] = None
+_cluster_tasks: list = []
+_scheduled_services = 0
+# Consecutive up (positive) or down (negative) probes per probe group
+_streaks: Dict[int, int] = {}
+
+HTTP_POOL_SIZE = int(os.environ.get('MONITOR_HTTP_POOL_SIZE', '200'))
+# 0 leaves connections per host unlimited; a cap makes checks of services
+# sharing a host queue for a connection.
+HTTP_POOL_PER_HOST = int(os.environ.get('MONITOR_HTTP_POOL_PER_HOST', '0'))
+# Per-phase limits, which do not count time spent waiting for a pooled
+# connection. The total bound does, and marks a check down before the
+# scheduler's CHECK_DEADLINE would discard it unrecorded.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('MONITOR_HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_READ_TIMEOUT = float(os.environ.get('MONITOR_HTTP_READ_TIMEOUT', '10'))
+HTTP_TOTAL_TIMEOUT = float(os.environ.get('MONITOR_HTTP_TOTAL_TIMEOUT', str(CHECK_DEADLINE * 2 / 3)))
+HTTP_DNS_CACHE_TTL = int(os.environ.get('MONITOR_HTTP_DNS_TTL', '300'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get('MONITOR_HTTP_KEEPALIVE', '120'))
+HTTP_MAX_BODY_BYTES = 1024 * 1024
+HTTP_COLD_CONNECTIONS = os.environ.get('MONITOR_HTTP_COLD', '').lower() in ('1', 'true', 'yes')
+
+_http_session: Optional[aiohttp.ClientSession] = None
+
+PING_TIMEOUT = float(os.environ.get('MONITOR_PING_TIMEOUT', '4'))
+
+_pinger: Optional[AsyncPinger] = None
+_pinger_unavailable = False
+
+
+def get_pinger() -> Optional[AsyncPinger]:
+    """Return the shared ICMP engine, or None if no ICMP socket can be opened."""
+    global _pinger, _pinger_unavailable
+    if _pinger is None and not _pinger_unavailable:
+        pinger = AsyncPinger()
+        try:
+            pinger.open()
+        except OSError as e:
+            print(f"ICMP socket unavailable, falling back to ping3 in a thread: {str(e)}")
+            _pinger_unavailable = True
+            return None
+        _pinger = pinger
+    return _pinger
+
+def close_pinger():
+    global _pinger
+    if _pinger is not None:
+        _pinger.close()
+        _pinger = None
 
 async def check_ping(target: str) -> Tuple[bool, Optional[float]]:
     try:
-        response_time = ping3.ping(target)
+        pinger = get_pinger()
+        if pinger is not None:
+            response_time = await pinger.ping(target, PING_TIMEOUT)
+        else:
+            loop = asyncio.get_running_loop()
+            response_time = await loop.run_in_executor(None, ping3.ping, target, PING_TIMEOUT)
         return (True, response_time) if response_time is not None else (False, None)
     except Exception:
         return False, None
 
-async def check_http(target: str) -> Tuple[bool, Optional[float], Dict]:
+class CheckTiming:
+    """Phase timestamps for one HTTP check, all from ``time.perf_counter()``.
+
+    Durations accumulate across redirect hops; ``phases()`` returns them in
+    ``CHECK_PHASES`` order, in seconds.
+    """
+
+    __slots__ = ('connection_reused', 'dns', 'connect', 'tls', 'ttfb', 'queued', '_secure',
+                 '_dns_start', '_connect_start', '_connect_dns', '_tcp_end', '_sent', '_queued_start')
+
+    def __init__(self):
+        self.connection_reused = False
+        self._secure = False
+        self.dns = self.connect = self.tls = self.ttfb = self.queued = 0.0
+        self._dns_start = self._connect_start = self._tcp_end = self._sent = self._queued_start = None
+        self._connect_dns = 0.0
+
+    def phases(self, transfer: float) -> list:
+        return [round(value, 6) for value in (self.dns, self.connect, self.tls, self.ttfb, transfer)]
+
+
+# The connector has no access to the trace context, so the check in
+# progress is published to it through the task's context instead.
+_current_timing: contextvars.ContextVar[Optional[CheckTiming]] = contextvars.ContextVar(
+    'current_timing', default=None
+)
+
+
+class PhaseTimingConnector(aiohttp.TCPConnector):
+    """Marks the end of the TCP handshake so TLS can be timed on its own.
+
+    aiohttp hands ``loop.create_connection`` an already connected socket and
+    the event loop builds the protocol before starting any TLS handshake, so
+    the protocol factory runs exactly when TCP is done.
+    """
+
+    async def _wrap_create_connection(self, protocol_factory, *args, **kwargs):
+        timing = _current_timing.get()
+        if timing is None:
+            return await super()._wrap_create_connection(protocol_factory, *args, **kwargs)
+
+        def timed_factory():
+            timing._tcp_end = time.perf_counter()
+            return protocol_factory()
+
+        return await super()._wrap_create_connection(timed_factory, *args, **kwargs)
+
+
+async def _on_request_start(session, trace_ctx, params):
+    # Sent again for every redirect hop, which may switch scheme
+    trace_ctx.trace_request_ctx._secure = params.url.scheme == 'https'
+
+async def _on_dns_resolvehost_start(session, trace_ctx, params):
+    trace_ctx.trace_request_ctx._dns_start = time.perf_counter()
+
+async def _on_dns_resolvehost_end(session, trace_ctx, params):
+    timing = trace_ctx.trace_request_ctx
+    if timing._dns_start is not None:
+        elapsed = time.perf_counter() - timing._dns_start
+        timing.dns += elapsed
+        timing._connect_dns += elapsed
+
+async def _on_connection_create_start(session, trace_ctx, params):
+    timing = trace_ctx.trace_request_ctx
+    timing._connect_start = time.perf_counter()
+    timing._connect_dns = 0.0
+    timing._tcp_end = None
+
+async def _on_connection_create_end(session, trace_ctx, params):
+    timing = trace_ctx.trace_request_ctx
+    timing.connection_reused = False
+    now = time.perf_counter()
+    tcp_end = timing._tcp_end if timing._secure and timing._tcp_end else now
+    # DNS is resolved inside connection setup; count it only once.
+    timing.connect += tcp_end - timing._connect_start - timing._connect_dns
+    timing.tls += now - tcp_end
+
+async def _on_connection_queued_start(session, trace_ctx, params):
+    trace_ctx.trace_request_ctx._queued_start = time.perf_counter()
+
+async def _on_connection_queued_end(session, trace_ctx, params):
+    timing = trace_ctx.trace_request_ctx
+    if timing._queued_start is not None:
+        timing.queued += time.perf_counter() - timing._queued_start
+        timing._queued_start = None
+
+async def _on_connection_reuseconn(session, trace_ctx, params):
+    trace_ctx.trace_request_ctx.connection_reused = True
+
+async def _on_request_headers_sent(session, trace_ctx, params):
+    trace_ctx.trace_request_ctx._sent = time.perf_counter()
+
+async def _on_request_redirect(session, trace_ctx, params):
+    timing = trace_ctx.trace_request_ctx
+    if timing._sent is not None:
+        timing.ttfb += time.perf_counter() - timing._sent
+        timing._sent = None
+
+def _build_trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_dns_resolvehost_start.append(_on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(_on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_queued_start.append(_on_connection_queued_start)
+    trace_config.on_connection_queued_end.append(_on_connection_queued_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    trace_config.on_request_headers_sent.append(_on_request_headers_sent)
+    trace_config.on_request_redirect.append(_on_request_redirect)
+    return trace_config
+
+def _new_http_session(cold: bool = False) -> aiohttp.ClientSession:
+    if cold:
+        connector = PhaseTimingConnector(force_close=True, use_dns_cache=False, ssl=False)
+    else:
+        connector = PhaseTimingConnector(
+            limit=HTTP_POOL_SIZE,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ssl=False,
+        )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(
+            total=HTTP_TOTAL_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT
+        ),
+        headers={'User-Agent': 'ServiceMonitor/1.0'},
+        trace_configs=[_build_trace_config()],
+    )
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Return the monitor's shared session, creating it on first use."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = _new_http_session()
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+async def check_http(target: str, cold: bool = HTTP_COLD_CONNECTIONS) -> Tuple[bool, Optional[float], Dict]:
+    """Fetch ``target`` through the shared connection pool.
+
+    With ``cold=True`` the check runs on a throwaway session that cannot
+    reuse connections or cached DNS, which is useful to compare cold-start
+    latency against pooled checks.
+    """
+    timing = CheckTiming()
+    token = _current_timing.set(timing)
+    session = _new_http_session(cold=True) if cold else get_http_session()
     try:
-        timeout = aiohttp.ClientTimeout(total=10)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            start_time = datetime.now()
-            async with session.get(target, allow_redirects=True, 
-                                 ssl=False,
-                                 headers={'User-Agent': 'ServiceMonitor/1.0'}) as response:
-                response_time = (datetime.now() - start_time).total_seconds()
-                
-                details = {
-                    'status_code': response.status,
-                    'redirect_count': len(response.history),
-                    'final_url': str(response.url),
-                    'response_time': response_time
-                }
-                
-                return 200 <= response.status < 400, response_time, details
+        start_time = time.perf_counter()
+        async with session.get(target, allow_redirects=True,
+                               trace_request_ctx=timing) as response:
+            headers_received = time.perf_counter()
+            # Waiting for a free pooled connection is not the target's latency
+            response_time = headers_received - start_time - timing.queued
+            if timing._sent is not None:
+                timing.ttfb += headers_received - timing._sent
+
+            # Drain the body so the connection can go back to the pool;
+            # oversized bodies are abandoned and the connection is dropped.
+            received = 0
+            async for chunk in response.content.iter_chunked(65536):
+                received += len(chunk)
+                if received > HTTP_MAX_BODY_BYTES:
+                    break
+
+            details = {
+                'status_code': response.status,
+                'redirect_count': len(response.history),
+                'final_url': str(response.url),
+                'response_time': response_time,
+                # Seconds, in CHECK_PHASES order: dns, connect, tls, ttfb, transfer
+                'phases': timing.phases(time.perf_counter() - headers_received),
+                'connection_reused': timing.connection_reused,
+                'queued': round(timing.queued, 6),
+                'cold': cold
+            }
+
+            return 200 <= response.status < 400, response_time, details
+    except asyncio.TimeoutError as e:
+        # Per-phase timeouts say which phase; the total bound has no message
+        return False, None, {'error': str(e) or f'no complete response within {HTTP_TOTAL_TIMEOUT}s'}
     except Exception as e:
-        return False, None, {'error': str(e)}
+        return False, None, {'error': str(e) or type(e).__name__}
+    finally:
+        _current_timing.reset(token)
+        if cold:
+            await session.close()
 
 
 
-async def send_alert(email: str, service_name: str, status: str):
-    with get_db() as conn:
-        config = conn.execute(
-            "SELECT host, port, username, password, from_email, use_tls FROM smtp_config"
-        ).fetchone()
-        
-    if not config:
-        print("Alert not sent: SMTP not configured")
-        return
-        
-    host = config[0].strip().encode('ascii', 'ignore').decode()
-    port = config[1]
-    username = config[2].strip().encode('ascii', 'ignore').decode()
-    password = config[3].strip().encode('ascii', 'ignore').decode()
-    from_email = config[4].strip().encode('ascii', 'ignore').decode()
-    use_tls = config[5]
-    
+async def record_error(error: str):
+    await write(INSERT_ERROR_SQL, (datetime.now().isoformat(), error))
+
+CHECK_DURATION = Histogram(
+    'monitor_check_duration_seconds',
+    'Wall time of one service check, by check type.',
+    ('type',),
+)
+CHECK_RESULTS = Counter(
+    'monitor_check_results',
+    'Recorded check results, including those from probe agents.',
+    ('type', 'status'),
+)
+# Children for the built-in types are created up front for the hot path.
+_check_duration = {type_: CHECK_DURATION.labels(type_) for type_ in ('http', 'ping')}
+_check_results = {
+    (type_, status): CHECK_RESULTS.labels(type_, status)
+    for type_ in ('http', 'ping') for status in ('up', 'down')
+}
+Gauge(
+    'monitor_checks_in_flight',
+    'Checks currently running in this worker.',
+    fn=lambda: scheduler.stats()['in_flight'] if scheduler else 0,
+)
+
+async def run_check(type_: str, target: str) -> Tuple[bool, Optional[float], Dict]:
+    if type_ == 'ping':
+        status, response_time = await check_ping(target)
+        return status, response_time, {'method': 'ping'}
+    return await check_http(target)
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def probe_key(type_: str, target: str) -> Tuple[str, str]:
+    """What makes two services' probes interchangeable.
+
+    Scheme and host are case-insensitive, default ports and fragments do not
+    reach the server, and an empty path is requested as ``/``.
+    """
+    target = target.strip()
+    if type_ != 'http':
+        return type_, target.lower()
     try:
-        with smtplib.SMTP(host, port, timeout=10) as server:
-            if use_tls:
-                server.starttls()
-            if username and password:
-                server.login(username, password)
-            
-            subject = f"Service Alert: {service_name} is {status.upper()}"
-            body = f"""
-Service: {service_name}
-Status: {status.upper()}
-Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-"""
-            msg = MIMEText(body, 'plain', 'utf-8')
-            msg['Subject'] = subject
-            msg['From'] = from_email
-            msg['To'] = email
-            msg['Date'] = formatdate(localtime=True)
-            
-            server.send_message(msg)
-            print(f"Alert sent to {email}: {service_name} is {status}")
+        parts = urlsplit(target)
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        if ':' in host:
+            host = f'[{host}]'
+        if parts.port is not None and parts.port != _DEFAULT_PORTS.get(scheme):
+            host = f'{host}:{parts.port}'
+        if parts.username is not None:
+            userinfo = parts.username + (f':{parts.password}' if parts.password is not None else '')
+            host = f'{userinfo}@{host}'
+    except ValueError:
+        return type_, target
+    return type_, urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+_probes_in_flight: Dict[Tuple[str, str], asyncio.Task] = {}
+_recent_probes: Dict[Tuple[str, str], Tuple[float, Tuple[bool, Optional[float], Dict]]] = {}
+
+PROBES_SHARED = Counter(
+    'monitor_probes_shared',
+    'Check results served from another service\'s probe of the same target, by how.',
+    ('source',),
+)
+_shared_in_flight = PROBES_SHARED.labels('in_flight')
+_shared_recent = PROBES_SHARED.labels('recent')
+_shared_group = PROBES_SHARED.labels('group')
+
+async def _probe(key: Tuple[str, str], type_: str, target: str):
+    try:
+        result = await asyncio.wait_for(run_check(type_, target), PROBE_DEADLINE)
+    except asyncio.TimeoutError:
+        result = False, None, {'error': 'check timed out'}
     except Exception as e:
-        print(f"Failed to send alert: {str(e)}")
-        with get_db() as conn:
-            conn.execute(
-                'INSERT INTO errors (timestamp, error) VALUES (?, ?)',
-                (datetime.now().isoformat(), f"SMTP Error: {str(e)}")
-            )
+        result = False, None, {'error': str(e)}
+    finally:
+        _probes_in_flight.pop(key, None)
+    if PROBE_REUSE_WINDOW > 0:
+        finished = time.monotonic()
+        _recent_probes[key] = (finished, result)
+        asyncio.get_running_loop().call_later(PROBE_REUSE_WINDOW, _expire_probe, key, finished)
+    return result
 
+def _expire_probe(key: Tuple[str, str], finished: float):
+    recent = _recent_probes.get(key)
+    if recent is not None and recent[0] == finished:
+        del _recent_probes[key]
 
+async def shared_check(type_: str, target: str,
+                       max_age: float = PROBE_REUSE_WINDOW) -> Tuple[bool, Optional[float], Dict]:
+    """``run_check`` that runs at most one probe per target at a time.
 
+    A caller finding the same target already being probed waits for that
+    probe, and one arriving less than ``max_age`` seconds after it finished
+    reuses its result; callers keep ``max_age`` below their own interval so
+    they never get their own previous result back. The probe runs as its
+    own task, so a caller being cancelled does not cancel it for the others.
+    """
+    key = probe_key(type_, target)
+    recent = _recent_probes.get(key)
+    if recent is not None and time.monotonic() - recent[0] < max_age:
+        _shared_recent.inc()
+        status, response_time, details = recent[1]
+        return status, response_time, dict(details, shared=True)
 
-async def monitor_service(service: tuple):
-    service_id, name, type_, target, freq, threshold, grace, email = service
+    task = _probes_in_flight.get(key)
+    if task is None:
+        task = _probes_in_flight[key] = asyncio.create_task(_probe(key, type_, target))
+        return await asyncio.shield(task)
+    _shared_in_flight.inc()
+    status, response_time, details = await asyncio.shield(task)
+    return status, response_time, dict(details, shared=True)
+
+async def record_result(service: tuple, status: bool, response_time: Optional[float],
+                        details: Dict, current_time: int):
+    """Store one check result, publish it and send any alert it triggers."""
+    service_id, name, type_, target, freq, threshold, grace, email = service[:8]
+
+    # Fetched before recording so a state loaded lazily from history
+    # cannot already include this check.
+    state = get_service_state(service_id)
+    if state is None:
+        state = await run_db(load_service_state, service_id, threshold)
     
+    # Record check
+    await write(INSERT_CHECK_SQL, (
+        service_id,
+        current_time,
+        'up' if status else 'down',
+        response_time,
+        json.dumps(details)
+    ))
+    broadcaster.publish('check', {
+        'id': service_id,
+        'status': 'up' if status else 'down',
+        'response_time': response_time,
+        'last_check': iso_from_ms(current_time)
+    })
+    
+    counter = _check_results.get((type_, 'up' if status else 'down'))
+    if counter is None:
+        counter = CHECK_RESULTS.labels(type_, 'up' if status else 'down')
+    counter.inc()
+
+    # Handle alerts
+    decision = state.observe(bool(status), current_time, threshold, grace * 60_000)
+    
+    if decision == 'down':
+        await send_alert(email, name, 'down')
+        await write(INSERT_ALERT_SQL, (
+            service_id,
+            current_time,
+            'down',
+            json.dumps({
+                'status': 'down',
+                'details': details,
+                'response_time': response_time
+            })
+        ))
+    
+    elif decision == 'recovery':
+        await send_alert(email, name, 'up')
+        await write(INSERT_ALERT_SQL, (
+            service_id,
+            current_time,
+            'recovery',
+            json.dumps({
+                'status': 'up',
+                'details': details,
+                'response_time': response_time
+            })
+        ))
+
+class ProbeGroup(NamedTuple):
+    """Services probing the same target on the same interval, scheduled as one.
+
+    The group takes its lowest member id, so it keeps its place in the
+    schedule as long as that member exists.
+    """
+    id: int
+    type: str
+    target: str
+    check_frequency: int
+    services: Tuple[tuple, ...]
+
+def group_services(services) -> List[ProbeGroup]:
+    members: Dict[tuple, List[tuple]] = {}
+    for service in services:
+        members.setdefault(probe_key(service[2], service[3]) + (service[4],), []).append(service)
+    groups = []
+    for group in members.values():
+        group.sort(key=lambda service: service[0])
+        first = group[0]
+        groups.append(ProbeGroup(first[0], first[2], first[3], first[4], tuple(group)))
+    return groups
+
+async def monitor_service(service: tuple):
+    await monitor_group(ProbeGroup(service[0], service[2], service[3], service[4], (service,)))
+
+async def monitor_group(group: ProbeGroup):
+    """Probe a group's target once and hand the result to every member's alert logic.
+
+    In adaptive mode a failure brings the group's next check forward, so
+    the retry threshold is reached within a few retry intervals. Stretching
+    or resetting the interval needs nothing here: the scheduler requeues the
+    next check once ``group_interval`` changes with the streak.
+    """
+    streak = _streaks.get(group.id, 0)
+    spacing = group_interval(group)
+    if streak < 0:
+        spacing = retry_delay(spacing, MIN_CHECK_INTERVAL)
     try:
-        with get_db() as conn:
-            c = conn.cursor()
-            
-            # Get last alert
-            last_alert = c.execute('''
-                SELECT timestamp FROM alerts 
-                WHERE service_id = ? 
-                ORDER BY timestamp DESC LIMIT 1
-            ''', (service_id,)).fetchone()
-            
-            # Perform check
-            if type_ == 'ping':
-                status, response_time = await check_ping(target)
-                details = {'method': 'ping'}
-            else:
-                status, response_time, details = await check_http(target)
-            
-            current_time = datetime.now()
-            
-            # Record check
-            c.execute('''
-                INSERT INTO checks 
-                (service_id, timestamp, status, response_time, details)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                service_id,
-                current_time.isoformat(),
-                'up' if status else 'down',
-                response_time,
-                json.dumps(details)
-            ))
-            
-            # Handle alerts
-            if not status:
-                grace_period_start = current_time.timestamp() - (grace * 60)
-                recent_checks = c.execute('''
-                    SELECT status 
-                    FROM checks 
-                    WHERE service_id = ? 
-                    AND datetime(timestamp) > datetime(?)
-                    ORDER BY timestamp DESC 
-                    LIMIT ?
-                ''', (
-                    service_id,
-                    datetime.fromtimestamp(grace_period_start).isoformat(),
-                    threshold
-                )).fetchall()
-                
-                if (len(recent_checks) >= threshold and 
-                    all(check[0] == 'down' for check in recent_checks)):
-                    
-                    should_alert = True
-                    if last_alert:
-                        last_alert_time = datetime.fromisoformat(last_alert[0])
-                        time_since_last_alert = (current_time - last_alert_time).total_seconds()
-                        should_alert = time_since_last_alert >= (grace * 60)
-                    
-                    if should_alert:
-                        await send_alert(email, name, 'down')
-                        c.execute('''
-                            INSERT INTO alerts 
-                            (service_id, timestamp, type, details)
-                            VALUES (?, ?, ?, ?)
-                        ''', (
-                            service_id,
-                            current_time.isoformat(),
-                            'down',
-                            json.dumps({
-                                'status': 'down',
-                                'details': details,
-                                'response_time': response_time
-                            })
-                        ))
-            
-            elif status:
-                last_check = c.execute('''
-                    SELECT status 
-                    FROM checks 
-                    WHERE service_id = ? 
-                    AND timestamp < ? 
-                    ORDER BY timestamp DESC 
-                    LIMIT 1
-                ''', (service_id, current_time.isoformat())).fetchone()
-                
-                if last_check and last_check[0] == 'down':
-                    await send_alert(email, name, 'up')
-                    c.execute('''
-                        INSERT INTO alerts 
-                        (service_id, timestamp, type, details)
-                        VALUES (?, ?, ?, ?)
-                    ''', (
-                        service_id,
-                        current_time.isoformat(),
-                        'recovery',
-                        json.dumps({
-                            'status': 'up',
-                            'details': details,
-                            'response_time': response_time
-                        })
-                    ))
-            
+        started = time.perf_counter()
+        probe_budget.spend()
+        status, response_time, details = await shared_check(
+            group.type, group.target, min(PROBE_REUSE_WINDOW, spacing / 2)
+        )
+        histogram = _check_duration.get(group.type) or CHECK_DURATION.labels(group.type)
+        histogram.observe(time.perf_counter() - started)
     except Exception as e:
-        with get_db() as conn:
-            conn.execute('''
-                INSERT INTO errors (timestamp, error)
-                VALUES (?, ?)
-            ''', (datetime.now().isoformat(), str(e)))
+        await record_error(str(e))
+        return
 
-async def monitor_services():
-    while True:
+    current_time = now_ms()
+    streak = max(streak, 0) + 1 if status else min(streak, 0) - 1
+    _streaks[group.id] = streak
+    if len(group.services) > 1:
+        _shared_group.inc(len(group.services) - 1)
+    for service in group.services:
         try:
-            with get_db() as conn:
-                services = conn.execute('SELECT * FROM services').fetchall()
-                
-            tasks = [monitor_service(service) for service in services]
-            await asyncio.gather(*tasks)
-            
+            await record_result(service, status, response_time, details, current_time)
         except Exception as e:
-            with get_db() as conn:
-                conn.execute('''
-                    INSERT INTO errors (timestamp, error)
-                    VALUES (?, ?)
-                ''', (datetime.now().isoformat(), str(e)))
-        
-        await asyncio.sleep(60)
+            await record_error(str(e))
+
+    if (ADAPTIVE_INTERVALS and not status and scheduler is not None
+            and should_retry(-streak, max(service[5] or 1 for service in group.services))):
+        scheduler.expedite(group.id, retry_delay(service_interval(group.services[0]), MIN_CHECK_INTERVAL))
+
+def service_interval(service) -> float:
+    frequency = service[4] or 1
+    return max(frequency * FREQUENCY_UNIT_SECONDS, MIN_CHECK_INTERVAL)
+
+def group_interval(group: ProbeGroup) -> float:
+    return stretched_interval(service_interval(group.services[0]), _streaks.get(group.id, 0))
+
+def request_service_refresh():
+    """Ask the monitor to reload the service list now instead of at the next poll."""
+    if _refresh_event is not None:
+        _refresh_event.set()
+
+def get_scheduler_stats() -> Dict:
+    if not scheduler:
+        return {}
+    stats = scheduler.stats()
+    # The scheduler runs probe groups; report services as before
+    stats['probe_groups'] = stats['services']
+    stats['services'] = _scheduled_services
+    if ADAPTIVE_INTERVALS:
+        groups = scheduler.services()
+        stats['adaptive'] = {
+            'failing_groups': sum(1 for group in groups if _streaks.get(group.id, 0) < 0),
+            'stretched_groups': sum(
+                1 for group in groups if group_interval(group) > service_interval(group.services[0])
+            ),
+            'probe_budget_tokens': probe_budget.tokens if probe_budget.rate else None,
+        }
+    return stats
+
+def _fetch_services(conn):
+    return conn.execute('SELECT * FROM services').fetchall()
+
+async def monitor_services():
+    global scheduler, _refresh_event, _scheduled_services
+    scheduler = CheckScheduler(
+        monitor_group,
+        group_interval,
+        max_concurrency=MAX_CONCURRENT_CHECKS,
+        check_timeout=CHECK_DEADLINE,
+        jitter=SCHEDULE_JITTER,
+    )
+    _refresh_event = asyncio.Event()
+    runner = asyncio.create_task(scheduler.run())
+    states_loaded = False
+    try:
+        # Until the other workers have seen this one they still check the
+        # services it is about to take over.
+        await cluster.settle()
+    except Exception as e:
+        print(f"Cluster heartbeat failed: {str(e)}")
+
+    try:
+        while True:
+            try:
+                # Other workers check the services outside this worker's shard
+                services = [
+                    service for service in await run_db(_fetch_services)
+                    if cluster.owns(service[0])
+                ]
+                if not states_loaded:
+                    await run_db(load_service_states, services)
+                    states_loaded = True
+                # Dropping the others means a service handed back later
+                # reloads its state from what the other worker recorded.
+                prune_service_states(service[0] for service in services)
+                groups = group_services(services)
+                scheduler.sync(groups)
+                _scheduled_services = len(services)
+                active_groups = {group.id for group in groups}
+                for group_id in list(_streaks):
+                    if group_id not in active_groups:
+                        del _streaks[group_id]
+
+            except Exception as e:
+                await record_error(str(e))
+
+            _refresh_event.clear()
+            try:
+                await asyncio.wait_for(_refresh_event.wait(), SERVICE_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        await scheduler.stop()
 
 async def start_monitoring():
-    asyncio.create_task(monitor_services())
\ No newline at end of file
+    global _monitor_task, _retention_task, _lag_probe_task
+    await start_writer()
+    await start_alerts()
+    try:
+        # Join before the first shard assignment so a restarted worker does
+        # not briefly check every service.
+        await cluster.heartbeat()
+    except Exception as e:
+        print(f"Cluster heartbeat failed: {str(e)}")
+    _cluster_tasks[:] = [
+        asyncio.create_task(cluster.run(request_service_refresh)),
+        asyncio.create_task(cluster.relay()),
+    ]
+    if not REMOTE_PROBES:
+        _monitor_task = asyncio.create_task(monitor_services())
+    _retention_task = asyncio.create_task(run_retention(lambda: cluster.is_leader))
+    _lag_probe_task = asyncio.create_task(run_loop_lag_probe())
+
+async def stop_monitoring():
+    for task in (_monitor_task, _retention_task, _lag_probe_task, *_cluster_tasks):
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    _cluster_tasks.clear()
+    try:
+        # Hand this worker's shard and leadership over without waiting for the TTL
+        await cluster.leave()
+    except Exception as e:
+        print(f"Failed to leave cluster: {str(e)}")
+    await close_http_session()
+    close_pinger()
+    await stop_alerts()
+    await stop_writer()
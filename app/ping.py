@@ -0,0 +1,146 @@
+# ping.py
+import asyncio
+import os
+import socket
+import struct
+import time
+from typing import Dict, Optional, Tuple
+
+ICMP_ECHO_REPLY = 0
+ICMP_DEST_UNREACHABLE = 3
+ICMP_ECHO_REQUEST = 8
+ICMP_TIME_EXCEEDED = 11
+
+_HEADER = struct.Struct('!BBHHH')
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(identifier: int, sequence: int, payload: bytes) -> bytes:
+    header = _HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = _checksum(header + payload)
+    return _HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + payload
+
+
+class AsyncPinger:
+    """Sends ICMP echo requests for any number of targets over one socket.
+
+    An unprivileged datagram ICMP socket is used where the kernel allows it,
+    falling back to a raw socket. Replies are read from the event loop with
+    ``add_reader`` and matched to the pending future by identifier and
+    sequence number, so no ping ever blocks the loop.
+    """
+
+    def __init__(self):
+        self._sock: Optional[socket.socket] = None
+        self._raw = False
+        self._identifier = os.getpid() & 0xFFFF
+        self._sequence = 0
+        self._pending: Dict[int, Tuple[asyncio.Future, str, float]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def open(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            raw = False
+        except PermissionError:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            raw = True
+        sock.setblocking(False)
+        self._sock = sock
+        self._raw = raw
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable)
+
+    def close(self):
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        for future, _, _ in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+
+    def _next_sequence(self) -> int:
+        for _ in range(0x10000):
+            self._sequence = (self._sequence + 1) & 0xFFFF
+            if self._sequence not in self._pending:
+                return self._sequence
+        raise RuntimeError("Too many pings in flight")
+
+    def _on_readable(self):
+        while True:
+            try:
+                packet, (address, _) = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # Datagram sockets surface ICMP errors (e.g. unreachable)
+                # as socket errors; the matching ping simply times out.
+                return
+            received = time.perf_counter()
+
+            if self._raw:
+                packet = packet[(packet[0] & 0x0F) * 4:]
+            if len(packet) < _HEADER.size:
+                continue
+
+            type_, _, _, identifier, sequence = _HEADER.unpack_from(packet)
+            if type_ == ICMP_ECHO_REPLY:
+                # Datagram sockets get their identifier rewritten by the kernel
+                # and only ever see their own replies.
+                if self._raw and identifier != self._identifier:
+                    continue
+                self._resolve(sequence, address, received)
+            elif self._raw and type_ in (ICMP_DEST_UNREACHABLE, ICMP_TIME_EXCEEDED):
+                # The error quotes the original IP header and echo request.
+                inner = packet[8:]
+                if len(inner) < 20:
+                    continue
+                inner = inner[(inner[0] & 0x0F) * 4:]
+                if len(inner) < _HEADER.size:
+                    continue
+                _, _, _, identifier, sequence = _HEADER.unpack_from(inner)
+                if identifier == self._identifier:
+                    self._resolve(sequence, None, None)
+
+    def _resolve(self, sequence: int, address: Optional[str], received: Optional[float]):
+        pending = self._pending.get(sequence)
+        if pending is None:
+            return
+        future, destination, sent = pending
+        if address is not None and address != destination:
+            return
+        if not future.done():
+            future.set_result(received - sent if received is not None else None)
+
+    async def ping(self, target: str, timeout: float = 4.0) -> Optional[float]:
+        """Return the round-trip time in seconds, or None on timeout or error."""
+        if self._sock is None:
+            self.open()
+        loop = self._loop
+
+        infos = await loop.getaddrinfo(target, None, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        destination = infos[0][4][0]
+
+        sequence = self._next_sequence()
+        future = loop.create_future()
+        packet = build_echo_request(self._identifier, sequence, struct.pack('!d', time.time()))
+        sent = time.perf_counter()
+        self._pending[sequence] = (future, destination, sent)
+        try:
+            self._sock.sendto(packet, (destination, 0))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._pending.pop(sequence, None)
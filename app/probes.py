@@ -0,0 +1,150 @@
+# probes.py
+import os
+import secrets
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import Header, HTTPException
+
+from .adaptive import probe_budget, retry_delay, should_retry
+from .cluster import cluster
+from .dal import run_db
+from .database import now_ms
+from .monitor import FREQUENCY_UNIT_SECONDS, MIN_CHECK_INTERVAL, record_error, record_result, service_interval
+from .state import get_service_state, load_service_state
+
+# Shared secret agents send in X-Agent-Token; unset leaves the endpoints open
+# like the rest of the API.
+AGENT_TOKEN = os.environ.get('MONITOR_AGENT_TOKEN', '')
+MAX_LEASE_BATCH = 1000
+AGENT_STALE_SECONDS = 60.0
+
+LEASE_DUE_SQL = '''
+    UPDATE probe_schedule
+    SET agent_id = ?, leased_at = ?,
+        next_due = ? + (
+            SELECT CAST(max(coalesce(nullif(s.check_frequency, 0), 1) * ?, ?) * 1000 AS INTEGER)
+            FROM services s WHERE s.id = probe_schedule.service_id
+        )
+    WHERE service_id IN (
+        SELECT service_id FROM probe_schedule
+        WHERE next_due <= ?
+        ORDER BY next_due
+        LIMIT ?
+    )
+    RETURNING service_id
+'''
+EXPEDITE_SQL = 'UPDATE probe_schedule SET next_due = min(next_due, ?) WHERE service_id = ?'
+
+_agents: Dict[str, Dict[str, Any]] = {}
+
+
+def verify_agent(x_agent_token: Optional[str] = Header(None)):
+    if AGENT_TOKEN and not secrets.compare_digest(x_agent_token or '', AGENT_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid agent token")
+
+
+def lease_due_services(conn, agent_id: str, limit: int) -> List:
+    """Hand up to ``limit`` due services to ``agent_id``.
+
+    Leasing pushes each service's next due time one interval ahead in the
+    same statement, so concurrent agents, or API workers, never receive the
+    same service twice. A lease is never returned: if the agent dies, the
+    service simply comes due again one interval later.
+    """
+    now = now_ms()
+    leased = conn.execute(LEASE_DUE_SQL, (
+        agent_id, now, now, FREQUENCY_UNIT_SECONDS, MIN_CHECK_INTERVAL,
+        now, min(limit, MAX_LEASE_BATCH),
+    )).fetchall()
+    if not leased:
+        return []
+    ids = [row[0] for row in leased]
+    placeholders = ','.join('?' * len(ids))
+    return conn.execute(
+        f'SELECT id, type, target FROM services WHERE id IN ({placeholders})', ids
+    ).fetchall()
+
+
+def fetch_services_by_id(conn, ids: List[int]) -> Dict[int, tuple]:
+    if not ids:
+        return {}
+    placeholders = ','.join('?' * len(ids))
+    rows = conn.execute(f'SELECT * FROM services WHERE id IN ({placeholders})', ids).fetchall()
+    return {row[0]: tuple(row) for row in rows}
+
+
+def _agent(agent_id: str) -> Dict[str, Any]:
+    agent = _agents.get(agent_id)
+    if agent is None:
+        agent = _agents[agent_id] = {'leased': 0, 'results': 0, 'last_seen': 0.0}
+    agent['last_seen'] = time.monotonic()
+    return agent
+
+
+def note_lease(agent_id: str, count: int):
+    _agent(agent_id)['leased'] += count
+
+
+def _expedite(conn, retries: List[tuple]):
+    conn.executemany(EXPEDITE_SQL, retries)
+
+
+def _reload_states(conn, services: List[tuple]):
+    for service in services:
+        load_service_state(conn, service[0], service[5])
+
+
+async def ingest_results(agent_id: str, services: Dict[int, tuple], results: List) -> int:
+    """Record a batch of agent results exactly as local checks are recorded.
+
+    Each result is ``[service_id, timestamp, status, response_time, details]``.
+    Results for services deleted meanwhile are dropped; the rest are applied
+    in timestamp order. In adaptive mode a failure brings the service's next
+    lease forward to confirm it sooner.
+    """
+    now = now_ms()
+    # Agent clocks may run ahead of the server's
+    results = sorted(
+        ((service_id, min(int(timestamp), now), status, response_time, details)
+         for service_id, timestamp, status, response_time, details in results
+         if service_id in services),
+        key=lambda result: result[1],
+    )
+    if len(cluster.workers) > 1:
+        # Any worker may receive a service's results, so alert state is
+        # rebuilt from the database, once per batch: rows for earlier results
+        # in this batch are still queued in the writer and would not be seen.
+        await run_db(_reload_states, [services[service_id] for service_id in {r[0] for r in results}])
+    accepted = 0
+    retries = []
+    for service_id, timestamp, status, response_time, details in results:
+        service = services[service_id]
+        try:
+            await record_result(service, bool(status), response_time, details or {}, timestamp)
+            accepted += 1
+            probe_budget.spend()
+            state = get_service_state(service_id)
+            if not status and state is not None and should_retry(len(state.failures), service[5]):
+                delay = retry_delay(service_interval(service), MIN_CHECK_INTERVAL)
+                retries.append((now + int(delay * 1000), service_id))
+        except Exception as e:
+            await record_error(str(e))
+    if retries:
+        await run_db(_expedite, retries)
+    _agent(agent_id)['results'] += accepted
+    return accepted
+
+
+def get_agent_stats() -> Dict[str, Any]:
+    now = time.monotonic()
+    for agent_id in [a for a, agent in _agents.items() if now - agent['last_seen'] > AGENT_STALE_SECONDS]:
+        del _agents[agent_id]
+    return {
+        agent_id: {
+            'leased': agent['leased'],
+            'results': agent['results'],
+            'seen_seconds_ago': round(now - agent['last_seen'], 1),
+        }
+        for agent_id, agent in _agents.items()
+    }
@@ -0,0 +1,176 @@
+# rollups.py
+import asyncio
+import os
+from typing import Callable, Dict, List, Optional
+
+from .archive import archive_checks, archive_enabled
+from .database import get_db, now_ms, register_check_hook, check_phases, ROLLUP_RESOLUTIONS
+from .sketch import encode, register_functions, sketch_key
+from .transitions import prune_transitions
+
+DAY_MS = 86_400_000
+
+# Retention per granularity, in days. Raw checks only need to cover the
+# ranges still served from raw rows; older views read rollups. With
+# MONITOR_ARCHIVE_DIR set, raw checks past retention are archived instead.
+RETENTION_DAYS = {
+    'raw': float(os.environ.get('MONITOR_RETENTION_RAW_DAYS', '7')),
+    '1m': float(os.environ.get('MONITOR_RETENTION_1M_DAYS', '3')),
+    '1h': float(os.environ.get('MONITOR_RETENTION_1H_DAYS', '90')),
+    '1d': float(os.environ.get('MONITOR_RETENTION_1D_DAYS', '730')),
+}
+RETENTION_INTERVAL = float(os.environ.get('MONITOR_RETENTION_INTERVAL', '600'))
+RETENTION_BATCH_SIZE = 5000
+RETENTION_PAUSE = 0.05
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO check_rollups
+    (service_id, resolution, bucket, count, up_count,
+     response_time_sum, response_time_min, response_time_max, phase_count,
+     dns_sum, connect_sum, tls_sum, ttfb_sum, transfer_sum, response_time_sketch)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (service_id, resolution, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        up_count = up_count + excluded.up_count,
+        response_time_sum = response_time_sum + excluded.response_time_sum,
+        response_time_min = min(coalesce(response_time_min, excluded.response_time_min),
+                                coalesce(excluded.response_time_min, response_time_min)),
+        response_time_max = max(coalesce(response_time_max, excluded.response_time_max),
+                                coalesce(excluded.response_time_max, response_time_max)),
+        phase_count = phase_count + excluded.phase_count,
+        dns_sum = dns_sum + excluded.dns_sum,
+        connect_sum = connect_sum + excluded.connect_sum,
+        tls_sum = tls_sum + excluded.tls_sum,
+        ttfb_sum = ttfb_sum + excluded.ttfb_sum,
+        transfer_sum = transfer_sum + excluded.transfer_sum,
+        response_time_sketch = sketch_merge(response_time_sketch, excluded.response_time_sketch)
+'''
+
+
+def apply_check_rollups(conn, rows):
+    """Fold a batch of inserted checks into every rollup granularity.
+
+    The batch is aggregated in memory first, so each touched bucket costs a
+    single upsert no matter how many checks landed in it. Response times
+    also go into each bucket's percentile sketch (see sketch.py), which the
+    upsert merges into the stored one.
+    """
+    buckets: Dict[tuple, list] = {}
+    for service_id, timestamp, status, response_time, details in rows:
+        if timestamp is None:
+            continue
+        phases = check_phases(details)
+        bin_key = sketch_key(response_time) if response_time is not None else None
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            key = (service_id, resolution, timestamp - timestamp % resolution)
+            aggregate = buckets.get(key)
+            if aggregate is None:
+                aggregate = buckets[key] = [0, 0, 0.0, None, None, 0, 0.0, 0.0, 0.0, 0.0, 0.0, {}]
+            aggregate[0] += 1
+            if status == 'up':
+                aggregate[1] += 1
+            if response_time is not None:
+                aggregate[2] += response_time
+                if aggregate[3] is None or response_time < aggregate[3]:
+                    aggregate[3] = response_time
+                if aggregate[4] is None or response_time > aggregate[4]:
+                    aggregate[4] = response_time
+                bins = aggregate[11]
+                bins[bin_key] = bins.get(bin_key, 0) + 1
+            if phases is not None:
+                aggregate[5] += 1
+                for index, value in enumerate(phases, 6):
+                    aggregate[index] += value or 0.0
+
+    if buckets:
+        register_functions(conn)
+        conn.executemany(UPSERT_ROLLUP_SQL, [
+            key + tuple(value[:11]) + (encode(value[11]),) for key, value in buckets.items()
+        ])
+
+
+register_check_hook(apply_check_rollups)
+
+
+def fetch_rollups(conn, service_id: int, resolution: int, start: int, end: Optional[int] = None) -> List:
+    return conn.execute('''
+        SELECT bucket, count, up_count, response_time_sum,
+               response_time_min, response_time_max, phase_count,
+               dns_sum, connect_sum, tls_sum, ttfb_sum, transfer_sum, response_time_sketch
+        FROM check_rollups
+        WHERE service_id = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+        ORDER BY bucket ASC
+    ''', (service_id, resolution, start - start % resolution, end if end is not None else now_ms() + 1)).fetchall()
+
+
+def prune_raw_checks(cutoff: int, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    conn = get_db()
+    try:
+        with conn:
+            return conn.execute('''
+                DELETE FROM checks WHERE id IN (
+                    SELECT id FROM checks WHERE timestamp < ? LIMIT ?
+                )
+            ''', (cutoff, batch_size)).rowcount
+    finally:
+        conn.close()
+
+
+def prune_rollups(resolution: int, cutoff: int, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    conn = get_db()
+    try:
+        with conn:
+            return conn.execute('''
+                DELETE FROM check_rollups
+                WHERE (service_id, resolution, bucket) IN (
+                    SELECT service_id, resolution, bucket FROM check_rollups
+                    WHERE resolution = ? AND bucket < ? LIMIT ?
+                )
+            ''', (resolution, cutoff, batch_size)).rowcount
+    finally:
+        conn.close()
+
+
+async def _prune_in_batches(prune, *args) -> int:
+    loop = asyncio.get_running_loop()
+    total = 0
+    while True:
+        deleted = await loop.run_in_executor(None, prune, *args)
+        total += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            return total
+        await asyncio.sleep(RETENTION_PAUSE)
+
+
+async def apply_retention():
+    now = now_ms()
+    raw_cutoff = now - int(RETENTION_DAYS['raw'] * DAY_MS)
+    if archive_enabled():
+        # Old raw checks move to cold storage a whole day at a time; whatever
+        # is left before that day (rows without a service) is pruned.
+        archived = await archive_checks(raw_cutoff)
+        if archived:
+            print(f"Archived {archived} checks")
+        raw_cutoff -= raw_cutoff % DAY_MS
+    deleted = await _prune_in_batches(prune_raw_checks, raw_cutoff)
+    for name, resolution in ROLLUP_RESOLUTIONS.items():
+        deleted += await _prune_in_batches(
+            prune_rollups, resolution, now - int(RETENTION_DAYS[name] * DAY_MS)
+        )
+    # Transitions are few, so they are kept as long as the coarsest rollups
+    deleted += await _prune_in_batches(
+        prune_transitions, now - int(RETENTION_DAYS['1d'] * DAY_MS), RETENTION_BATCH_SIZE
+    )
+    return deleted
+
+
+async def run_retention(is_leader: Callable[[], bool] = lambda: True):
+    """Prune periodically; with several workers only the leader does the work."""
+    while True:
+        try:
+            deleted = await apply_retention() if is_leader() else 0
+            if deleted:
+                print(f"Retention pruned {deleted} rows")
+        except Exception as e:
+            print(f"Retention run failed: {str(e)}")
+        await asyncio.sleep(RETENTION_INTERVAL)
@@ -1,348 +1,664 @@
 # routes.py
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from typing import List, Optional
 from .models import Service, ServiceUpdate, UserCreate, Token
 from .auth import get_current_user, create_access_token, get_password_hash, verify_password
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from .database import get_db
-from .monitor import check_ping, check_http, send_alert
+from .database import now_ms, to_ms, from_ms, iso_from_ms, check_phases, CHECK_PHASES, ROLLUP_RESOLUTIONS
+from .rollups import fetch_rollups, DAY_MS, RETENTION_DAYS
+from .archive import archive_enabled, read_archived_checks, get_archive_stats
+from .events import broadcaster
+from .metrics import CONTENT_TYPE, Histogram, render_metrics
+from .sketch import add_values, merge_all, percentiles
+from .transitions import sla_report
+from .series import downsample, encode_binary
+from .cache import cached_body, cached_json, response_cache
+from .cluster import cluster
+from .dal import run_db, run_cpu
+from .service_status import fetch_services_with_status, decode_history
+from .writer import write, get_writer_stats, INSERT_CHECK_SQL
+from .monitor import check_ping, check_http, request_service_refresh, get_scheduler_stats
+from .probes import verify_agent, lease_due_services, note_lease, fetch_services_by_id, ingest_results, get_agent_stats
+from .bulk import (
+    LAYOUTS as BULK_LAYOUTS, MEDIA_TYPES as BULK_MEDIA_TYPES, HISTORY_COLUMNS,
+    import_services, request_layout, stream_services, stream_history
+)
+from .alerts import send_alert, get_alert_stats, invalidate_smtp_config, load_smtp_config, send_test_email
 from datetime import datetime, timedelta
+import asyncio
+import csv
+import gzip
 import json
-from email.mime.text import MIMEText
-import smtplib
-import ssl
-from .models import SMTPConfig, Service, ServiceUpdate, UserCreate, Token
+import math
+import sqlite3
+import time
+import zlib
+from .models import SMTPConfig, Service, ServiceUpdate, UserCreate, Token, AgentLease
 
 
 
-router = APIRouter()
+REQUEST_DURATION = Histogram(
+    'monitor_http_request_duration_seconds',
+    'API latency until the response is ready (for streams, until they start).',
+    ('method', 'route'),
+)
+
+
+class TimedRoute(APIRoute):
+    """Records every request's latency under its route template."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        path = self.path
+        # Filled on first use: routers copied into the app by include_router
+        # would otherwise leave empty series for the originals.
+        histograms = {}
+
+        async def timed_handler(request: Request):
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                histogram = histograms.get(request.method)
+                if histogram is None:
+                    histogram = histograms[request.method] = REQUEST_DURATION.labels(request.method, path)
+                histogram.observe(time.perf_counter() - started)
+
+        return timed_handler
+
+
+router = APIRouter(route_class=TimedRoute)
+
+def _get_user(conn, username):
+    return conn.execute(
+        "SELECT * FROM users WHERE username = ?", 
+        (username,)
+    ).fetchone()
 
 @router.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    with get_db() as conn:
-        user = conn.execute(
-            "SELECT * FROM users WHERE username = ?", 
-            (form_data.username,)
-        ).fetchone()
+    user = await run_db(_get_user, form_data.username)
+    
+    if not user or not await run_cpu(verify_password, form_data.password, user[1]):
+        raise HTTPException(
+            status_code=400,
+            detail="Incorrect username or password"
+        )
         
-        if not user or not verify_password(form_data.password, user[1]):
-            raise HTTPException(
-                status_code=400,
-                detail="Incorrect username or password"
-            )
-            
     access_token = create_access_token(data={"sub": user[0]})
     return {"access_token": access_token, "token_type": "bearer"}
 
+def _insert_user(conn, username, hashed_password):
+    try:
+        conn.execute(
+            "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
+            (username, hashed_password)
+        )
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=400, detail="Username already registered")
+
 @router.post("/users")
 async def create_user(user: UserCreate):
-    with get_db() as conn:
-        hashed_password = get_password_hash(user.password)
-        try:
-            conn.execute(
-                "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
-                (user.username, hashed_password)
-            )
-        except sqlite3.IntegrityError:
-            raise HTTPException(status_code=400, detail="Username already registered")
+    hashed_password = await run_cpu(get_password_hash, user.password)
+    await run_db(_insert_user, user.username, hashed_password)
     return {"message": "User created successfully"}
 
 
-@router.get("/services/")
-async def get_services():
-    with get_db() as conn:
-        c = conn.cursor()
-        services = c.execute('SELECT * FROM services').fetchall()
-        services_list = []
+def _services_payload(conn):
+    services = fetch_services_with_status(conn)
+    services_list = []
+    
+    for service in services:
+        services_list.append({
+            "id": service[0],
+            "name": service[1],
+            "type": service[2],
+            "target": service[3],
+            "check_frequency": service[4],
+            "retry_threshold": service[5],
+            "grace_period": service[6],
+            "alert_email": service[7],
+            "status": service['last_status'] or "unknown",
+            "last_check": iso_from_ms(service['last_timestamp']),
+            "response_time": service['last_response_time']
+        })
         
-        for service in services:
-            latest_check = c.execute('''
-                SELECT status, timestamp, response_time 
-                FROM checks 
-                WHERE service_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            ''', (service[0],)).fetchone()
-            
-            services_list.append({
-                "id": service[0],
-                "name": service[1],
-                "type": service[2],
-                "target": service[3],
-                "check_frequency": service[4],
-                "retry_threshold": service[5],
-                "grace_period": service[6],
-                "alert_email": service[7],
-                "status": latest_check[0] if latest_check else "unknown",
-                "last_check": latest_check[1] if latest_check else None,
-                "response_time": latest_check[2] if latest_check else None
-            })
-            
     return {"services": services_list}
 
 
+@router.get("/services/")
+async def get_services(request: Request):
+    return await cached_json(request, ('services',), _services_payload)
+
+
+def _insert_service(conn, service: Service):
+    conn.execute('''
+        INSERT INTO services 
+        (name, type, target, check_frequency, retry_threshold, grace_period, alert_email)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        service.name, service.type, service.target, service.check_frequency,
+        service.retry_threshold, service.grace_period, service.alert_email
+    ))
+
 @router.post("/services")
 async def add_service(
     service: Service
 ):
-    with get_db() as conn:
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO services 
-            (name, type, target, check_frequency, retry_threshold, grace_period, alert_email)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            service.name, service.type, service.target, service.check_frequency,
-            service.retry_threshold, service.grace_period, service.alert_email
-        ))
+    await run_db(_insert_service, service)
+    request_service_refresh()
+    broadcaster.publish('services', {'changed': 'added'})
     return {"message": "Service added successfully"}
 
+def _update_service(conn, service_id: int, service: Service):
+    c = conn.execute('''
+        UPDATE services 
+        SET name=?, type=?, target=?, check_frequency=?, 
+            retry_threshold=?, grace_period=?, alert_email=?
+        WHERE id=?
+    ''', (
+        service.name, service.type, service.target, service.check_frequency,
+        service.retry_threshold, service.grace_period, service.alert_email,
+        service_id
+    ))
+    if c.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Service not found")
+
 @router.put("/services/{service_id}")
 async def update_service(
     service_id: int,
     service: Service,
     current_user: str = Depends(get_current_user)
 ):
-    with get_db() as conn:
-        c = conn.cursor()
-        c.execute('''
-            UPDATE services 
-            SET name=?, type=?, target=?, check_frequency=?, 
-                retry_threshold=?, grace_period=?, alert_email=?
-            WHERE id=?
-        ''', (
-            service.name, service.type, service.target, service.check_frequency,
-            service.retry_threshold, service.grace_period, service.alert_email,
-            service_id
-        ))
-        if c.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Service not found")
+    await run_db(_update_service, service_id, service)
+    request_service_refresh()
+    broadcaster.publish('services', {'changed': 'updated'})
     return {"message": "Service updated successfully"}
 
+def _delete_service(conn, service_id: int):
+    c = conn.execute("DELETE FROM services WHERE id=?", (service_id,))
+    if c.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Service not found")
+    conn.execute("DELETE FROM service_status WHERE service_id=?", (service_id,))
+    conn.execute("DELETE FROM status_transitions WHERE service_id=?", (service_id,))
+
 @router.delete("/services/{service_id}")
 async def delete_service(
     service_id: int
 ):
-    with get_db() as conn:
-        c = conn.cursor()
-        c.execute("DELETE FROM services WHERE id=?", (service_id,))
-        if c.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Service not found")
+    await run_db(_delete_service, service_id)
+    request_service_refresh()
+    broadcaster.publish('services', {'changed': 'deleted'})
     return {"message": "Service deleted successfully"}
 
+def _check_bulk_layout(layout: str):
+    if layout not in BULK_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(BULK_LAYOUTS)}")
+
+@router.post("/services/import")
+async def import_services_bulk(
+    request: Request,
+    layout: Optional[str] = Query(None, alias='format'),
+    current_user: str = Depends(get_current_user)
+):
+    """Upsert services from a streamed NDJSON or CSV body; see ``bulk.import_services``."""
+    layout = request_layout(request, layout)
+    _check_bulk_layout(layout)
+    try:
+        report = await import_services(request, layout)
+    except (UnicodeDecodeError, zlib.error):
+        raise HTTPException(status_code=400, detail="Body is not valid UTF-8, or not valid gzip")
+    except csv.Error as e:
+        raise HTTPException(status_code=400, detail=f"CSV header is not valid: {e}")
+    if report.inserted or report.updated:
+        # One diffing reload for the whole import: the scheduler keeps the
+        # phase of every service whose interval did not change.
+        request_service_refresh()
+        broadcaster.publish('services', {'changed': 'imported'})
+    return report.as_dict()
+
+@router.get("/services/export")
+async def export_services(layout: str = Query('ndjson', alias='format')):
+    _check_bulk_layout(layout)
+    return StreamingResponse(
+        stream_services(layout),
+        media_type=BULK_MEDIA_TYPES[layout],
+        headers={'Content-Disposition': f'attachment; filename="services.{layout}"'}
+    )
+
+@router.get("/export/{table}")
+async def export_history(
+    table: str,
+    layout: str = Query('ndjson', alias='format'),
+    service_id: Optional[List[int]] = Query(None),
+    start: int = 0,
+    end: Optional[int] = None,
+    compress: bool = Query(False, alias='gzip')
+):
+    """Stream raw ``checks`` (archived ones included) or ``alerts`` rows; ``start``/``end`` are epoch ms."""
+    if table not in HISTORY_COLUMNS:
+        raise HTTPException(status_code=404, detail="Only checks and alerts can be exported")
+    _check_bulk_layout(layout)
+    headers = {'Content-Disposition': f'attachment; filename="{table}.{layout}"'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(
+        stream_history(table, layout, service_id, start, end if end is not None else now_ms() + 1, compress),
+        media_type=BULK_MEDIA_TYPES[layout],
+        headers=headers
+    )
+
+
+@router.get("/sla")
+async def get_sla(request: Request, service_id: Optional[List[int]] = Query(None),
+                  start: Optional[int] = None, end: Optional[int] = None):
+    """Uptime, outages, MTTR and longest outage over ``[start, end)`` in epoch ms.
+
+    Defaults to the last 30 days of every service; durations are in ms.
+    """
+    service_ids = tuple(dict.fromkeys(service_id)) if service_id else None
+    # Ranges can run up to now, so entries also roll over each minute
+    key = ('sla', service_ids, start, end, now_ms() // 60_000)
+    end = min(end, now_ms()) if end is not None else now_ms()
+    start = start if start is not None else end - 30 * DAY_MS
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return await cached_json(request, key, sla_report, service_ids, start, end)
+
+
+# time_range -> (window, rollup granularity or None for raw checks)
+METRIC_RANGES = {
+    'hour': (timedelta(hours=1), None),
+    'day': (timedelta(days=1), '1m'),
+    'week': (timedelta(weeks=1), '1h'),
+    'month': (timedelta(days=30), '1h'),
+}
+
+METRIC_LAYOUTS = ('json', 'columnar', 'binary')
+# Longest custom range served from 1m or 1h rollups, in buckets
+MAX_SPAN_BUCKETS = 2000
+NO_PHASES = (None,) * len(CHECK_PHASES)
+# Phase timings pulled out of details by SQLite's JSON functions, which is
+# far cheaper than decoding every row's details in Python.
+RAW_PHASE_COLUMNS = ', '.join(
+    f'''CASE WHEN instr(details, '"phases"') AND json_valid(details)
+        THEN details ->> '$.phases[{i}]' END'''
+    for i in range(len(CHECK_PHASES))
+)
+
+
+def _metric_window(time_range: str, span: Optional[tuple]):
+    """``(start, end, granularity)`` for a named range, or for an explicit ``span``.
+
+    Explicit spans read raw checks when they cover at most a day and raw
+    rows, hot or archived, still exist for them; otherwise the finest
+    rollup that is still retained and keeps the series a sensible length.
+    """
+    if span is None:
+        window, granularity = METRIC_RANGES.get(time_range, METRIC_RANGES['week'])
+        return to_ms(datetime.now() - window), now_ms() + 1, granularity
+
+    start, end = span
+    age = now_ms() - start
+    if end - start <= DAY_MS and (archive_enabled() or age <= RETENTION_DAYS['raw'] * DAY_MS):
+        return start, end, None
+    for name in ('1m', '1h'):
+        if age <= RETENTION_DAYS[name] * DAY_MS and end - start <= MAX_SPAN_BUCKETS * ROLLUP_RESOLUTIONS[name]:
+            return start, end, name
+    return start, end, '1d'
+
+
+def _raw_rows(conn, service_id: int, start_time: int, end_time: int) -> List[tuple]:
+    """``(timestamp, up, response_time, *phases)`` rows from SQLite and the archive."""
+    rows = conn.execute(f'''
+        SELECT id, timestamp, status = 'up', coalesce(response_time, 0), {RAW_PHASE_COLUMNS}
+        FROM checks 
+        WHERE service_id = ? AND timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp ASC
+    ''', (service_id, start_time, end_time)).fetchall()
+    if archive_enabled() and start_time < now_ms() - RETENTION_DAYS['raw'] * DAY_MS:
+        hot_ids = {row[0] for row in rows}
+        archived = [
+            (check_id, timestamp, int(status == 'up'), response_time or 0,
+             *(check_phases(details) or NO_PHASES))
+            for check_id, timestamp, status, response_time, details
+            in read_archived_checks(service_id, start_time, end_time)
+            if check_id not in hot_ids
+        ]
+        if archived:
+            rows = sorted(archived + rows, key=lambda row: row[1])
+    return [row[1:] for row in rows]
+
+
+def _service_series(conn, service_id: int, time_range: str, span: Optional[tuple] = None):
+    """Full-resolution columns for a metrics range and the summary over all of them.
+
+    Rows are transposed with ``zip(*rows)`` and totals taken with builtin
+    reductions rather than accumulated point by point in Python.
+    """
+    start_time, end_time, granularity = _metric_window(time_range, span)
+
+    if granularity is None:
+        label = '%H:%M' if span is None else '%m-%d %H:%M'
+        rows = _raw_rows(conn, service_id, start_time, end_time)
+        # Per-phase series are aligned with times; None where a check has no timings
+        times, status_values, response_times, *phase_series = (
+            zip(*rows) if rows else ((),) * (3 + len(CHECK_PHASES))
+        )
+        # Zeros add nothing to a sum, so filter(None) only has to skip the Nones
+        phase_totals = [math.fsum(filter(None, column)) for column in phase_series]
+        # Missing response times were read as 0, so they are skipped the same way
+        measured = list(filter(None, response_times))
+        bins = add_values({}, measured)
+        max_response_time = max(measured, default=None)
+
+        total_count = len(rows)
+        up_count = sum(status_values)
+        total_response_time = math.fsum(response_times)
+        phase_count = total_count - phase_series[0].count(None)
+    else:
+        label = '%H:%M' if granularity == '1m' and span is None else '%m-%d %H:%M'
+        rows = fetch_rollups(conn, service_id, ROLLUP_RESOLUTIONS[granularity], start_time, end_time)
+        times, counts, ups, response_sums, _, maxima, phase_counts, *phase_sums, sketches = (
+            zip(*rows) if rows else ((),) * (8 + len(CHECK_PHASES))
+        )
+
+        response_times = [total / count if count else 0 for total, count in zip(response_sums, counts)]
+        status_values = [round(up / count, 3) if count else 0 for up, count in zip(ups, counts)]
+        phase_series = [
+            [total / count if count else None for total, count in zip(column, phase_counts)]
+            for column in phase_sums
+        ]
+        phase_totals = [math.fsum(column) for column in phase_sums]
+
+        total_count = sum(counts)
+        up_count = sum(ups)
+        total_response_time = math.fsum(response_sums)
+        phase_count = sum(phase_counts)
+        # Percentiles for the whole range come from merging the bucket sketches
+        bins = merge_all(sketches)
+        max_response_time = max((value for value in maxima if value is not None), default=None)
+
+    metrics = {
+        'avg_response_time': total_response_time / total_count if total_count else 0,
+        'response_time_percentiles': percentiles(bins, max_response_time),
+        'uptime': (up_count / total_count * 100) if total_count else 0,
+        'outage_count': total_count - up_count,
+        'avg_phases': {
+            name: (phase_totals[i] / phase_count if phase_count else None)
+            for i, name in enumerate(CHECK_PHASES)
+        }
+    }
+    return times, response_times, status_values, dict(zip(CHECK_PHASES, phase_series)), metrics, label
+
+
+def _downsampled_series(conn, service_id: int, time_range: str, max_points: Optional[int],
+                        span: Optional[tuple] = None):
+    times, response_times, status_values, phases, metrics, label = _service_series(
+        conn, service_id, time_range, span
+    )
+    if max_points:
+        times, response_times, status_values, phases = downsample(
+            times, response_times, status_values, phases, max_points
+        )
+    return times, response_times, status_values, phases, metrics, label
+
+
+def _time_labels(times, label: str) -> List[str]:
+    # Labels have minute precision, so each minute is formatted only once
+    labels = {}
+    result = []
+    for timestamp in times:
+        minute = timestamp // 60_000
+        text = labels.get(minute)
+        if text is None:
+            text = labels[minute] = from_ms(timestamp).strftime(label)
+        result.append(text)
+    return result
+
+
+def _service_metrics_payload(conn, service_id: int, time_range: str, max_points: Optional[int] = None,
+                             columnar: bool = False, span: Optional[tuple] = None):
+    times, response_times, status_values, phases, metrics, label = _downsampled_series(
+        conn, service_id, time_range, max_points, span
+    )
+    if columnar:
+        # Epoch milliseconds as offsets from the first point instead of labels
+        start = times[0] if times else 0
+        return {
+            'start': start,
+            'offsets': [timestamp - start for timestamp in times],
+            'response_times': response_times,
+            'status_values': status_values,
+            'phases': phases,
+            'metrics': metrics
+        }
+    return {
+        'timestamps': _time_labels(times, label),
+        'response_times': response_times,
+        'status_values': status_values,
+        'phases': phases,
+        'metrics': metrics
+    }
+
+
+def _service_metrics_binary(conn, service_id: int, time_range: str, max_points: Optional[int] = None,
+                            span: Optional[tuple] = None):
+    times, response_times, status_values, phases, metrics, _ = _downsampled_series(
+        conn, service_id, time_range, max_points, span
+    )
+    start = times[0] if times else 0
+    columns = {'response_times': response_times, 'status_values': status_values, **phases}
+    return encode_binary(start, [timestamp - start for timestamp in times], columns, {'metrics': metrics})
+
 
 @router.get("/service_metrics/{service_id}/{time_range}")
-async def get_service_metrics(service_id: int, time_range: str):
-   with get_db() as conn:
-       c = conn.cursor()
-       now = datetime.now()
-       
-       if time_range == 'hour':
-           start_time = now - timedelta(hours=1)
-       elif time_range == 'day': 
-           start_time = now - timedelta(days=1)
-       else:
-           start_time = now - timedelta(weeks=1)
-
-       checks = c.execute('''
-           SELECT timestamp, status, response_time
-           FROM checks 
-           WHERE service_id = ? AND timestamp >= ?
-           ORDER BY timestamp ASC
-       ''', (service_id, start_time.isoformat())).fetchall()
-
-       timestamps = []
-       response_times = []
-       status_values = []
-       outage_count = 0
-       total_response_time = 0
-       up_count = 0
-
-       for check in checks:
-           timestamps.append(datetime.fromisoformat(check[0]).strftime('%H:%M'))
-           response_times.append(check[2] if check[2] else 0)
-           status_value = 1 if check[1] == 'up' else 0
-           status_values.append(status_value)
-           
-           if check[2]:
-               total_response_time += check[2]
-           if status_value == 1:
-               up_count += 1
-           else:
-               outage_count += 1
-
-       metrics = {
-           'avg_response_time': total_response_time / len(checks) if checks else 0,
-           'uptime': (up_count / len(checks) * 100) if checks else 0,
-           'outage_count': outage_count
-       }
-
-       return {
-           'timestamps': timestamps,
-           'response_times': response_times,
-           'status_values': status_values,
-           'metrics': metrics
-       }
+async def get_service_metrics(request: Request, service_id: int, time_range: str,
+                              max_points: Optional[int] = Query(None, ge=3),
+                              layout: str = Query('json', alias='format'),
+                              start: Optional[int] = None, end: Optional[int] = None):
+    """``time_range`` is hour, day, week or month, or custom with ``start``/``end`` in epoch ms."""
+    if layout not in METRIC_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(METRIC_LAYOUTS)}")
+    span = None
+    if time_range == 'custom':
+        if start is None:
+            raise HTTPException(status_code=400, detail="custom ranges need a start")
+        span = (start, end if end is not None else now_ms() + 1)
+        if span[0] >= span[1]:
+            raise HTTPException(status_code=400, detail="start must be before end")
+    # The window slides with time, so entries also roll over each minute
+    key = ('service_metrics', service_id, time_range, span, max_points, layout, now_ms() // 60_000)
+    if layout == 'binary':
+        return await cached_body(request, key, 'application/octet-stream',
+                                 _service_metrics_binary, service_id, time_range, max_points, span)
+    return await cached_json(request, key, _service_metrics_payload,
+                             service_id, time_range, max_points, layout == 'columnar', span)
    
 
+def _get_service(conn, service_id: int):
+    return conn.execute('SELECT * FROM services WHERE id = ?', (service_id,)).fetchone()
+
 @router.post("/services/{service_id}/test")
 async def test_existing_service(service_id: int):
-    with get_db() as conn:
-        service = conn.execute('SELECT * FROM services WHERE id = ?', (service_id,)).fetchone()
-        if not service:
-            raise HTTPException(status_code=404, detail="Service not found")
-        
-        if service[2] == 'ping':
-            status, response_time = await check_ping(service[3])
-            details = {'method': 'ping'}
-        else:
-            status, response_time, details = await check_http(service[3])
+    service = await run_db(_get_service, service_id)
+    if not service:
+        raise HTTPException(status_code=404, detail="Service not found")
+    
+    if service[2] == 'ping':
+        status, response_time = await check_ping(service[3])
+        details = {'method': 'ping'}
+    else:
+        status, response_time, details = await check_http(service[3])
+    
+    # Record check through the monitor's single writer
+    current_time = now_ms()
+    await write(INSERT_CHECK_SQL, (
+        service_id,
+        current_time,
+        'up' if status else 'down',
+        response_time,
+        json.dumps(details)
+    ))
+
+    # If service is down, try to send alert
+    if not status:
+        await send_alert(service[7], service[1], 'down')
         
-        # Record check
-        current_time = datetime.now().isoformat()
-        try:
-            conn.execute('''
-                INSERT INTO checks 
-                (service_id, timestamp, status, response_time, details)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                service_id,
-                current_time,
-                'up' if status else 'down',
-                response_time,
-                json.dumps(details)
-            ))
-
-            # If service is down, try to send alert
-            if not status:
-                await send_alert(service[7], service[1], 'down')
-                
-            return {
-                "status": "up" if status else "down",
-                "response_time": response_time,
-                "details": details,
-                "alert_sent": not status,
-                "timestamp": current_time
-            }
-            
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e):
-                raise HTTPException(status_code=503, detail="Database is busy, please try again")
-            raise
+    return {
+        "status": "up" if status else "down",
+        "response_time": response_time,
+        "details": details,
+        "alert_sent": not status,
+        "timestamp": iso_from_ms(current_time)
+    }
 
 
 
-@router.get("/status_with_history")
-async def get_status_with_history():
-    with get_db() as conn:
-        c = conn.cursor()
-        services = c.execute('SELECT * FROM services').fetchall()
-        status_data = []
-        
-        for service in services:
-            service_id = service[0]
-            latest_check = c.execute('''
-                SELECT status, timestamp, response_time 
-                FROM checks 
-                WHERE service_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            ''', (service_id,)).fetchone()
-            
-            check_history = c.execute('''
-                SELECT status 
-                FROM checks 
-                WHERE service_id = ?
-                ORDER BY timestamp DESC 
-                LIMIT 100
-            ''', (service_id,)).fetchall()
-            
-            status_data.append({
-                "id": service_id,
-                "name": service[1],
-                "type": service[2],
-                "status": latest_check[0] if latest_check else "unknown",
-                "last_check": latest_check[1] if latest_check else None,
-                "response_time": latest_check[2] if latest_check else None,
-                "check_history": [check[0] for check in check_history]
-            })
-        
+def _status_with_history_payload(conn):
+    services = fetch_services_with_status(conn, with_history=True)
+    status_data = []
+    
+    for service in services:
+        status_data.append({
+            "id": service[0],
+            "name": service[1],
+            "type": service[2],
+            "status": service['last_status'] or "unknown",
+            "last_check": iso_from_ms(service['last_timestamp']),
+            "response_time": service['last_response_time'],
+            "check_history": decode_history(service['history'])
+        })
+    
     return {"services": status_data}
 
 
+@router.get("/status_with_history")
+async def get_status_with_history(request: Request):
+    return await cached_json(request, ('status_with_history',), _status_with_history_payload)
+
+
+@router.get("/events")
+async def stream_events(request: Request):
+    """Server-Sent Events: a 'check' event per completed check and a
+    'services' event whenever the service list changes."""
+    subscriber = broadcaster.subscribe()
+    return StreamingResponse(
+        broadcaster.stream(subscriber, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/monitor/stats")
+async def get_monitor_stats():
+    return {
+        "scheduler": get_scheduler_stats(),
+        "writer": get_writer_stats(),
+        "events": broadcaster.stats(),
+        "cache": response_cache.stats(),
+        "alerts": get_alert_stats(),
+        "cluster": cluster.stats(),
+        "agents": get_agent_stats(),
+        "archive": get_archive_stats()
+    }
+
+
+@router.post("/agents/lease", dependencies=[Depends(verify_agent)])
+async def lease_services(lease: AgentLease):
+    services = await run_db(lease_due_services, lease.agent_id, lease.max_services)
+    note_lease(lease.agent_id, len(services))
+    return {"services": [
+        {"id": service[0], "type": service[1], "target": service[2]}
+        for service in services
+    ]}
+
+
+def _decode_results(body: bytes, compressed: bool):
+    results = json.loads(gzip.decompress(body) if compressed else body)["results"]
+    if not all(isinstance(result, list) and len(result) == 5 for result in results):
+        raise ValueError("results must be [service_id, timestamp, status, response_time, details]")
+    return results
+
+@router.post("/agents/{agent_id}/results", dependencies=[Depends(verify_agent)])
+async def upload_results(agent_id: str, request: Request):
+    """Accepts ``{"results": [...]}``, gzip-compressed when Content-Encoding says so."""
+    body = await request.body()
+    try:
+        results = await run_cpu(
+            _decode_results, body, request.headers.get('content-encoding') == 'gzip'
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Malformed results batch")
+    services = await run_db(fetch_services_by_id, list({result[0] for result in results}))
+    accepted = await ingest_results(agent_id, services, results)
+    return {"accepted": accepted}
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
+def _get_smtp_config(conn):
+    return conn.execute("SELECT host, port, username, from_email, use_tls FROM smtp_config").fetchone()
+
+def _replace_smtp_config(conn, values):
+    conn.execute("DELETE FROM smtp_config")
+    conn.execute('''
+        INSERT INTO smtp_config (host, port, username, password, from_email, use_tls)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', values)
+
 #current_user: str = Depends(get_current_user)
 @router.get("/smtp")
 async def get_smtp_config():
-    with get_db() as conn:
-        config = conn.execute("SELECT host, port, username, from_email, use_tls FROM smtp_config").fetchone()
-        return {
-            "host": config[0] if config else "",
-            "port": config[1] if config else 587,
-            "username": config[2] if config else "",
-            "from_email": config[3] if config else "",
-            "use_tls": config[4] if config else True
-        }
+    config = await run_db(_get_smtp_config)
+    return {
+        "host": config[0] if config else "",
+        "port": config[1] if config else 587,
+        "username": config[2] if config else "",
+        "from_email": config[3] if config else "",
+        "use_tls": config[4] if config else True
+    }
 
 @router.post("/smtp")
 async def update_smtp_config(config: SMTPConfig):
-    with get_db() as conn:
-        conn.execute("DELETE FROM smtp_config")
-        conn.execute('''
-            INSERT INTO smtp_config (host, port, username, password, from_email, use_tls)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (config.host, config.port, config.username, config.password, 
-              config.from_email, config.use_tls))
+    await run_db(_replace_smtp_config, (
+        config.host, config.port, config.username, config.password, 
+        config.from_email, config.use_tls
+    ))
+    invalidate_smtp_config()
     return {"message": "SMTP configuration updated"}
 
 
 #current_user: str = Depends(get_current_user)
 @router.post("/smtp")
 async def update_smtp_config(config: SMTPConfig, current_user: str = Depends(get_current_user)):
-    with get_db() as conn:
-        conn.execute("DELETE FROM smtp_config")
-        conn.execute('''
-            INSERT INTO smtp_config (host, port, username, password, from_email, use_tls)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            config.host.strip(),
-            config.port,
-            config.username.strip(),
-            config.password.strip(),
-            config.from_email.strip(),
-            config.use_tls
-        ))
+    await run_db(_replace_smtp_config, (
+        config.host.strip(),
+        config.port,
+        config.username.strip(),
+        config.password.strip(),
+        config.from_email.strip(),
+        config.use_tls
+    ))
+    invalidate_smtp_config()
     return {"message": "SMTP configuration updated"}
 
 @router.post("/smtp/test")
 async def test_smtp():
-    with get_db() as conn:
-        config = conn.execute(
-            "SELECT host, port, username, password, from_email, use_tls FROM smtp_config"
-        ).fetchone()
-        
+    invalidate_smtp_config()
+    config = await run_db(load_smtp_config)
+
     if not config:
         raise HTTPException(status_code=400, detail="SMTP not configured")
     
-    host = config[0].strip().encode('ascii', 'ignore').decode()
-    port = config[1]
-    username = config[2].strip().encode('ascii', 'ignore').decode()
-    password = config[3].strip().encode('ascii', 'ignore').decode()
-    from_email = config[4].strip().encode('ascii', 'ignore').decode()
-    use_tls = config[5]
-    
     try:
-        with smtplib.SMTP(host, port, timeout=10) as server:
-            if use_tls:
-                server.starttls()
-            if username and password:
-                server.login(username, password)
-            
-            msg = MIMEText("Test email", 'plain', 'utf-8')
-            msg['Subject'] = 'Test Alert'
-            msg['From'] = from_email
-            msg['To'] = from_email
-            
-            server.send_message(msg)
+        # Blocking network I/O: not the database pool, nor the bcrypt pool logins wait on
+        await asyncio.to_thread(send_test_email, config)
         return {"message": "Test email sent successfully"}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error sending email: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=f"Error sending email: {str(e)}")
@@ -0,0 +1,217 @@
+# scheduler.py
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .metrics import Counter, Histogram, LAG_BUCKETS
+
+SCHEDULER_LAG = Histogram(
+    'monitor_scheduler_lag_seconds',
+    'Delay between a check falling due and starting.',
+    buckets=LAG_BUCKETS,
+).labels()
+_outcomes = Counter(
+    'monitor_scheduler_checks_abandoned',
+    'Checks that timed out, raised or were skipped because the previous run was still going.',
+    ('reason',),
+)
+CHECKS_TIMED_OUT = _outcomes.labels('timeout')
+CHECKS_FAILED = _outcomes.labels('error')
+CHECKS_SKIPPED = _outcomes.labels('overlap')
+
+
+class CheckScheduler:
+    """Runs every service on its own interval.
+
+    Next-due times live in a min-heap keyed on a monotonic clock, so the loop
+    only wakes up when the earliest service is due. Each service is rescheduled
+    relative to its previous due time (not to when its check finished), which
+    keeps slow targets from drifting the schedule. The next run is queued when
+    a check starts; if the check's result changes the service's interval, that
+    run is moved to match once the check finishes. Heap entries are invalidated
+    lazily: ``_due`` holds the authoritative due time per service and any popped
+    entry that does not match it is discarded.
+    """
+
+    def __init__(
+        self,
+        run_check: Callable[[Any], Awaitable[Any]],
+        interval_for: Callable[[Any], float],
+        max_concurrency: int = 100,
+        check_timeout: float = 30.0,
+        jitter: float = 0.1,
+    ):
+        self._run_check = run_check
+        self._interval_for = interval_for
+        self._check_timeout = check_timeout
+        self._jitter = jitter
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._heap: List[Tuple[float, int, int]] = []
+        self._seq = itertools.count()
+        self._services: Dict[int, Any] = {}
+        self._due: Dict[int, float] = {}
+        self._inflight: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+        self.checks_started = 0
+        self.checks_timed_out = 0
+        self.checks_failed = 0
+        self.checks_skipped = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self._lag_total = 0.0
+
+    def _push(self, service_id: int, due: float):
+        self._due[service_id] = due
+        heapq.heappush(self._heap, (due, next(self._seq), service_id))
+
+    def _next_due(self, due: float, interval: float, now: float) -> float:
+        spread = interval * self._jitter
+        next_due = due + interval + random.uniform(-spread, spread)
+        if next_due <= now:
+            # We fell more than a whole interval behind; skip the missed runs
+            # instead of firing them back to back.
+            next_due = now + interval
+        return next_due
+
+    def upsert(self, service: Any):
+        """Add a service, or update it in place keeping its phase when possible."""
+        service_id = service[0]
+        now = time.monotonic()
+        interval = self._interval_for(service)
+        previous = self._services.get(service_id)
+        self._services[service_id] = service
+
+        if previous is None:
+            # Spread new services uniformly over their first interval so a
+            # fresh start does not check everything at once.
+            self._push(service_id, now + random.uniform(0, interval))
+        elif self._interval_for(previous) != interval:
+            self._push(service_id, min(self._due[service_id], now + interval))
+        else:
+            return
+        self._wakeup.set()
+
+    def expedite(self, service_id: int, delay: float) -> bool:
+        """Run a service within ``delay`` seconds if it is not due sooner.
+
+        Its regular interval then resumes from that run.
+        """
+        due = self._due.get(service_id)
+        target = time.monotonic() + delay
+        if due is None or target >= due:
+            return False
+        self._push(service_id, target)
+        self._wakeup.set()
+        return True
+
+    def remove(self, service_id: int):
+        self._services.pop(service_id, None)
+        self._due.pop(service_id, None)
+
+    def sync(self, services: Iterable[Any]):
+        """Make the scheduled set match ``services`` exactly."""
+        seen = set()
+        for service in services:
+            seen.add(service[0])
+            self.upsert(service)
+        for service_id in list(self._services):
+            if service_id not in seen:
+                self.remove(service_id)
+
+    def services(self) -> List[Any]:
+        return list(self._services.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'services': len(self._services),
+            'in_flight': len(self._inflight),
+            'checks_started': self.checks_started,
+            'checks_timed_out': self.checks_timed_out,
+            'checks_failed': self.checks_failed,
+            'checks_skipped': self.checks_skipped,
+            'lag_last': self.lag_last,
+            'lag_max': self.lag_max,
+            'lag_avg': self._lag_total / self.checks_started if self.checks_started else 0.0,
+        }
+
+    def _reschedule(self, service_id: int, due: float, interval: float, queued: float):
+        """Requeue a run queued at ``queued`` if the service's interval has changed since."""
+        service = self._services.get(service_id)
+        if service is None or self._due.get(service_id) != queued:
+            # Removed, updated or expedited while the check ran
+            return
+        current = self._interval_for(service)
+        if current != interval:
+            self._push(service_id, self._next_due(due, current, time.monotonic()))
+            self._wakeup.set()
+
+    async def _execute(self, service: Any, due: float, interval: float, queued: float):
+        service_id = service[0]
+        try:
+            async with self._semaphore:
+                lag = max(0.0, time.monotonic() - due)
+                self.checks_started += 1
+                self.lag_last = lag
+                self.lag_max = max(self.lag_max, lag)
+                self._lag_total += lag
+                SCHEDULER_LAG.observe(lag)
+                await asyncio.wait_for(self._run_check(service), self._check_timeout)
+            self._reschedule(service_id, due, interval, queued)
+        except asyncio.TimeoutError:
+            self.checks_timed_out += 1
+            CHECKS_TIMED_OUT.inc()
+            print(f"Check for service {service_id} exceeded {self._check_timeout}s deadline")
+        except Exception as e:
+            self.checks_failed += 1
+            CHECKS_FAILED.inc()
+            print(f"Check for service {service_id} failed: {str(e)}")
+        finally:
+            self._inflight.discard(service_id)
+
+    def _dispatch(self, now: float):
+        while self._heap and self._heap[0][0] <= now:
+            due, _, service_id = heapq.heappop(self._heap)
+            if self._due.get(service_id) != due:
+                continue
+
+            service = self._services[service_id]
+            interval = self._interval_for(service)
+            queued = self._next_due(due, interval, now)
+            self._push(service_id, queued)
+
+            if service_id in self._inflight:
+                # Previous check is still running; never overlap one service.
+                self.checks_skipped += 1
+                CHECKS_SKIPPED.inc()
+                continue
+
+            self._inflight.add(service_id)
+            task = asyncio.create_task(self._execute(service, due, interval, queued))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            self._dispatch(now)
+
+            timeout: Optional[float] = None
+            if self._heap:
+                timeout = max(0.0, self._heap[0][0] - time.monotonic())
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,109 @@
+# series.py
+"""Downsampling and compact encodings for metric time series."""
+import json
+import math
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+# Version 2 widened offsets to uint64; uint32 ms overflowed past ~49.7 days.
+BINARY_MAGIC = b'SVM2'
+# magic, point count, start timestamp (ms), metadata length
+BINARY_HEADER = struct.Struct('<4sIqI')
+
+
+def lttb_buckets(n: int, threshold: int) -> List[int]:
+    """Bucket edges LTTB uses to reduce ``n`` points to ``threshold``.
+
+    The first and last points are buckets of their own; the ones between
+    split the remaining points evenly. Edge ``i`` to ``i + 1`` is bucket ``i``.
+    """
+    every = (n - 2) / (threshold - 2)
+    return [0] + [1 + int(i * every) for i in range(threshold - 2)] + [n - 1, n]
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps.
+
+    From each bucket it keeps the point forming the largest triangle with
+    the point kept from the previous bucket and the average of the next, so
+    spikes and dips survive where plain striding or averaging would drop
+    them.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    edges = lttb_buckets(n, threshold)
+    kept = [0]
+    a = 0
+    for bucket in range(1, threshold - 1):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        span = next_end - next_start
+        avg_x = math.fsum(xs[next_start:next_end]) / span
+        avg_y = math.fsum(ys[next_start:next_end]) / span
+
+        ax, ay = xs[a], ys[a]
+        dx, dy = avg_x - ax, avg_y - ay
+        # Twice the triangle area, up to sign; the constant factor is irrelevant
+        areas = [abs(dx * (y - ay) - (x - ax) * dy) for x, y in zip(xs[start:end], ys[start:end])]
+        a = start + areas.index(max(areas))
+        kept.append(a)
+    kept.append(n - 1)
+    return kept
+
+
+def downsample(times: Sequence[int], response_times: Sequence[float], status_values: Sequence[float],
+               phases: Dict[str, Sequence[Optional[float]]], max_points: int) -> tuple:
+    """Reduce the series to at most ``max_points`` with LTTB on response time.
+
+    Each kept point reports the lowest status in its bucket, so a short
+    outage is never smoothed away by a neighbouring healthy check.
+    """
+    n = len(times)
+    if n <= max_points or max_points < 3:
+        return times, response_times, status_values, phases
+
+    indices = lttb(times, response_times, max_points)
+    edges = lttb_buckets(n, max_points)
+    return (
+        [times[i] for i in indices],
+        [response_times[i] for i in indices],
+        [min(status_values[edges[b]:edges[b + 1]]) for b in range(len(indices))],
+        {name: [series[i] for i in indices] for name, series in phases.items()},
+    )
+
+
+def pack_array(typecode: str, values) -> bytes:
+    """``values`` as a little-endian packed ``array`` of ``typecode``."""
+    packed = array(typecode, values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_array(typecode: str, buffer, offset: int, count: int) -> array:
+    """The inverse of ``pack_array`` for ``count`` items at ``offset`` in ``buffer``."""
+    unpacked = array(typecode)
+    unpacked.frombytes(buffer[offset:offset + unpacked.itemsize * count])
+    if sys.byteorder != 'little':
+        unpacked.byteswap()
+    return unpacked
+
+
+def encode_binary(start: int, offsets: Sequence[int], columns: Dict[str, Sequence[Optional[float]]],
+                  metadata: dict) -> bytes:
+    """Pack a columnar series into one little-endian binary frame.
+
+    Layout: header (``BINARY_HEADER``), UTF-8 JSON metadata, ``uint64``
+    millisecond offsets from ``start``, then one ``float32`` array per
+    column in ``metadata['columns']`` order, with NaN for missing values.
+    """
+    meta = json.dumps(dict(metadata, columns=list(columns))).encode()
+    parts = [BINARY_HEADER.pack(BINARY_MAGIC, len(offsets), start, len(meta)), meta,
+             pack_array('Q', offsets)]
+    for values in columns.values():
+        parts.append(pack_array('f', (math.nan if v is None else v for v in values)))
+    return b''.join(parts)
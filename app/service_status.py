@@ -0,0 +1,78 @@
+# service_status.py
+from typing import Dict, List
+
+from .database import register_check_hook
+
+HISTORY_LENGTH = 100
+
+# Check history is kept as one character per check, oldest first.
+_STATUS_CODES = {'up': 'u', 'down': 'd'}
+_CODE_STATUSES = {code: status for status, code in _STATUS_CODES.items()}
+
+UPSERT_STATUS_SQL = f'''
+    INSERT INTO service_status
+    (service_id, status, timestamp, response_time, history)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (service_id) DO UPDATE SET
+        status = CASE WHEN excluded.timestamp >= timestamp THEN excluded.status ELSE status END,
+        response_time = CASE WHEN excluded.timestamp >= timestamp
+                             THEN excluded.response_time ELSE response_time END,
+        timestamp = max(timestamp, excluded.timestamp),
+        history = substr(history || excluded.history, -{HISTORY_LENGTH})
+'''
+
+
+def _encode(status: str) -> str:
+    return _STATUS_CODES.get(status, '?')
+
+
+def decode_history(history: str) -> List[str]:
+    """Return statuses newest first, as the API has always listed them."""
+    return [_CODE_STATUSES.get(code, 'unknown') for code in reversed(history or '')]
+
+
+def apply_latest_status(conn, rows):
+    """Advance each service's latest status and history ring by one batch."""
+    per_service: Dict[int, list] = {}
+    for service_id, timestamp, status, response_time, _ in rows:
+        per_service.setdefault(service_id, []).append((timestamp, status, response_time))
+
+    updates = []
+    for service_id, checks in per_service.items():
+        checks.sort(key=lambda check: check[0])
+        timestamp, status, response_time = checks[-1]
+        history = ''.join(_encode(check[1]) for check in checks[-HISTORY_LENGTH:])
+        updates.append((service_id, status, timestamp, response_time, history))
+    conn.executemany(UPSERT_STATUS_SQL, updates)
+
+
+# History rings only make sense when checks arrive in time order, so
+# backfills rebuild the table instead (see rebuild_service_status).
+register_check_hook(apply_latest_status, backfill=False)
+
+
+def rebuild_service_status(conn):
+    """Recompute every service's latest status and history from ``checks``."""
+    recent = conn.execute(f'''
+        SELECT service_id, timestamp, status, response_time FROM (
+            SELECT service_id, timestamp, status, response_time,
+                   ROW_NUMBER() OVER (PARTITION BY service_id ORDER BY timestamp DESC) AS rn
+            FROM checks
+        )
+        WHERE rn <= {HISTORY_LENGTH}
+        ORDER BY service_id, timestamp ASC
+    ''').fetchall()
+    conn.execute('DELETE FROM service_status')
+    apply_latest_status(conn, [tuple(row) + (None,) for row in recent])
+
+
+def fetch_services_with_status(conn, with_history: bool = False) -> List:
+    """All services joined with their latest check, in a single query."""
+    history = ', st.history' if with_history else ''
+    return conn.execute(f'''
+        SELECT s.*, st.status AS last_status, st.timestamp AS last_timestamp,
+               st.response_time AS last_response_time{history}
+        FROM services s
+        LEFT JOIN service_status st ON st.service_id = s.id
+        ORDER BY s.id
+    ''').fetchall()
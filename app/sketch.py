@@ -0,0 +1,120 @@
+# sketch.py
+"""Mergeable response-time sketches for percentiles over rollup buckets.
+
+A sketch counts values in logarithmic bins (as in DDSketch): bin ``k``
+holds values in ``(GAMMA ** (k - 1), GAMMA ** k]``, so every quantile it
+reports is within ``RELATIVE_ACCURACY`` of a real value. Merging two
+sketches adds their counts, which is what lets any range be answered by
+combining per-bucket sketches instead of reading raw checks.
+
+Encoded sketches are little-endian ``int16`` bin keys followed by the
+matching ``uint32`` counts.
+"""
+import math
+from typing import Dict, Iterable, Optional, Sequence
+
+from .series import pack_array, unpack_array
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+# Values at or below this (seconds) share one bin, keeping keys in int16
+MIN_VALUE = 1e-6
+ZERO_KEY = math.floor(math.log(MIN_VALUE) / _LOG_GAMMA)
+# Past this many bins the lowest ones are folded together, bounding size
+MAX_BINS = 1024
+
+PERCENTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+
+def sketch_key(value: float) -> int:
+    """The bin ``value`` counts in."""
+    if value <= MIN_VALUE:
+        return ZERO_KEY
+    return max(ZERO_KEY, math.ceil(math.log(value) / _LOG_GAMMA))
+
+
+def _value(key: int) -> float:
+    if key <= ZERO_KEY:
+        return 0.0
+    # The point with the same relative distance to both bin edges
+    return 2 * GAMMA ** key / (GAMMA + 1)
+
+
+def add_values(bins: Dict[int, int], values: Iterable[float]) -> Dict[int, int]:
+    """Count ``values`` into ``bins`` in place; None is skipped."""
+    for value in values:
+        if value is not None:
+            key = sketch_key(value)
+            bins[key] = bins.get(key, 0) + 1
+    return bins
+
+
+def encode(bins: Dict[int, int]) -> Optional[bytes]:
+    if not bins:
+        return None
+    keys = sorted(bins)
+    if len(keys) > MAX_BINS:
+        # Collapse the lowest bins into the first one kept
+        cut = len(keys) - MAX_BINS
+        bins = dict(bins)
+        bins[keys[cut]] += sum(bins.pop(key) for key in keys[:cut])
+        keys = keys[cut:]
+    return pack_array('h', keys) + pack_array('I', (bins[key] for key in keys))
+
+
+def decode(data: Optional[bytes], bins: Optional[Dict[int, int]] = None) -> Dict[int, int]:
+    """The bins in ``data``, added into ``bins`` if one is given."""
+    if bins is None:
+        bins = {}
+    if data:
+        count = len(data) // 6
+        for key, n in zip(unpack_array('h', data, 0, count), unpack_array('I', data, 2 * count, count)):
+            bins[key] = bins.get(key, 0) + n
+    return bins
+
+
+def merge_encoded(left: Optional[bytes], right: Optional[bytes]) -> Optional[bytes]:
+    """Merge two encoded sketches; registered with SQLite as ``sketch_merge``."""
+    if not left:
+        return right
+    if not right:
+        return left
+    return encode(decode(right, decode(left)))
+
+
+def register_functions(conn):
+    conn.create_function('sketch_merge', 2, merge_encoded, deterministic=True)
+
+
+def merge_all(sketches: Iterable[Optional[bytes]]) -> Dict[int, int]:
+    bins: Dict[int, int] = {}
+    for data in sketches:
+        decode(data, bins)
+    return bins
+
+
+def quantiles(bins: Dict[int, int], qs: Sequence[float]) -> list:
+    """Values at each quantile in ``qs`` (ascending), or Nones when ``bins`` is empty."""
+    total = sum(bins.values())
+    if not total:
+        return [None] * len(qs)
+    results = []
+    keys = iter(sorted(bins))
+    key = next(keys)
+    seen = bins[key]
+    for q in qs:
+        rank = q * (total - 1)
+        while seen <= rank:
+            key = next(keys)
+            seen += bins[key]
+        results.append(_value(key))
+    return results
+
+
+def percentiles(bins: Dict[int, int], maximum: Optional[float]) -> Dict[str, Optional[float]]:
+    """``PERCENTILES`` from ``bins``, capped at the exact ``maximum``, plus the maximum."""
+    values = quantiles(bins, list(PERCENTILES.values()))
+    if maximum is not None:
+        values = [None if value is None else min(value, maximum) for value in values]
+    return dict(zip(PERCENTILES, values), max=maximum)
@@ -0,0 +1,128 @@
+# state.py
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional
+
+
+class ServiceState:
+    """What the alert logic needs to know about one service.
+
+    ``failures`` holds the times of the trailing run of consecutive down
+    checks, capped at the retry threshold, so deciding whether to alert is
+    a constant-time look at its oldest entry. All times are epoch
+    milliseconds, matching the ``checks`` table.
+    """
+
+    __slots__ = ('last_status', 'last_alert_at', 'failures')
+
+    def __init__(self, last_status: Optional[str] = None, last_alert_at: Optional[int] = None,
+                 failures: Iterable[int] = (), threshold: int = 1):
+        self.last_status = last_status
+        self.last_alert_at = last_alert_at
+        self.failures: Deque[int] = deque(failures, maxlen=max(threshold, 1))
+
+    def observe(self, is_up: bool, now: int, threshold: int, grace_ms: int) -> Optional[str]:
+        """Record a check result and return ``'down'``, ``'recovery'`` or None.
+
+        A down alert fires once the last ``threshold`` checks all failed
+        within the grace period, and at most once per grace period. A
+        recovery alert fires on the first up check after a down one.
+        """
+        previous_status = self.last_status
+        self.last_status = 'up' if is_up else 'down'
+
+        if is_up:
+            self.failures.clear()
+            return 'recovery' if previous_status == 'down' else None
+
+        if self.failures.maxlen != max(threshold, 1):
+            self.failures = deque(self.failures, maxlen=max(threshold, 1))
+        self.failures.append(now)
+
+        if len(self.failures) < threshold or self.failures[0] <= now - grace_ms:
+            return None
+        if self.last_alert_at is not None and now - self.last_alert_at < grace_ms:
+            return None
+
+        self.last_alert_at = now
+        return 'down'
+
+
+_states: Dict[int, ServiceState] = {}
+
+
+def load_service_states(conn, services: Iterable) -> Dict[int, ServiceState]:
+    """Rebuild every service's state from check and alert history in one pass."""
+    thresholds = {service[0]: service[5] or 1 for service in services}
+    if not thresholds:
+        return _states
+    depth = max(thresholds.values())
+
+    recent = conn.execute('''
+        SELECT service_id, timestamp, status FROM (
+            SELECT service_id, timestamp, status,
+                   ROW_NUMBER() OVER (PARTITION BY service_id ORDER BY timestamp DESC) AS rn
+            FROM checks
+        )
+        WHERE rn <= ?
+        ORDER BY service_id, timestamp DESC
+    ''', (depth,)).fetchall()
+    last_alerts = conn.execute('''
+        SELECT service_id, MAX(timestamp) FROM alerts GROUP BY service_id
+    ''').fetchall()
+
+    history: Dict[int, list] = {}
+    for service_id, timestamp, status in recent:
+        history.setdefault(service_id, []).append((timestamp, status))
+    alerted = {row[0]: row[1] for row in last_alerts if row[1] is not None}
+
+    for service_id, threshold in thresholds.items():
+        _states[service_id] = _build_state(
+            history.get(service_id, []), alerted.get(service_id), threshold
+        )
+    return _states
+
+
+def _build_state(history: list, last_alert_at: Optional[int], threshold: int) -> ServiceState:
+    """``history`` is newest first, as ``(timestamp, status)`` pairs."""
+    failures = []
+    for timestamp, status in history[:threshold]:
+        if status != 'down':
+            break
+        failures.append(timestamp)
+    failures.reverse()
+    return ServiceState(
+        last_status=history[0][1] if history else None,
+        last_alert_at=last_alert_at,
+        failures=failures,
+        threshold=threshold,
+    )
+
+
+def get_service_state(service_id: int) -> Optional[ServiceState]:
+    return _states.get(service_id)
+
+
+def load_service_state(conn, service_id: int, threshold: int) -> ServiceState:
+    """Load one service's state from history; used for services added after startup."""
+    history = conn.execute('''
+        SELECT timestamp, status FROM checks
+        WHERE service_id = ?
+        ORDER BY timestamp DESC LIMIT ?
+    ''', (service_id, max(threshold, 1))).fetchall()
+    last_alert = conn.execute('''
+        SELECT MAX(timestamp) FROM alerts WHERE service_id = ?
+    ''', (service_id,)).fetchone()
+    state = _build_state(
+        [tuple(row) for row in history],
+        last_alert[0] if last_alert else None,
+        threshold,
+    )
+    _states[service_id] = state
+    return state
+
+
+def prune_service_states(active_ids: Iterable[int]):
+    active = set(active_ids)
+    for service_id in list(_states):
+        if service_id not in active:
+            del _states[service_id]
@@ -0,0 +1,161 @@
+# transitions.py
+"""Up/down transitions per service, for uptime and SLA over any range.
+
+``status_transitions`` holds one row each time a service changes between
+up and not up; the status holds from that row's timestamp until the next
+one. SLA figures then come from a handful of intervals per service rather
+than from every check in the range.
+"""
+from typing import Dict, List, Optional, Sequence
+
+from .database import get_db, register_check_hook
+
+INSERT_TRANSITION_SQL = '''
+    INSERT OR IGNORE INTO status_transitions (service_id, timestamp, up)
+    VALUES (?, ?, ?)
+'''
+
+
+def apply_status_transitions(conn, rows):
+    """Record a transition wherever a batch changes a service's status.
+
+    Checks are compared with the service's latest transition, in time
+    order. One older than that transition arrived too late to place, and is
+    left to the raw history.
+    """
+    per_service: Dict[int, list] = {}
+    for service_id, timestamp, status, _, _ in rows:
+        if timestamp is not None:
+            per_service.setdefault(service_id, []).append((timestamp, status == 'up'))
+
+    inserts = []
+    for service_id, checks in per_service.items():
+        latest = conn.execute('''
+            SELECT timestamp, up FROM status_transitions
+            WHERE service_id = ? ORDER BY timestamp DESC LIMIT 1
+        ''', (service_id,)).fetchone()
+        since, up = latest if latest is not None else (None, None)
+        checks.sort()
+        for timestamp, check_up in checks:
+            if since is not None and timestamp < since:
+                continue
+            if check_up != up:
+                inserts.append((service_id, timestamp, check_up))
+                since, up = timestamp, check_up
+    if inserts:
+        conn.executemany(INSERT_TRANSITION_SQL, inserts)
+
+
+# Like service_status, transitions assume checks arrive in time order, so
+# backfills rebuild the table instead (see rebuild_status_transitions).
+register_check_hook(apply_status_transitions, backfill=False)
+
+
+def rebuild_status_transitions(conn):
+    """Recompute every transition from ``checks``."""
+    conn.execute('DELETE FROM status_transitions')
+    conn.execute('''
+        INSERT OR IGNORE INTO status_transitions (service_id, timestamp, up)
+        SELECT service_id, timestamp, up FROM (
+            SELECT service_id, timestamp, status = 'up' AS up,
+                   LAG(status = 'up') OVER (PARTITION BY service_id ORDER BY timestamp) AS previous
+            FROM checks
+            WHERE timestamp IS NOT NULL
+        )
+        WHERE previous IS NULL OR previous != up
+    ''')
+
+
+def prune_transitions(cutoff: int, batch_size: int) -> int:
+    """Delete transitions superseded before ``cutoff``, keeping the one in effect then."""
+    conn = get_db()
+    try:
+        with conn:
+            return conn.execute('''
+                DELETE FROM status_transitions
+                WHERE (service_id, timestamp) IN (
+                    SELECT t.service_id, t.timestamp FROM status_transitions t
+                    WHERE t.timestamp < ? AND EXISTS (
+                        SELECT 1 FROM status_transitions n
+                        WHERE n.service_id = t.service_id
+                          AND n.timestamp > t.timestamp AND n.timestamp <= ?
+                    )
+                    LIMIT ?
+                )
+            ''', (cutoff, cutoff, batch_size)).rowcount
+    finally:
+        conn.close()
+
+
+def fetch_transitions(conn, service_ids: Optional[Sequence[int]], start: int, end: int) -> Dict[int, list]:
+    """Each service's ``(timestamp, up)`` transitions in ``[start, end)``, led by the one in effect at ``start``."""
+    where = ''
+    params: tuple = (start, start, end)
+    if service_ids is not None:
+        where = f"AND t.service_id IN ({','.join('?' * len(service_ids))})"
+        params += tuple(service_ids)
+    transitions: Dict[int, list] = {}
+    for service_id, timestamp, up in conn.execute(f'''
+        SELECT t.service_id, t.timestamp, t.up FROM status_transitions t
+        WHERE t.timestamp >= coalesce((
+                SELECT max(p.timestamp) FROM status_transitions p
+                WHERE p.service_id = t.service_id AND p.timestamp <= ?
+            ), ?)
+          AND t.timestamp < ? {where}
+        ORDER BY t.service_id, t.timestamp
+    ''', params):
+        transitions.setdefault(service_id, []).append((timestamp, up))
+    return transitions
+
+
+def _outages(transitions: List[tuple], start: int, end: int):
+    """Up time, monitored time and ``(duration, recovered)`` outages, clipped to ``[start, end)``."""
+    up_ms = monitored_ms = 0
+    outages = []
+    boundaries = [timestamp for timestamp, _ in transitions[1:]] + [end]
+    for (timestamp, up), until in zip(transitions, boundaries):
+        duration = min(until, end) - max(timestamp, start)
+        if duration <= 0:
+            continue
+        monitored_ms += duration
+        if up:
+            up_ms += duration
+        else:
+            outages.append((duration, until < end))
+    return up_ms, monitored_ms, outages
+
+
+def _summary(up_ms: int, monitored_ms: int, outages: List[tuple]) -> dict:
+    recovered = [duration for duration, ended in outages if ended]
+    return {
+        'uptime': up_ms / monitored_ms * 100 if monitored_ms else None,
+        'monitored_ms': monitored_ms,
+        'downtime_ms': monitored_ms - up_ms,
+        'outage_count': len(outages),
+        'mttr_ms': sum(recovered) / len(recovered) if recovered else None,
+        'longest_outage_ms': max((duration for duration, _ in outages), default=0),
+    }
+
+
+def sla_report(conn, service_ids: Optional[Sequence[int]], start: int, end: int) -> dict:
+    """Uptime, outage count, MTTR and longest outage per service and overall.
+
+    Time before a service's first transition is not monitored and counts
+    neither way. Outages are clipped to the range; MTTR only covers those
+    that recovered within it.
+    """
+    services = {}
+    total_up = total_monitored = 0
+    all_outages = []
+    for service_id, transitions in fetch_transitions(conn, service_ids, start, end).items():
+        up_ms, monitored_ms, outages = _outages(transitions, start, end)
+        services[service_id] = _summary(up_ms, monitored_ms, outages)
+        total_up += up_ms
+        total_monitored += monitored_ms
+        all_outages.extend(outages)
+    return {
+        'start': start,
+        'end': end,
+        'services': services,
+        'overall': _summary(total_up, total_monitored, all_outages),
+    }
@@ -0,0 +1,214 @@
+# writer.py
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .database import get_db, db_session, run_check_hooks
+from .metrics import Counter, Gauge, Histogram, SIZE_BUCKETS
+# Imported for their check hooks, which keep derived tables in step.
+from . import rollups, service_status, transitions  # noqa: F401
+
+INSERT_CHECK_SQL = '''
+    INSERT INTO checks
+    (service_id, timestamp, status, response_time, details)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+INSERT_ALERT_SQL = '''
+    INSERT INTO alerts
+    (service_id, timestamp, type, details)
+    VALUES (?, ?, ?, ?)
+'''
+
+INSERT_ERROR_SQL = '''
+    INSERT INTO errors (timestamp, error)
+    VALUES (?, ?)
+'''
+
+WRITER_BATCH_SIZE = int(os.environ.get('MONITOR_WRITER_BATCH_SIZE', '500'))
+WRITER_FLUSH_INTERVAL = float(os.environ.get('MONITOR_WRITER_FLUSH_INTERVAL', '0.5'))
+WRITER_QUEUE_SIZE = int(os.environ.get('MONITOR_WRITER_QUEUE_SIZE', '20000'))
+WRITER_MAX_RETRIES = 3
+
+WRITE_SECONDS = Histogram(
+    'monitor_db_write_seconds',
+    'Time to commit one writer batch, including check hooks.',
+).labels()
+BATCH_ROWS = Histogram(
+    'monitor_db_batch_rows',
+    'Rows per writer batch.',
+    buckets=SIZE_BUCKETS,
+).labels()
+ROWS_DROPPED = Counter(
+    'monitor_db_rows_dropped',
+    'Rows lost because their batch failed to write.',
+).labels()
+
+
+class BatchWriter:
+    """Single writer for every monitor insert.
+
+    Producers put ``(sql, params)`` pairs on a bounded queue; ``put`` blocks
+    when the queue is full, which pushes back on the checks producing rows.
+    One task drains the queue whenever a full batch is waiting or the flush
+    interval elapses and writes the batch with ``executemany`` in a single
+    transaction. SQLite runs on a dedicated thread with its own connection,
+    so commits never block the event loop and there is exactly one writer.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = WRITER_BATCH_SIZE,
+        flush_interval: float = WRITER_FLUSH_INTERVAL,
+        max_queue: int = WRITER_QUEUE_SIZE,
+    ):
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_ready = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.batches_written = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.last_batch_size = 0
+        self.last_write_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then release the connection."""
+        self._stopping = True
+        self._batch_ready.set()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close_connection)
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, sql: str, params: Sequence[Any]):
+        await self._queue.put((sql, params))
+        if self._queue.qsize() >= self._batch_size:
+            self._batch_ready.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not (self._stopping and self._queue.empty()):
+            if self._queue.qsize() < self._batch_size and not self._stopping:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self._flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = []
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch:
+                await loop.run_in_executor(self._executor, self._write_batch, batch)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = get_db()
+        return self._conn
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _write_batch(self, batch: List[Tuple[str, Sequence[Any]]]):
+        grouped: Dict[str, List[Sequence[Any]]] = {}
+        for sql, params in batch:
+            grouped.setdefault(sql, []).append(params)
+
+        started = time.perf_counter()
+        for attempt in range(WRITER_MAX_RETRIES):
+            conn = self._connection()
+            try:
+                with conn:
+                    for sql, rows in grouped.items():
+                        conn.executemany(sql, rows)
+                        if sql == INSERT_CHECK_SQL:
+                            run_check_hooks(conn, rows)
+                break
+            except sqlite3.OperationalError as e:
+                if attempt + 1 < WRITER_MAX_RETRIES and 'locked' in str(e):
+                    time.sleep(0.1 * (attempt + 1))
+                    continue
+                print(f"Failed to write {len(batch)} rows: {str(e)}")
+                self.rows_dropped += len(batch)
+                ROWS_DROPPED.inc(len(batch))
+                return
+            except sqlite3.Error as e:
+                print(f"Failed to write {len(batch)} rows: {str(e)}")
+                self.rows_dropped += len(batch)
+                ROWS_DROPPED.inc(len(batch))
+                return
+
+        self.batches_written += 1
+        self.rows_written += len(batch)
+        self.last_batch_size = len(batch)
+        self.last_write_seconds = time.perf_counter() - started
+        WRITE_SECONDS.observe(self.last_write_seconds)
+        BATCH_ROWS.observe(len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_size': self._queue.qsize(),
+            'batches_written': self.batches_written,
+            'rows_written': self.rows_written,
+            'rows_dropped': self.rows_dropped,
+            'last_batch_size': self.last_batch_size,
+            'last_write_seconds': self.last_write_seconds,
+        }
+
+
+writer: Optional[BatchWriter] = None
+
+Gauge(
+    'monitor_db_queue_rows',
+    'Rows waiting for the writer.',
+    fn=lambda: writer.stats()['queue_size'] if writer else 0,
+)
+
+
+async def start_writer():
+    global writer
+    if writer is None or not writer.running:
+        writer = BatchWriter()
+        writer.start()
+
+
+async def stop_writer():
+    global writer
+    if writer is not None:
+        await writer.stop()
+        writer = None
+
+
+async def write(sql: str, params: Sequence[Any]):
+    """Queue a row for the writer, or write it directly if the writer is not running."""
+    if writer is not None and writer.running:
+        await writer.submit(sql, params)
+        return
+    with db_session() as conn:
+        conn.execute(sql, params)
+
+
+def get_writer_stats() -> Dict[str, Any]:
+    return writer.stats() if writer else {}
@@ -0,0 +1,136 @@
+"""Check throughput as probe agents are added.
+
+    python bench/bench_agents.py --agents 1 2 4 --services 2000
+
+Starts a server with MONITOR_REMOTE_PROBES=1 on a throwaway database, a
+local HTTP target that answers after --delay seconds, and then 1, 2, 4...
+agent processes. Every service is due each second, so demand exceeds
+what one agent can do at --concurrency; checks per second should grow
+roughly linearly with the number of agents until demand is met.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from aiohttp import web
+
+from app.database import init_db, now_ms
+
+
+def start_target(port, delay):
+    async def handle(request):
+        await asyncio.sleep(delay)
+        return web.Response(text='ok')
+
+    async def serve():
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port, backlog=4096).start()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+
+
+def seed(path, services, target_port):
+    init_db(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany('''
+            INSERT INTO services
+            (name, type, target, check_frequency, retry_threshold, grace_period, alert_email)
+            VALUES (?, 'http', ?, 1, 3, 5, 'ops@example.com')
+        ''', [(f'service-{i}', f'http://127.0.0.1:{target_port}/{i}') for i in range(services)])
+    conn.close()
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def count_checks(path, since):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM checks WHERE timestamp >= ?', (since,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--agents', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--services', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50, help='checks in flight per agent')
+    parser.add_argument('--delay', type=float, default=0.1, help='target response time, seconds')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8790)
+    args = parser.parse_args()
+
+    target_port = args.port + 1
+    start_target(target_port, args.delay)
+    server_url = f'http://127.0.0.1:{args.port}'
+
+    print(f"{'agents':>6} {'checks/s':>9} {'per agent':>10} {'ceiling':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.agents:
+            path = os.path.join(directory, f'agents-{count}.db')
+            seed(path, args.services, target_port)
+            env = dict(
+                os.environ,
+                MONITOR_DATABASE_PATH=path,
+                MONITOR_REMOTE_PROBES='1',
+                MONITOR_FREQUENCY_UNIT='1',
+                MONITOR_MIN_INTERVAL='1',
+                # Every service shares the one local target host
+                MONITOR_HTTP_POOL_PER_HOST=str(args.concurrency),
+            )
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(args.port),
+                 '--log-level', 'warning'],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            agents = []
+            try:
+                wait_for(f'{server_url}/api/health')
+                agents = [
+                    subprocess.Popen(
+                        [sys.executable, '-m', 'app.agent', '--server', server_url,
+                         '--id', f'bench-{i}', '--concurrency', str(args.concurrency)],
+                        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    )
+                    for i in range(count)
+                ]
+                # Let agents connect and the backlog of initially due services drain
+                time.sleep(3)
+                started = now_ms()
+                time.sleep(args.duration)
+                rate = count_checks(path, started) / args.duration
+            finally:
+                for process in agents + [server]:
+                    process.terminate()
+                for process in agents + [server]:
+                    process.wait()
+            ceiling = min(args.services, count * args.concurrency / args.delay)
+            print(f"{count:>6} {rate:>9.0f} {rate / count:>10.0f} {ceiling:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
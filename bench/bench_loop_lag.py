@@ -0,0 +1,118 @@
+"""Event loop responsiveness while the API serves logins and metric queries.
+
+    python bench/bench_loop_lag.py --logins 20 --services 200
+
+Runs the API in-process and fires concurrent /api/token logins (bcrypt)
+and uncached /api/service_metrics requests while a probe task measures
+how late a 10 ms timer fires. Database work and password hashing run on
+worker pools, so the probe's lag should stay in the low milliseconds
+however long the requests themselves take.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import httpx
+from fastapi import FastAPI
+
+from app.auth import init_auth_db, create_default_admin
+from app.cache import response_cache
+from app.dal import close_connections
+from app.database import init_db, get_db, now_ms, run_check_hooks
+from app.routes import router
+from app.writer import INSERT_CHECK_SQL
+
+PROBE_INTERVAL = 0.01
+
+
+def seed(path, services, checks_per_service):
+    init_db(path)
+    init_auth_db(path)
+    now = now_ms()
+    conn = get_db()
+    with conn:
+        conn.executemany('''
+            INSERT INTO services
+            (name, type, target, check_frequency, retry_threshold, grace_period, alert_email)
+            VALUES (?, 'http', ?, 1, 3, 5, 'ops@example.com')
+        ''', [(f'service-{i}', f'http://127.0.0.1/{i}') for i in range(services)])
+        rows = [
+            (service_id, now - step * 1_000, 'up' if step % 9 else 'down', 0.05, '{}')
+            for service_id in range(1, services + 1)
+            for step in range(checks_per_service)
+        ]
+        conn.executemany(INSERT_CHECK_SQL, rows)
+        run_check_hooks(conn, rows)
+    conn.close()
+
+
+async def probe(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((loop.time() - started - PROBE_INTERVAL) * 1000)
+
+
+async def run(args):
+    app = FastAPI()
+    app.include_router(router, prefix='/api')
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def login():
+            response = await client.post('/api/token', data={'username': 'admin', 'password': 'admin'})
+            assert response.status_code == 200
+
+        async def query(i):
+            # One request per service, so every query misses the response cache
+            response = await client.get(f'/api/service_metrics/{i + 1}/hour')
+            assert response.status_code == 200
+
+        # Open the pooled and cache connections before measuring
+        await client.get('/api/services/')
+
+        lags = []
+        stop = asyncio.Event()
+        prober = asyncio.create_task(probe(lags, stop))
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(login() for _ in range(args.logins)),
+            *(query(i) for i in range(args.queries)),
+        )
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await prober
+
+    lags.sort()
+    print(f"requests   {args.logins + args.queries} in {elapsed:.2f}s")
+    print(f"loop lag   p50 {statistics.median(lags):.2f} ms  "
+          f"p99 {lags[int(len(lags) * 0.99)]:.2f} ms  max {lags[-1]:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--services', type=int, default=200, help='one metrics query per service')
+    parser.add_argument('--checks', type=int, default=1800, help='checks seeded per service')
+    parser.add_argument('--logins', type=int, default=20)
+    args = parser.parse_args()
+    args.queries = args.services
+
+    with tempfile.TemporaryDirectory() as directory:
+        seed(os.path.join(directory, 'bench.db'), args.services, args.checks)
+        asyncio.run(create_default_admin())
+        try:
+            asyncio.run(run(args))
+        finally:
+            close_connections()
+            response_cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Latency of the service listing endpoints as the number of services grows.
+
+    python bench/bench_status.py --services 100 1000 2000 --checks 100
+
+Seeds a throwaway database per size and prints the median and p99 latency
+of /api/services/ and /api/status_with_history. Both endpoints use a
+constant number of queries, so latency should grow with the size of the
+response only, not with one query round trip per service.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.cache import response_cache
+from app.dal import close_connections
+from app.database import init_db, get_db, now_ms, run_check_hooks
+from app.routes import router
+from app.writer import INSERT_CHECK_SQL
+
+ENDPOINTS = ['/api/services/', '/api/status_with_history']
+
+
+def seed(path, services, checks_per_service):
+    init_db(path)
+    now = now_ms()
+    conn = get_db()
+    with conn:
+        conn.executemany('''
+            INSERT INTO services
+            (name, type, target, check_frequency, retry_threshold, grace_period, alert_email)
+            VALUES (?, 'http', ?, 1, 3, 5, 'ops@example.com')
+        ''', [(f'service-{i}', f'http://127.0.0.1/{i}') for i in range(services)])
+        for step in range(checks_per_service):
+            timestamp = now - (checks_per_service - step) * 60_000
+            rows = [
+                (service_id, timestamp, 'up' if (service_id + step) % 7 else 'down', 0.05, '{}')
+                for service_id in range(1, services + 1)
+            ]
+            conn.executemany(INSERT_CHECK_SQL, rows)
+            run_check_hooks(conn, rows)
+    conn.close()
+
+
+def measure(client, path, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--services', type=int, nargs='+', default=[100, 1000, 2000])
+    parser.add_argument('--checks', type=int, default=100, help='checks seeded per service')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = FastAPI()
+    app.include_router(router, prefix='/api')
+    client = TestClient(app)
+
+    print(f"{'services':>8}  {'endpoint':<26} {'p50 ms':>8} {'p99 ms':>8} {'ms/svc':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.services:
+            seed(os.path.join(directory, f'bench-{count}.db'), count, args.checks)
+            # Pooled and cache connections still point at the previous database
+            close_connections()
+            response_cache.close()
+            for path in ENDPOINTS:
+                p50, p99 = measure(client, path, args.repeat)
+                print(f"{count:>8}  {path:<26} {p50:>8.1f} {p99:>8.1f} {p50 / count:>8.4f}")
+
+
+if __name__ == '__main__':
+    main()
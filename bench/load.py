@@ -0,0 +1,334 @@
+"""Load benchmark for the monitor and API, with results to compare between commits.
+
+    python bench/load.py run --services 1000 10000 --output results.json
+    python bench/load.py compare before.json after.json
+
+``run`` starts a farm of fake HTTP targets (configurable latency, error
+rate and hang rate), seeds a throwaway database with N services, starts
+the real server against it and lets it monitor the farm. For each size it
+records:
+
+- completed checks per second and database rows per second
+- scheduler drift (lag between due and start time, mean and p99)
+- client-side p50/p99 latency of /status_with_history and /service_metrics
+  while the monitor is under load
+- peak resident memory of the server process
+
+Results are written as JSON together with the commit they were measured
+on; ``compare`` prints the relative change of every metric.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# Metrics where a larger value is an improvement; everything else is a cost.
+HIGHER_IS_BETTER = {'checks_per_second', 'db_rows_per_second'}
+# Derived from the parameters, not measured.
+NOT_COMPARED = {'services', 'expected_checks_per_second'}
+HANG_SECONDS = 3600
+
+
+def serve_farm(args):
+    """Fake targets: one aiohttp server per port in this process."""
+    from aiohttp import web
+
+    rng = random.Random(args.seed)
+
+    async def handle(request):
+        roll = rng.random()
+        if roll < args.hang_rate:
+            await asyncio.sleep(HANG_SECONDS)
+        await asyncio.sleep(args.latency * rng.uniform(0.5, 1.5))
+        if roll < args.hang_rate + args.error_rate:
+            return web.Response(status=500, text='error')
+        return web.Response(text='ok')
+
+    async def main():
+        for port in range(args.port, args.port + args.targets):
+            app = web.Application()
+            app.router.add_get('/{tail:.*}', handle)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', port, backlog=4096).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def seed(path, services, farm_port, targets):
+    from app.database import init_db
+
+    init_db(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany('''
+            INSERT INTO services
+            (name, type, target, check_frequency, retry_threshold, grace_period, alert_email)
+            VALUES (?, 'http', ?, 1, 3, 5, 'ops@example.com')
+        ''', [
+            (f'service-{i}', f'http://127.0.0.1:{farm_port + i % targets}/{i}')
+            for i in range(services)
+        ])
+    conn.close()
+
+
+def http_get(url, timeout=30):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            http_get(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+_SAMPLE = re.compile(r'^([a-z_]+)(?:\{([^}]*)\})? (\S+)$')
+
+
+def scrape(url):
+    """Histogram buckets and sums from /api/metrics, keyed by series name."""
+    samples = {}
+    for line in http_get(url).decode().splitlines():
+        match = _SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[(name, labels or '')] = float(value)
+    return samples
+
+
+def histogram_delta(before, after, name):
+    buckets = []
+    for (series, labels), value in after.items():
+        if series == f'{name}_bucket':
+            bound = float(re.search(r'le="([^"]+)"', labels).group(1).replace('+Inf', 'inf'))
+            buckets.append((bound, value - before.get((series, labels), 0)))
+    buckets.sort()
+    count = after.get((f'{name}_count', ''), 0) - before.get((f'{name}_count', ''), 0)
+    total = after.get((f'{name}_sum', ''), 0) - before.get((f'{name}_sum', ''), 0)
+    return buckets, count, total
+
+
+def histogram_quantile(buckets, count, q):
+    """Upper bound of the bucket holding quantile ``q``."""
+    for bound, cumulative in buckets:
+        if count and cumulative >= q * count:
+            return bound
+    return 0.0
+
+
+def count_checks(path, since_ms, until_ms):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            'SELECT COUNT(*) FROM checks WHERE timestamp >= ? AND timestamp < ?', (since_ms, until_ms)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def api_latency(url, requests_count):
+    samples = []
+    for _ in range(requests_count):
+        started = time.perf_counter()
+        http_get(url)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def run_scenario(args, services, directory):
+    path = os.path.join(directory, f'load-{services}.db')
+    seed(path, services, args.farm_port, args.targets)
+    env = dict(
+        os.environ,
+        MONITOR_DATABASE_PATH=path,
+        MONITOR_FREQUENCY_UNIT=str(args.interval),
+        MONITOR_MIN_INTERVAL='0',
+        MONITOR_CHECK_DEADLINE=str(args.deadline),
+        MONITOR_MAX_CONCURRENCY=str(args.concurrency),
+        MONITOR_HTTP_POOL_PER_HOST=str(args.concurrency),
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(args.port), '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f'http://127.0.0.1:{args.port}/api'
+    try:
+        wait_for(f'{base}/health')
+        # New services are spread over their first interval
+        time.sleep(args.interval)
+
+        before = scrape(f'{base}/metrics')
+        started_ms = int(time.time() * 1000)
+        started = time.perf_counter()
+        status_p50, status_p99 = api_latency(f'{base}/status_with_history', args.api_requests)
+        metrics_p50, metrics_p99 = api_latency(
+            f'{base}/service_metrics/{random.randint(1, services)}/day', args.api_requests
+        )
+        remaining = args.duration - (time.perf_counter() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+        elapsed = time.perf_counter() - started
+        ended_ms = int(time.time() * 1000)
+        after = scrape(f'{base}/metrics')
+
+        # Let the writer flush what was checked inside the window
+        time.sleep(1)
+        checks = count_checks(path, started_ms, ended_ms)
+        lag_buckets, lag_count, lag_sum = histogram_delta(before, after, 'monitor_scheduler_lag_seconds')
+        _, _, rows = histogram_delta(before, after, 'monitor_db_batch_rows')
+        return {
+            'services': services,
+            'checks_per_second': round(checks / elapsed, 1),
+            'expected_checks_per_second': round(services / args.interval, 1),
+            'db_rows_per_second': round(rows / elapsed, 1),
+            'scheduler_lag_mean_ms': round(lag_sum / lag_count * 1000, 2) if lag_count else 0.0,
+            'scheduler_lag_p99_ms': histogram_quantile(lag_buckets, lag_count, 0.99) * 1000,
+            'status_with_history_p50_ms': round(status_p50, 2),
+            'status_with_history_p99_ms': round(status_p99, 2),
+            'service_metrics_p50_ms': round(metrics_p50, 2),
+            'service_metrics_p99_ms': round(metrics_p99, 2),
+            'server_peak_rss_mb': peak_rss_mb(server.pid),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    farm = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), 'farm',
+        '--port', str(args.farm_port), '--targets', str(args.targets),
+        '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+        '--hang-rate', str(args.hang_rate), '--seed', str(args.seed),
+    ])
+    scenarios = []
+    try:
+        wait_for(f'http://127.0.0.1:{args.farm_port}/ready')
+        with tempfile.TemporaryDirectory() as directory:
+            for services in args.services:
+                result = run_scenario(args, services, directory)
+                scenarios.append(result)
+                print(json.dumps(result))
+    finally:
+        farm.terminate()
+        farm.wait()
+
+    report = {
+        'commit': git_commit(),
+        'measured_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {
+            key: getattr(args, key)
+            for key in ('interval', 'duration', 'targets', 'latency', 'error_rate',
+                        'hang_rate', 'deadline', 'concurrency', 'api_requests', 'seed')
+        },
+        'scenarios': scenarios,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f"Wrote {args.output}")
+
+
+def compare(args):
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print(f"before {before.get('commit')}\nafter  {after.get('commit')}")
+    previous = {scenario['services']: scenario for scenario in before['scenarios']}
+    for scenario in after['scenarios']:
+        old = previous.get(scenario['services'])
+        if old is None:
+            continue
+        print(f"\n{scenario['services']} services")
+        for key, value in scenario.items():
+            if key in NOT_COMPARED or not isinstance(value, (int, float)) or not old.get(key):
+                continue
+            change = (value - old[key]) / old[key] * 100
+            worse = change < 0 if key in HIGHER_IS_BETTER else change > 0
+            flag = '  <- regression' if worse and abs(change) >= args.threshold else ''
+            print(f"  {key:<30} {old[key]:>10} {value:>10} {change:>+8.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the load scenarios')
+    run_parser.add_argument('--services', type=int, nargs='+', default=[1000, 10000])
+    run_parser.add_argument('--interval', type=float, default=10, help='check interval, seconds')
+    run_parser.add_argument('--duration', type=float, default=30, help='measurement window, seconds')
+    run_parser.add_argument('--targets', type=int, default=4, help='fake target servers')
+    run_parser.add_argument('--latency', type=float, default=0.05, help='mean target latency, seconds')
+    run_parser.add_argument('--error-rate', type=float, default=0.02)
+    run_parser.add_argument('--hang-rate', type=float, default=0.01)
+    run_parser.add_argument('--deadline', type=float, default=5, help='per-check deadline, seconds')
+    run_parser.add_argument('--concurrency', type=int, default=500)
+    run_parser.add_argument('--api-requests', type=int, default=100)
+    run_parser.add_argument('--port', type=int, default=8780)
+    run_parser.add_argument('--farm-port', type=int, default=8800)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output', help='write results as JSON')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10,
+                                help='flag changes for the worse above this percentage')
+    compare_parser.set_defaults(handler=compare)
+
+    farm_parser = commands.add_parser('farm', help=argparse.SUPPRESS)
+    farm_parser.add_argument('--port', type=int, required=True)
+    farm_parser.add_argument('--targets', type=int, default=4)
+    farm_parser.add_argument('--latency', type=float, default=0.05)
+    farm_parser.add_argument('--error-rate', type=float, default=0.0)
+    farm_parser.add_argument('--hang-rate', type=float, default=0.0)
+    farm_parser.add_argument('--seed', type=int, default=1)
+    farm_parser.set_defaults(handler=serve_farm)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@
 
 # Function to start the application
 start_app() {
-    uvicorn main:app --host 0.0.0.0 --port 8000 --workers 2
+    uvicorn main:app --host 0.0.0.0 --port 8000 --workers ${WORKERS:-2}
 }
 
 # Main loop for self-healing
@@ -2,11 +2,14 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 import os
+import asyncio
 
 from app.routes import router
-from app.database import init_db
+from app.database import init_db, migrate_legacy_tables
 from app.auth import init_auth_db, create_default_admin
-from app.monitor import start_monitoring
+from app.monitor import start_monitoring, stop_monitoring
+from app.cache import response_cache
+from app.dal import close_connections
 
 app = FastAPI()
 
@@ -14,15 +17,23 @@ app = FastAPI()
 os.makedirs("/app/data", exist_ok=True)
 
 # Update database path
-DATABASE_PATH = "/app/data/monitor.db"
+DATABASE_PATH = os.environ.get("MONITOR_DATABASE_PATH", "/app/data/monitor.db")
 
 @app.on_event("startup")
 async def startup_event():
     init_db(DATABASE_PATH)
     init_auth_db(DATABASE_PATH)
     await create_default_admin()
+    # Converts history from older schema versions without blocking startup
+    app.state.migration_task = asyncio.create_task(migrate_legacy_tables())
     await start_monitoring()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_monitoring()
+    response_cache.close()
+    close_connections()
+
 @app.get("/")
 async def read_root():
     return FileResponse("static/status.html")
@@ -0,0 +1,51 @@
+"""Bad rows in a bulk import are reported per line, never as a server error."""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app import dal, database
+from app.auth import create_access_token
+from app.routes import router
+
+HEADER = 'name,type,target,check_frequency,retry_threshold,grace_period,alert_email'
+# Past the csv module's default field size limit of 131072
+HUGE_FIELD = '"' + 'x' * 200_000 + '"'
+
+
+@pytest.fixture
+def post_import(tmp_path):
+    database.init_db(str(tmp_path / 'monitor.db'))
+    app = FastAPI()
+    app.include_router(router, prefix='/api')
+    headers = {'Authorization': f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+    async def post(body):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.post('/api/services/import?format=csv', content=body, headers=headers)
+
+    yield lambda body: asyncio.run(post(body))
+    dal.close_connections()
+
+
+def service_row(name):
+    return f'{name},http,http://{name}.example.com/,60,3,0,ops@example.com'
+
+
+def test_oversized_csv_field_is_a_row_error(post_import):
+    body = '\n'.join([HEADER, service_row('a'), f'{HUGE_FIELD},http,x,60,3,0,ops@example.com',
+                      service_row('b')])
+    response = post_import(body)
+    assert response.status_code == 200
+    report = response.json()
+    assert (report['inserted'], report['error_count']) == (2, 1)
+    assert report['errors'][0]['line'] == 3
+    assert 'field larger than field limit' in report['errors'][0]['error']
+
+
+def test_unparseable_csv_header_is_rejected(post_import):
+    response = post_import('\n'.join([HUGE_FIELD + ',type', service_row('a')]))
+    assert response.status_code == 400
+    assert 'CSV header' in response.json()['detail']
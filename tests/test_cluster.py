@@ -0,0 +1,47 @@
+"""A joining worker only starts checking once its peers have seen it."""
+import asyncio
+
+from app import dal, database
+from app.cluster import Cluster
+
+
+def run(scenario, tmp_path):
+    database.init_db(str(tmp_path / 'monitor.db'))
+    try:
+        return asyncio.run(scenario())
+    finally:
+        dal.close_connections()
+
+
+def test_settle_waits_for_peers_to_see_the_new_worker(tmp_path):
+    async def scenario():
+        first = Cluster('worker-a', ttl=5, interval=0.3)
+        await first.settle()
+        assert first.workers == ['worker-a']
+        heartbeats = asyncio.create_task(first.run(lambda: None))
+        try:
+            await asyncio.sleep(0.05)
+            joining = Cluster('worker-b', ttl=5, interval=0.3)
+            await joining.settle()
+            await asyncio.sleep(0.01)
+            return first.workers, joining.workers
+        finally:
+            heartbeats.cancel()
+
+    seen_by_first, seen_by_joining = run(scenario, tmp_path)
+    assert seen_by_first == seen_by_joining == ['worker-a', 'worker-b']
+
+
+def test_settle_stops_waiting_for_a_dead_peer(tmp_path):
+    async def scenario():
+        conn = database.get_db()
+        with conn:
+            stale = database.now_ms() - 500
+            conn.execute('INSERT INTO monitor_workers (worker_id, started, heartbeat) VALUES (?, ?, ?)',
+                         ('worker-dead', stale, stale))
+        conn.close()
+        joining = Cluster('worker-b', ttl=1, interval=0.3)
+        await asyncio.wait_for(joining.settle(), 3)
+        return joining.workers
+
+    assert run(scenario, tmp_path) == ['worker-b']
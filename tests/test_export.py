@@ -0,0 +1,68 @@
+"""History exports cover archived checks exactly as if they were still live."""
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app import archive, dal, database
+from app.routes import router
+
+DAY_MS = archive.DAY_MS
+DETAILS = ['{"status_code": 200, "phases": [0.01, 0.02]}', 'connection refused', None]
+
+
+@pytest.fixture
+def export(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    database.init_db(str(tmp_path / 'monitor.db'))
+    app = FastAPI()
+    app.include_router(router, prefix='/api')
+
+    async def get(query):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            response = await client.get(f'/api/export/checks?{query}')
+            assert response.status_code == 200
+            return response.text
+
+    yield lambda query: asyncio.run(get(query))
+    dal.close_connections()
+
+
+def seed(now):
+    today = now - now % DAY_MS
+    conn = database.get_db()
+    with conn:
+        conn.executemany(
+            'INSERT INTO checks (service_id, timestamp, status, response_time, details) VALUES (?, ?, ?, ?, ?)',
+            ((1 + i % 3, today - 40 * DAY_MS + i * 3_600_000 + i % 3, 'up' if i % 4 else 'down',
+              None if i % 5 == 0 else 0.05 + i % 7 / 100, DETAILS[i % 3])
+             for i in range(24 * 38)),
+        )
+    conn.close()
+    return today
+
+
+QUERIES = ['format=ndjson', 'format=csv', 'format=ndjson&service_id=2&service_id=1',
+           'format=csv&service_id=3', 'format=ndjson&gzip=false&start={start}&end={end}']
+
+
+def test_export_reads_archived_checks(export):
+    now = database.now_ms()
+    today = seed(now)
+    queries = [query.format(start=today - 35 * DAY_MS + 5, end=today - DAY_MS) for query in QUERIES]
+    before = [export(query) for query in queries]
+
+    archived = asyncio.run(archive.archive_checks(today - 7 * DAY_MS))
+    assert archived > 24 * 30
+    assert archive.archived_days(0, now + 1)
+
+    after = [export(query) for query in queries]
+    for query, expected, actual in zip(queries, before, after):
+        assert actual == expected, query
+    lines = after[0].splitlines()
+    assert len(lines) == 24 * 38
+    timestamps = [json.loads(line)['timestamp'] for line in lines]
+    assert timestamps == sorted(timestamps)
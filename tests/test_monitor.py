@@ -0,0 +1,47 @@
+"""A check that hangs must still be recorded as down, never dropped."""
+import asyncio
+import sqlite3
+
+from app import dal, database, monitor, state
+from app.scheduler import CheckScheduler
+
+
+def test_probe_gives_up_before_the_scheduler():
+    assert monitor.PROBE_DEADLINE < monitor.CHECK_DEADLINE
+
+
+def test_hung_target_records_down_for_every_member(tmp_path, monkeypatch):
+    path = str(tmp_path / 'monitor.db')
+    database.init_db(path)
+    services = [
+        (service_id, f'web{service_id}', 'http', 'http://hung.example.com/', 1, 3, 0, 'ops@example.com')
+        for service_id in (1, 2)
+    ]
+    conn = database.get_db()
+    with conn:
+        conn.executemany('INSERT INTO services VALUES (?, ?, ?, ?, ?, ?, ?, ?)', services)
+    conn.close()
+
+    async def hang(type_, target):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(monitor, 'run_check', hang)
+    monkeypatch.setattr(monitor, 'PROBE_DEADLINE', 0.3)
+
+    async def scenario():
+        group, = monitor.group_services(services)
+        scheduler = CheckScheduler(monitor.monitor_group, lambda group: 60, check_timeout=0.5)
+        await scheduler._execute(group, 0.0, 60, 60)
+        return scheduler.checks_timed_out
+
+    try:
+        assert asyncio.run(scenario()) == 0
+    finally:
+        dal.close_connections()
+        state.prune_service_states([])
+
+    conn = sqlite3.connect(path)
+    rows = conn.execute('SELECT service_id, status, details FROM checks ORDER BY service_id').fetchall()
+    conn.close()
+    assert [(service_id, status) for service_id, status, _ in rows] == [(1, 'down'), (2, 'down')]
+    assert all('check timed out' in details for _, _, details in rows)
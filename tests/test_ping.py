@@ -0,0 +1,67 @@
+"""AsyncPinger against loopback; skipped where ICMP sockets are not permitted."""
+import asyncio
+import time
+
+import pytest
+
+from app.ping import AsyncPinger, ICMP_ECHO_REQUEST, _checksum, build_echo_request
+
+
+def run_with_pinger(scenario):
+    async def main():
+        pinger = AsyncPinger()
+        try:
+            pinger.open()
+        except (PermissionError, OSError) as e:
+            pytest.skip(f"ICMP sockets not permitted: {e}")
+        try:
+            return await scenario(pinger)
+        finally:
+            pinger.close()
+    return asyncio.run(main())
+
+
+def test_echo_request_checksum():
+    packet = build_echo_request(0x1234, 7, b'payload')
+    assert packet[0] == ICMP_ECHO_REQUEST
+    # A packet including its checksum sums to zero
+    assert _checksum(packet) == 0
+
+
+def test_ping_loopback():
+    rtt = run_with_pinger(lambda pinger: pinger.ping('127.0.0.1', timeout=2))
+    assert rtt is not None and 0 <= rtt < 2
+
+
+def test_concurrent_pings_share_one_socket():
+    async def scenario(pinger):
+        return await asyncio.gather(*(pinger.ping('127.0.0.1', timeout=2) for _ in range(50)))
+
+    results = run_with_pinger(scenario)
+    assert all(rtt is not None for rtt in results)
+
+
+def test_unanswered_pings_do_not_block_the_loop():
+    async def scenario(pinger):
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        try:
+            # TEST-NET-1 should never answer, though some sandboxes do
+            results = await asyncio.gather(*(pinger.ping('192.0.2.1', timeout=0.5) for _ in range(10)))
+        finally:
+            task.cancel()
+        ticks.append(time.perf_counter())
+        return results, time.perf_counter() - started, max(b - a for a, b in zip(ticks, ticks[1:]))
+
+    results, elapsed, longest_gap = run_with_pinger(scenario)
+    assert all(rtt is None or rtt < 0.5 for rtt in results)
+    # Ten timeouts run side by side rather than one after another
+    assert elapsed < 1.5
+    assert longest_gap < 0.2
@@ -0,0 +1,49 @@
+"""Agent result batches drive alert state the same way local checks do."""
+import asyncio
+
+from app import dal, database, monitor, probes, state, writer
+from app.cluster import cluster
+
+SERVICE = (1, 'web', 'http', 'http://web.example.com/', 1, 3, 5, 'ops@example.com')
+
+
+def test_batched_failures_alert_once_with_several_workers(tmp_path, monkeypatch):
+    database.init_db(str(tmp_path / 'monitor.db'))
+    conn = database.get_db()
+    with conn:
+        conn.execute('INSERT INTO services VALUES (?, ?, ?, ?, ?, ?, ?, ?)', SERVICE)
+    conn.close()
+
+    alerts = []
+
+    async def send_alert(email, name, status):
+        alerts.append(status)
+
+    monkeypatch.setattr(monitor, 'send_alert', send_alert)
+    # Another worker may have recorded this service's earlier results
+    monkeypatch.setattr(cluster, 'workers', [cluster.worker_id, 'other-worker'])
+
+    now = database.now_ms()
+    # Out of order, as an agent may send them; the up check is the oldest
+    results = [[1, now - 1000, False, None, {}], [1, now - 3000, True, 0.1, {}],
+               [1, now - 2000, False, None, {}], [1, now, False, None, {}]]
+
+    async def scenario():
+        # Rows stay queued in the batch writer while the batch is applied
+        await writer.start_writer()
+        try:
+            return await probes.ingest_results('agent', {1: SERVICE}, results)
+        finally:
+            await writer.stop_writer()
+
+    try:
+        assert asyncio.run(scenario()) == 4
+    finally:
+        dal.close_connections()
+        state.prune_service_states([])
+
+    assert alerts == ['down']
+    conn = database.get_db()
+    statuses = [row[0] for row in conn.execute('SELECT status FROM checks ORDER BY timestamp')]
+    conn.close()
+    assert statuses == ['up', 'down', 'down', 'down']
@@ -0,0 +1,47 @@
+"""The hot history queries must stay index searches, not table scans."""
+import sqlite3
+
+import pytest
+
+from app import database
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = str(tmp_path / 'monitor.db')
+    database.init_db(path)
+    conn = sqlite3.connect(path)
+    yield conn
+    conn.close()
+
+
+def query_plan(conn, sql, params=()):
+    return ' | '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+
+
+@pytest.mark.parametrize('sql, params, index', [
+    # Recent history of one service (state.load_service_state)
+    ('SELECT timestamp, status FROM checks WHERE service_id = ? ORDER BY timestamp DESC LIMIT ?',
+     (1, 100), 'idx_checks_service_timestamp'),
+    # Metrics range scans (routes._raw_rows)
+    ('SELECT id, timestamp, status FROM checks WHERE service_id = ? AND timestamp >= ? AND timestamp < ? '
+     'ORDER BY timestamp', (1, 0, 1), 'idx_checks_service_timestamp'),
+    # Latest alert per service (state.load_service_state)
+    ('SELECT MAX(timestamp) FROM alerts WHERE service_id = ?', (1,), 'idx_alerts_service_timestamp'),
+    # Exports and retention walk checks and alerts by time
+    ('SELECT id FROM checks WHERE timestamp < ? LIMIT ?', (1, 10), 'idx_checks_timestamp'),
+    ('SELECT id FROM alerts WHERE (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?',
+     (0, -1, 10), 'idx_alerts_timestamp'),
+])
+def test_history_queries_use_indexes(conn, sql, params, index):
+    plan = query_plan(conn, sql, params)
+    assert index in plan, plan
+    assert 'SCAN checks' not in plan and 'SCAN alerts' not in plan, plan
+
+
+def test_rollup_reads_use_primary_key(conn):
+    plan = query_plan(conn, '''
+        SELECT bucket, count FROM check_rollups
+        WHERE service_id = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+    ''', (1, 60_000, 0, 1))
+    assert 'SEARCH check_rollups USING PRIMARY KEY' in plan, plan
@@ -0,0 +1,86 @@
+"""Heavy requests must not stall the event loop that runs checks and other requests."""
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app import dal, database
+from app.auth import create_default_admin, init_auth_db
+from app.cache import response_cache
+from app.routes import router
+
+CHECKS = 40_000
+# Worst stall tolerated between two ticks of a 5 ms timer
+MAX_LOOP_LAG = 0.5
+
+
+def seed(path):
+    database.init_db(path)
+    init_auth_db(path)
+    now = database.now_ms()
+    conn = database.get_db()
+    with conn:
+        conn.execute('''INSERT INTO services (id, name, type, target, check_frequency,
+                        retry_threshold, grace_period, alert_email)
+                        VALUES (1, 'web', 'http', 'http://127.0.0.1/', 60, 3, 0, 'ops@example.com')''')
+        conn.executemany(
+            'INSERT INTO checks (service_id, timestamp, status, response_time, details) VALUES (1, ?, ?, ?, NULL)',
+            ((now - 3_500_000 + i * 80, 'up' if i % 50 else 'down', 0.05 + i % 7 / 100) for i in range(CHECKS)),
+        )
+    conn.close()
+
+
+async def measure_loop_lag(requests):
+    """Serve ``requests`` concurrently and return the longest gap between timer ticks."""
+    app = FastAPI()
+    app.include_router(router, prefix='/api')
+    await create_default_admin()
+
+    gaps = []
+    done = asyncio.Event()
+
+    async def ticker():
+        last = time.monotonic()
+        while not done.is_set():
+            await asyncio.sleep(0.005)
+            now = time.monotonic()
+            gaps.append(now - last)
+            last = now
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        # First requests pay one-off imports and route setup on the loop
+        for request in set(requests):
+            await request(client)
+        response_cache.close()
+
+        tick = asyncio.create_task(ticker())
+        try:
+            responses = await asyncio.gather(*(request(client) for request in requests))
+        finally:
+            done.set()
+            await tick
+    return max(gaps), responses
+
+
+def test_loop_stays_responsive_under_heavy_requests(tmp_path):
+    seed(str(tmp_path / 'monitor.db'))
+
+    def metrics(max_points):
+        # Distinct max_points keep every request a cache miss
+        return lambda client: client.get(f'/api/service_metrics/1/hour?max_points={max_points}')
+
+    def login(client):
+        return client.post('/api/token', data={'username': 'admin', 'password': 'admin'})
+
+    requests = [metrics(100 + i) for i in range(4)] + [login] * 8
+    try:
+        lag, responses = asyncio.run(measure_loop_lag(requests))
+    finally:
+        response_cache.close()
+        dal.close_connections()
+
+    assert [response.status_code for response in responses] == [200] * len(requests)
+    assert len(responses[0].json()['timestamps']) <= 100
+    assert lag < MAX_LOOP_LAG, f'event loop stalled for {lag:.3f}s'
@@ -0,0 +1,45 @@
+"""The next run follows the interval a check's own result sets."""
+import asyncio
+import time
+
+import pytest
+
+from app.scheduler import CheckScheduler
+
+
+def run_once(interval_after, during_check=None):
+    """Dispatch one check of a 10s service whose interval becomes ``interval_after``.
+
+    Returns the check's due time and the run queued after it.
+    """
+    intervals = {1: 10.0}
+
+    async def run_check(service):
+        intervals[1] = interval_after
+        if during_check:
+            during_check(scheduler)
+
+    async def scenario():
+        nonlocal scheduler
+        scheduler = CheckScheduler(run_check, lambda service: intervals[service[0]], jitter=0)
+        scheduler.upsert((1,))
+        due = time.monotonic()
+        scheduler._push(1, due)
+        scheduler._dispatch(due)
+        assert scheduler._due[1] == due + 10
+        await asyncio.gather(*scheduler._tasks)
+        return due, scheduler._due[1]
+
+    scheduler = None
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('interval_after', [40.0, 5.0, 10.0])
+def test_next_run_uses_interval_after_check(interval_after):
+    due, queued = run_once(interval_after)
+    assert queued == pytest.approx(due + interval_after)
+
+
+def test_expedite_during_check_is_kept():
+    due, queued = run_once(40.0, lambda scheduler: scheduler.expedite(1, 2.0))
+    assert queued == pytest.approx(due + 2.0, abs=0.5)